@@ -1,14 +1,176 @@
+import csv
 import json
+import math
 import os.path
+import re
 import socket
-from argparse import ArgumentParser, Namespace
-from typing import Any, List, Optional
+import string
+import sys
+from argparse import SUPPRESS, ArgumentParser, ArgumentTypeError, Namespace
+from datetime import datetime, timedelta
+from typing import IO, Any, Dict, Iterable, Iterator, List, Optional
 
-from prettytable import PrettyTable
+from alarmix.constants import (
+    DAEMON_LOG_FILE,
+    DAEMON_PID_FILE,
+    MAX_SNOOZE_MINUTES,
+    MIN_WATCH_TICK,
+    SNOOZE_MINUTES,
+    SOCKET_NAME,
+    RequestAction,
+    When,
+)
+from alarmix.exceptions import AlarmDaemonIsNotRunning, DaemonSpawnFailed, ProtocolError
+from alarmix.protocol import client_handshake, recv_frame, send_frame
 
-from alarmix.exceptions import AlarmDaemonIsNotRunning
-from alarmix.schema import InfoList, RequestAction, TimeMessageClient, When
-from alarmix.utils import SOCKET_NAME, parse_relative_time
+# alarmc is called from status bars many times,
+# so it doesn't import pydantic and other heavy modules
+# and prettytable is imported only to render a table.
+
+# Fields of imported and exported alarms, see `AlarmRecord`.
+RECORD_FIELDS = ["time", "when", "day", "rule"]
+RECORD_FORMATS = ["ndjson", "csv"]
+# Fields of the next alarm available in --format, see `AlarmInfo`.
+ALARM_FIELDS = ["time", "remaining", "when", "canceled"]
+# Lines printed by watch when --format isn't given.
+WATCH_FORMAT = "{time} {remaining}"
+# Number of alarms sent in one frame of an import request.
+IMPORT_CHUNK_SIZE = 500
+# Seconds to wait for the spawned daemon to start serving.
+SPAWN_TIMEOUT = 5.0
+# Spawned daemon exits after this number of seconds with nothing to do.
+SPAWN_EXIT_IDLE = 300
+
+
+def make_message(
+    action: RequestAction,
+    when: When = When.auto,
+    time_str: Optional[str] = None,
+    full_list: bool = False,
+    operations: Optional[List[Dict[str, Any]]] = None,
+    tick: Optional[float] = None,
+    profile: Optional[str] = None,
+    rule: Optional[str] = None,
+    day: Optional[str] = None,
+    minutes: Optional[float] = None,
+) -> Dict[str, Any]:
+    """
+    Build message with the same fields as `TimeMessageClient`.
+    """
+    message: Dict[str, Any] = {
+        "when": when.value,
+        "action": action.value,
+        "full_list": full_list,
+        "time": time_str,
+        "operations": operations or [],
+    }
+    if tick is not None:
+        message["tick"] = tick
+    if profile is not None:
+        message["profile"] = profile
+    if rule is not None:
+        message["rule"] = rule
+    if day is not None:
+        message["day"] = day
+    if minutes is not None:
+        message["minutes"] = minutes
+    return message
+
+
+def request_parts(
+    socket_addr: str,
+    message: Dict[str, Any],
+    upload: Optional[Iterable[bytes]] = None,
+) -> Iterator[str]:
+    """
+    Send request to alarm server and iterate over parts of its reply.
+    Frames of `upload` are sent right after the request.
+    """
+    if not os.path.exists(socket_addr):
+        raise AlarmDaemonIsNotRunning()
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(socket_addr)
+        except (ConnectionRefusedError, FileNotFoundError):
+            # Socket file was left by a daemon which was killed.
+            raise AlarmDaemonIsNotRunning()
+        client_handshake(sock)
+        send_frame(sock, json.dumps(message).encode("utf-8"))
+        if upload is not None:
+            for chunk in upload:
+                send_frame(sock, chunk)
+            send_frame(sock, b"")
+        while True:
+            frame = recv_frame(sock)
+            if frame is None:
+                return
+            yield frame.decode("utf-8")
+
+
+def spawn_daemon(socket_addr: str) -> None:
+    """
+    Start alarmd in background and wait until it serves the socket.
+    Spawned daemon exits by itself once it has nothing to do.
+
+    :raises DaemonSpawnFailed: if daemon exited without serving the socket.
+    :raises AlarmDaemonIsNotRunning: if daemon didn't start in time.
+    """
+    import subprocess
+    import time
+
+    # Daemonized process detaches, so the command returns at once.
+    # It changes directory to /, so relative sockets are resolved here.
+    launcher = subprocess.run(
+        [
+            sys.executable,
+            "-m",
+            "alarmix.daemon.main",
+            "--socket",
+            os.path.abspath(socket_addr),
+            "--exit-idle",
+            str(SPAWN_EXIT_IDLE),
+            "--daemonize",
+        ],
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+    )
+    # Launcher fails e.g. if another daemon holds the pid file.
+    failure = launcher.stdout.decode("utf-8", "replace").strip().rstrip(".")
+    if launcher.returncode != 0:
+        failure = f"it exited with status {launcher.returncode}: {failure}"
+    deadline = time.monotonic() + SPAWN_TIMEOUT
+    while time.monotonic() < deadline:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            try:
+                sock.connect(socket_addr)
+                return
+            except OSError:
+                pass
+        if not daemon_is_running(DAEMON_PID_FILE):
+            reason = f"it exited without serving {socket_addr}"
+            raise DaemonSpawnFailed(f"{reason}, see {DAEMON_LOG_FILE}")
+        time.sleep(0.01)
+    if launcher.returncode != 0:
+        # Maybe daemon of another socket, this one isn't served anyway.
+        raise DaemonSpawnFailed(failure)
+    raise AlarmDaemonIsNotRunning()
+
+
+def daemon_is_running(pid_file: str) -> bool:
+    """
+    Check whether anyone holds lock of the daemon pid file.
+    """
+    import fcntl
+
+    try:
+        with open(pid_file) as file:
+            fcntl.flock(file, fcntl.LOCK_SH | fcntl.LOCK_NB)
+    except FileNotFoundError:
+        return False
+    except OSError:
+        return True
+    return False
 
 
 def send_message(
@@ -17,24 +179,36 @@ def send_message(
     when: When = When.auto,
     time_str: Optional[str] = None,
     full_list: bool = False,
+    profile: Optional[str] = None,
+    minutes: Optional[float] = None,
 ) -> str:
     """
     Communicate with alarm server running on socket-file.
     """
-    if not os.path.exists(socket_addr):
-        raise AlarmDaemonIsNotRunning()
-    msg_obj = TimeMessageClient(
-        time=time_str, when=when, action=action, full_list=full_list
+    message = make_message(
+        action, when, time_str, full_list, profile=profile, minutes=minutes
     )
-    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
-        sock.connect(socket_addr)
-        msg = msg_obj.json().encode("utf-8")
-        sock.sendall(msg)
-        data = sock.recv(1024)
-        return data.decode("utf-8")
+    return "\n".join(request_parts(socket_addr, message))
+
+
+def fetch_alarms(
+    socket_addr: str,
+    full_list: bool,
+    profile: Optional[str] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Get alarms as dicts with the same fields as `AlarmInfo`.
+    """
+    message = make_message(RequestAction.list, full_list=full_list, profile=profile)
+    alarms = []
+    for part in request_parts(socket_addr, message):
+        alarms.extend(json.loads(part)["alarms"])
+    return alarms
 
 
 def render_table(field_names: List[str], alarms_info_list: List[List[Any]]) -> str:
+    from prettytable import PrettyTable
+
     table = PrettyTable(field_names=field_names)
     table.add_rows(alarms_info_list)
     return table.get_string()
@@ -54,26 +228,22 @@ def print_alarms(
     show_cancelled: bool,
     list_whens: bool,
     raw_table: bool,
+    profile: Optional[str] = None,
 ) -> str:
-    alarms_list_str = send_message(
-        socket_addr=socket_addr, action=RequestAction.list, full_list=full_list
-    )
-    alarms_list = InfoList(**json.loads(alarms_list_str))
-
     table_fields = ["alarm time", "remaining time"]
     if list_whens:
         table_fields.append("when")
     if show_cancelled:
         table_fields.append("cancelled")
     raw_rows = []
-    for alarm in alarms_list.alarms:
-        row = [str(alarm.time), alarm.remaining]
-        if alarm.canceled and not show_cancelled:
+    for alarm in fetch_alarms(socket_addr, full_list, profile):
+        row = [alarm["time"], alarm["remaining"]]
+        if alarm["canceled"] and not show_cancelled:
             continue
         if list_whens:
-            row.append(alarm.when)
+            row.append(alarm["when"])
         if show_cancelled:
-            row.append(alarm.canceled)
+            row.append(alarm["canceled"])
         raw_rows.append(row)
 
     if len(raw_rows) == 0:
@@ -85,6 +255,225 @@ def print_alarms(
         return render_table(table_fields, raw_rows)
 
 
+def format_next_alarm(alarms: List[Dict[str, Any]], format_str: str) -> str:
+    """
+    Format the nearest alarm which isn't cancelled.
+    Available fields are listed in ALARM_FIELDS.
+    """
+    for alarm in alarms:
+        if not alarm["canceled"]:
+            try:
+                return format_str.format(**alarm)
+            except (AttributeError, IndexError, TypeError, ValueError) as err:
+                # Fields are checked by `alarm_format`, but not their specs.
+                return f"Can't format alarm: {err}"
+    return "No alarms found"
+
+
+def print_next_alarm(
+    socket_addr: str,
+    full_list: bool,
+    format_str: str,
+    profile: Optional[str] = None,
+) -> str:
+    alarms = fetch_alarms(socket_addr, full_list, profile)
+    return format_next_alarm(alarms, format_str)
+
+
+def watch_alarms(
+    socket_addr: str,
+    full_list: bool,
+    format_str: str,
+    tick: float,
+    profile: Optional[str] = None,
+) -> None:
+    """
+    Print the next alarm every time daemon sends an update.
+    """
+    message = make_message(
+        RequestAction.watch, full_list=full_list, tick=tick, profile=profile
+    )
+    for part in request_parts(socket_addr, message):
+        alarms = json.loads(part)["alarms"]
+        print(format_next_alarm(alarms, format_str), flush=True)
+
+
+def print_stats(socket_addr: str, raw_table: bool) -> str:
+    """
+    Show daemon histograms with durations in milliseconds.
+    """
+    reply = json.loads(send_message(socket_addr, RequestAction.stats))
+    table_fields = ["metric", "count", "per second", "mean", "p50", "p99", "max"]
+    rows = []
+    for histogram in reply["histograms"]:
+        labels = ",".join(
+            f"{key}={value}" for key, value in histogram["labels"].items()
+        )
+        name = f"{histogram['name']}{{{labels}}}" if labels else histogram["name"]
+        count = histogram["count"]
+        rows.append(
+            [
+                name,
+                count,
+                f"{count / reply['uptime']:.3f}",
+                f"{histogram['sum'] / count * 1000:.3f}",
+                f"{histogram['p50'] * 1000:.3f}",
+                f"{histogram['p99'] * 1000:.3f}",
+                f"{histogram['max'] * 1000:.3f}",
+            ]
+        )
+    if not rows:
+        return "No stats collected yet"
+    if raw_table:
+        return render_raw(table_fields, rows)
+    return render_table(table_fields, rows)
+
+
+def record_format(path: str, file_format: Optional[str]) -> str:
+    """
+    Format of records file, guessed by extension if not set.
+    """
+    if file_format is not None:
+        return file_format
+    if path.lower().endswith(".csv"):
+        return "csv"
+    return "ndjson"
+
+
+def read_records(file: IO[str], file_format: str) -> Iterator[str]:
+    """
+    Read alarms as JSON lines, CSV rows are converted on the fly.
+    """
+    if file_format == "csv":
+        for row in csv.DictReader(file):
+            yield json.dumps({key: value for key, value in row.items() if value})
+        return
+    for line in file:
+        if line.strip():
+            yield line.strip()
+
+
+def chunk_records(records: Iterable[str]) -> Iterator[bytes]:
+    chunk: List[str] = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) == IMPORT_CHUNK_SIZE:
+            yield "\n".join(chunk).encode("utf-8")
+            chunk = []
+    if chunk:
+        yield "\n".join(chunk).encode("utf-8")
+
+
+def import_alarms(
+    socket_addr: str,
+    path: str,
+    file_format: Optional[str] = None,
+    profile: Optional[str] = None,
+) -> str:
+    """
+    Stream alarms from file to daemon, "-" reads them from stdin.
+    Daemon adds either all of them or none.
+    """
+    message = make_message(RequestAction.import_, profile=profile)
+    file_format = record_format(path, file_format)
+    if path == "-":
+        upload = chunk_records(read_records(sys.stdin, file_format))
+        return "\n".join(request_parts(socket_addr, message, upload))
+    with open(path, "r", encoding="utf-8", newline="") as file:
+        upload = chunk_records(read_records(file, file_format))
+        return "\n".join(request_parts(socket_addr, message, upload))
+
+
+def write_records(
+    socket_addr: str,
+    file: IO[str],
+    file_format: str,
+    profile: Optional[str] = None,
+) -> str:
+    """
+    Write alarms streamed by daemon.
+    Returns error sent by daemon instead of records if there's one.
+    """
+    message = make_message(RequestAction.export, profile=profile)
+    writer = csv.DictWriter(file, RECORD_FIELDS) if file_format == "csv" else None
+    if writer is not None:
+        writer.writeheader()
+    for part in request_parts(socket_addr, message):
+        if not part.startswith("{"):
+            return part
+        if writer is None:
+            file.write(f"{part}\n")
+            continue
+        for line in part.splitlines():
+            writer.writerow(json.loads(line))
+    return ""
+
+
+def export_alarms(
+    socket_addr: str,
+    path: str,
+    file_format: Optional[str] = None,
+    profile: Optional[str] = None,
+) -> str:
+    """
+    Save all alarms to file, "-" writes them to stdout.
+    """
+    file_format = record_format(path, file_format)
+    if path == "-":
+        return write_records(socket_addr, sys.stdout, file_format, profile)
+    with open(path, "w", encoding="utf-8", newline="") as file:
+        return write_records(socket_addr, file, file_format, profile)
+
+
+def watch_tick(value: str) -> float:
+    """
+    Parse --tick, daemon refuses to send updates more often.
+    """
+    try:
+        tick = float(value)
+    except ValueError:
+        raise ArgumentTypeError(f"invalid number: {value!r}")
+    if not math.isfinite(tick) or tick < MIN_WATCH_TICK:
+        raise ArgumentTypeError(f"must be at least {MIN_WATCH_TICK:g} second")
+    return tick
+
+
+def snooze_minutes(value: str) -> float:
+    """
+    Parse minutes of snooze, daemon refuses too long ones.
+    """
+    try:
+        minutes = float(value)
+    except ValueError:
+        raise ArgumentTypeError(f"invalid number: {value!r}")
+    if not 0 < minutes <= MAX_SNOOZE_MINUTES:
+        raise ArgumentTypeError(
+            f"must be more than 0 and at most {MAX_SNOOZE_MINUTES:g} minutes"
+        )
+    return minutes
+
+
+def alarm_format(value: str) -> str:
+    """
+    Parse --format, so unknown fields are reported before alarms are fetched.
+    """
+    try:
+        fields = [name for _, name, _, _ in string.Formatter().parse(value)]
+    except ValueError as err:
+        raise ArgumentTypeError(f"invalid format: {err}")
+    for name in fields:
+        if name is None:
+            continue
+        # Attributes and items of fields are allowed, e.g. {when[0]}.
+        field = re.split(r"[.\[]", name, maxsplit=1)[0]
+        if field not in ALARM_FIELDS:
+            available = ", ".join(f"{{{known}}}" for known in ALARM_FIELDS)
+            raise ArgumentTypeError(
+                f"unknown field {{{name}}}, available fields are {available}"
+            )
+    return value
+
+
 def parse_args() -> Namespace:
     arg_parse = ArgumentParser(
         description="Alarmd client written to interact with your alarms",
@@ -93,8 +482,55 @@ def parse_args() -> Namespace:
     subparsers = arg_parse.add_subparsers(dest="namespace")
     add_parser = subparsers.add_parser("add", help="Add new alarm")
     stop_parser = subparsers.add_parser("stop", help="Stop running alarm")
+    snooze_parser = subparsers.add_parser(
+        "snooze", help="Stop running alarm and play it again later"
+    )
+    snooze_parser.add_argument(
+        "minutes",
+        type=snooze_minutes,
+        nargs="?",
+        default=SNOOZE_MINUTES,
+        help="Play alarm again after this number of minutes",
+    )
     delete_parser = subparsers.add_parser("delete", help="Delete alarm from schedule")
     cancel_parser = subparsers.add_parser("cancel", help="Cancel alarm for today")
+    stats_parser = subparsers.add_parser(
+        "stats", help="Show daemon latency histograms in milliseconds"
+    )
+    stats_parser.add_argument(
+        "-r",
+        "--raw",
+        default=False,
+        dest="raw_table",
+        action="store_true",
+        help="Show raw data, instead of a formatted table",
+    )
+    watch_parser = subparsers.add_parser(
+        "watch", help="Print the next alarm every time the schedule changes"
+    )
+    # Defaults are set by options before the command.
+    watch_parser.add_argument(
+        "-f",
+        "--full",
+        default=SUPPRESS,
+        dest="full",
+        action="store_true",
+        help="Watch all existing alarms (not for today)",
+    )
+    watch_parser.add_argument(
+        "--format",
+        type=alarm_format,
+        default=SUPPRESS,
+        dest="format",
+        help=f"Format of printed lines, '{WATCH_FORMAT}' by default",
+    )
+    watch_parser.add_argument(
+        "-t",
+        "--tick",
+        type=watch_tick,
+        default=60,
+        help="Print update at least once in this number of seconds",
+    )
     arg_parse.add_argument(
         "-f",
         "--full",
@@ -119,6 +555,13 @@ def parse_args() -> Namespace:
         action="store_true",
         help="Show 'when' column in table",
     )
+    arg_parse.add_argument(
+        "--format",
+        type=alarm_format,
+        default=None,
+        dest="format",
+        help="Print only the next alarm using this format, e.g. '{time} {remaining}'",
+    )
     arg_parse.add_argument(
         "-r",
         "--raw",
@@ -127,14 +570,67 @@ def parse_args() -> Namespace:
         action="store_true",
         help="Show raw data, instead of a formatted table",
     )
-    for parser in (arg_parse, add_parser, stop_parser, delete_parser, cancel_parser):
+    import_parser = subparsers.add_parser(
+        "import", help="Add all alarms from NDJSON or CSV file at once"
+    )
+    import_parser.add_argument(
+        "file", type=str, help="File with alarms, '-' reads them from stdin"
+    )
+    export_parser = subparsers.add_parser(
+        "export", help="Save all alarms as NDJSON or CSV"
+    )
+    export_parser.add_argument(
+        "file",
+        type=str,
+        nargs="?",
+        default="-",
+        help="File to write alarms to, stdout by default",
+    )
+    for parser in (import_parser, export_parser):
+        parser.add_argument(
+            "-F",
+            "--file-format",
+            type=str,
+            default=None,
+            choices=RECORD_FORMATS,
+            help="Format of records, guessed by file extension by default",
+        )
+    for parser in (
+        arg_parse,
+        add_parser,
+        stop_parser,
+        snooze_parser,
+        delete_parser,
+        cancel_parser,
+        watch_parser,
+        stats_parser,
+        import_parser,
+        export_parser,
+    ):
+        # Options may go before or after the command, defaults are set
+        # only by the main parser, so commands don't override them.
+        top_level = parser is arg_parse
         parser.add_argument(
             "-s",
             "--socket",
             type=str,
-            default=SOCKET_NAME,
+            default=SOCKET_NAME if top_level else SUPPRESS,
             help="Socket path to communicate with daemon",
         )
+        parser.add_argument(
+            "--no-spawn",
+            default=False if top_level else SUPPRESS,
+            dest="no_spawn",
+            action="store_true",
+            help="Don't start daemon if it isn't running",
+        )
+        parser.add_argument(
+            "-P",
+            "--profile",
+            type=str,
+            default=None if top_level else SUPPRESS,
+            help="Alarm set to use, every user has the default one",
+        )
     for parser in (add_parser, delete_parser, cancel_parser):
         parser.add_argument(
             "time",
@@ -145,67 +641,180 @@ def parse_args() -> Namespace:
         parser.add_argument(
             "-W", "--when", default=When.auto, type=When, choices=list(When)
         )
+    for parser in (add_parser, delete_parser):
+        parser.add_argument(
+            "-D",
+            "--date",
+            type=str,
+            default=None,
+            dest="day",
+            help="Date of auto alarm in format YYYY-MM-DD, the nearest one by default",
+        )
+    add_parser.add_argument(
+        "-R",
+        "--rule",
+        type=str,
+        default=None,
+        help="Recurrence rule of custom alarm, e.g. 'mon,wed,fri' "
+        "or 'every 2 days until 2026-12-31'",
+    )
     return arg_parse.parse_args()
 
 
+def parse_relative_time(relative_time_str: str) -> str:
+    if relative_time_str.startswith("+"):
+        now = datetime.now().replace(second=0, microsecond=0)
+        time_values = relative_time_str.lstrip("+").split(":")
+        if len(time_values) == 2:
+            hours, minutes = time_values
+            new_time = now + timedelta(hours=int(hours), minutes=int(minutes))
+        elif len(time_values) == 1:
+            new_time = now + timedelta(minutes=int(time_values[0]))
+        else:
+            return relative_time_str
+        return f"{new_time.hour}:{new_time.minute}"
+    return relative_time_str
+
+
 def loop_time_action(
     socket_addr: str,
     action: RequestAction,
     time_list: List[str],
     when: When,
     allow_relative: bool = False,
+    profile: Optional[str] = None,
+    rule: Optional[str] = None,
+    day: Optional[str] = None,
 ) -> None:
-    for time_str in time_list:
-        if allow_relative:
-            time_str = parse_relative_time(time_str)
+    """
+    Apply action to every time in list.
+    Several times are sent as one batch request.
+    """
+    if allow_relative:
+        time_list = list(map(parse_relative_time, time_list))
+    operations = [
+        make_message(action, when, time_str, rule=rule, day=day)
+        for time_str in time_list
+    ]
+    if len(operations) > 1:
+        message = make_message(
+            RequestAction.batch, when, operations=operations, profile=profile
+        )
+        print("\n".join(request_parts(socket_addr, message)))
+        return
+    for message in operations:
+        if profile is not None:
+            message["profile"] = profile
+        print("\n".join(request_parts(socket_addr, message)))
+
+
+def run_command(args: Namespace) -> None:
+    answer = str()
+    if args.namespace is None and args.format is not None:
+        answer = print_next_alarm(
+            socket_addr=args.socket,
+            full_list=args.full,
+            format_str=args.format,
+            profile=args.profile,
+        )
+    elif args.namespace is None:
+        answer = print_alarms(
+            socket_addr=args.socket,
+            full_list=args.full,
+            show_cancelled=args.cancelled,
+            list_whens=args.list_whens,
+            raw_table=args.raw_table,
+            profile=args.profile,
+        )
+    elif args.namespace == "add":
+        loop_time_action(
+            socket_addr=args.socket,
+            action=RequestAction.add,
+            time_list=args.time,
+            when=When.custom if args.rule is not None else args.when,
+            allow_relative=True,
+            profile=args.profile,
+            rule=args.rule,
+            day=args.day,
+        )
+    elif args.namespace == "cancel":
+        loop_time_action(
+            socket_addr=args.socket,
+            action=RequestAction.cancel,
+            time_list=args.time,
+            when=args.when,
+            profile=args.profile,
+        )
+    elif args.namespace == "delete":
+        loop_time_action(
+            socket_addr=args.socket,
+            action=RequestAction.delete,
+            time_list=args.time,
+            when=args.when,
+            profile=args.profile,
+            day=args.day,
+        )
+    elif args.namespace == "watch":
+        watch_alarms(
+            socket_addr=args.socket,
+            full_list=args.full,
+            format_str=WATCH_FORMAT if args.format is None else args.format,
+            tick=args.tick,
+            profile=args.profile,
+        )
+        return
+    elif args.namespace == "import":
+        answer = import_alarms(
+            socket_addr=args.socket,
+            path=args.file,
+            file_format=args.file_format,
+            profile=args.profile,
+        )
+    elif args.namespace == "export":
+        # Nothing else is printed, so exported alarms can go to stdout.
+        error = export_alarms(
+            socket_addr=args.socket,
+            path=args.file,
+            file_format=args.file_format,
+            profile=args.profile,
+        )
+        if error:
+            print(error, file=sys.stderr)
+        return
+    elif args.namespace == "stats":
+        answer = print_stats(socket_addr=args.socket, raw_table=args.raw_table)
+    elif args.namespace == "stop":
+        answer = send_message(
+            socket_addr=args.socket,
+            action=RequestAction.stop,
+            profile=args.profile,
+        )
+    elif args.namespace == "snooze":
         answer = send_message(
-            socket_addr=socket_addr,
-            action=action,
-            time_str=time_str,
-            when=when,
+            socket_addr=args.socket,
+            action=RequestAction.snooze,
+            profile=args.profile,
+            minutes=args.minutes,
         )
-        print(answer)
+    print(answer)
 
 
 def main() -> None:
     args = parse_args()
     try:
-        answer = str()
-        if args.namespace is None:
-            answer = print_alarms(
-                socket_addr=args.socket,
-                full_list=args.full,
-                show_cancelled=args.cancelled,
-                list_whens=args.list_whens,
-                raw_table=args.raw_table,
-            )
-        elif args.namespace == "add":
-            loop_time_action(
-                socket_addr=args.socket,
-                action=RequestAction.add,
-                time_list=args.time,
-                when=args.when,
-                allow_relative=True,
-            )
-        elif args.namespace == "cancel":
-            loop_time_action(
-                socket_addr=args.socket,
-                action=RequestAction.cancel,
-                time_list=args.time,
-                when=args.when,
-            )
-        elif args.namespace == "delete":
-            loop_time_action(
-                socket_addr=args.socket,
-                action=RequestAction.delete,
-                time_list=args.time,
-                when=args.when,
-            )
-        elif args.namespace == "stop":
-            answer = send_message(socket_addr=args.socket, action=RequestAction.stop)
-        print(answer)
+        try:
+            run_command(args)
+        except AlarmDaemonIsNotRunning:
+            if args.no_spawn:
+                raise
+            spawn_daemon(args.socket)
+            run_command(args)
     except AlarmDaemonIsNotRunning:
         print("Are you sure that timer daemon is running.")
+    except (ProtocolError, DaemonSpawnFailed) as err:
+        print(err)
+    except KeyboardInterrupt:
+        print()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,70 @@
+"""
+Lightweight definitions shared by alarmc and alarmd.
+
+alarmc imports only modules without heavy dependencies
+to start fast, so keep pydantic and loguru out of here.
+"""
+import enum
+
+SOCKET_NAME = "/tmp/timer_socket.sock"
+DAEMON_LOG_FILE = "/tmp/alarmd.log"
+# Daemonized alarmd holds lock of this file while it runs.
+DAEMON_PID_FILE = "/tmp/alarmd.pid"
+# Profile used by clients which don't ask for a specific one.
+DEFAULT_PROFILE = "default"
+# Ringing alarms are snoozed for this number of minutes by default.
+SNOOZE_MINUTES = 5.0
+# Alarms can't be snoozed for longer than a day.
+MAX_SNOOZE_MINUTES = 24 * 60.0
+# Watchers get updates at most this often when nothing changes.
+MIN_WATCH_TICK = 1.0
+
+
+@enum.unique
+class When(str, enum.Enum):
+    auto = "auto"
+    everyday = "everyday"
+    weekdays = "weekdays"
+    weekends = "weekends"
+    # Alarms with recurrence rules.
+    custom = "custom"
+
+    def __str__(self) -> str:
+        return str(self.value)
+
+
+# Compact codes of alarm rules, they're stored in snapshots,
+# so never reorder this tuple.
+WHEN_CODES = (When.auto, When.everyday, When.weekdays, When.weekends, When.custom)
+WHEN_INDEX = {when: code for code, when in enumerate(WHEN_CODES)}
+
+
+@enum.unique
+class RequestAction(str, enum.Enum):
+    add = "add"
+    list = "list"
+    stop = "stop"
+    delete = "delete"
+    cancel = "cancel"
+    batch = "batch"
+    watch = "watch"
+    stats = "stats"
+    # "import" is a keyword.
+    import_ = "import"
+    export = "export"
+    snooze = "snooze"
+
+
+@enum.unique
+class CatchUp(str, enum.Enum):
+    """
+    What daemon does with alarms it finds after their minute,
+    e.g. after suspend or restart.
+    """
+
+    # Only log them.
+    skip = "skip"
+    # Ring once for all alarms of the profile missed at a time.
+    once = "once"
+    # Ring every missed alarm.
+    all = "all"
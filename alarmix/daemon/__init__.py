@@ -1,3 +1,8 @@
 import threading
 
+# Serializes changes of alarms: requests changing them, buzzer ticks
+# and persistence. Requests which only read alarms use states
+# published by managers and never take it.
 lock = threading.Lock()
+# Notified every time the schedule is changed, so buzzer can re-plan.
+schedule_changed = threading.Condition(lock)
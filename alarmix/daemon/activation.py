@@ -0,0 +1,38 @@
+"""
+Socket activation.
+
+Service managers like systemd bind the socket themselves
+and start the daemon on the first connection,
+passing it the listening socket, see sd_listen_fds(3).
+"""
+import os
+import socket
+from typing import Optional
+
+from loguru import logger
+
+# The first descriptor passed by the service manager.
+LISTEN_FDS_START = 3
+
+
+def inherited_socket() -> Optional[socket.socket]:
+    """
+    Take listening socket passed by the service manager, if any.
+    Variables are removed, so children don't take it too.
+
+    :raises ValueError: if passed descriptor isn't a unix stream socket.
+    """
+    if os.environ.get("LISTEN_PID") != str(os.getpid()):
+        return None
+    count = int(os.environ.get("LISTEN_FDS") or 0)
+    for name in ("LISTEN_PID", "LISTEN_FDS", "LISTEN_FDNAMES"):
+        os.environ.pop(name, None)
+    if count < 1:
+        return None
+    if count > 1:
+        logger.warning(f"{count} sockets were passed, only the first one is used")
+    sock = socket.socket(fileno=LISTEN_FDS_START)
+    if sock.family != socket.AF_UNIX or sock.type != socket.SOCK_STREAM:
+        raise ValueError("Passed socket must be a unix stream socket")
+    sock.set_inheritable(False)
+    return sock
@@ -1,175 +1,695 @@
+import json
 import os.path
 import pickle
-import signal
+import tempfile
+import threading
 from collections import defaultdict
-from datetime import date, datetime, time
-from operator import attrgetter
-from typing import DefaultDict, List, Optional, Set, Union
+from datetime import date, datetime, time, timedelta
+from typing import Dict, Iterator, List, NamedTuple, Optional, Set, Tuple, Union
 
 from loguru import logger
 
+from alarmix.constants import DEFAULT_PROFILE
+from alarmix.daemon.clock import Clock
+from alarmix.daemon.codec import encode_info_list
+from alarmix.daemon.journal import AlarmJournal
+from alarmix.daemon.list_view import AlarmListView
+from alarmix.daemon.player import PlayerPool
+from alarmix.daemon.scheduler import AlarmScheduler
+from alarmix.daemon.snapshot import (
+    Alarms,
+    CancelKey,
+    PendingSnapshot,
+    encode_snapshot,
+    is_legacy_dump,
+    read_snapshot,
+)
+from alarmix.daemon.state import AlarmState, alarm_rows
+from alarmix.daemon.stats import stats
+from alarmix.daemon.timer_wheel import Timer, TimerWheel
+from alarmix.exceptions import AlarmInPast
+from alarmix.recurrence import AlarmTarget, Recurrence, RuleAlarm, parse_recurrence
 from alarmix.schema import (
-    Alarm,
     AlarmInfo,
+    AlarmRecord,
+    AlarmRow,
     CanceledAlarm,
     DeltaAlarm,
     InfoList,
     RequestAction,
     TimeMessageSocket,
     When,
+    check_snooze_minutes,
 )
-from alarmix.utils import add_delta_to_alarms, calculate_auto_time
+from alarmix.utils import calculate_auto_time
+
+# Actions which can be sent inside of a batch request.
+BATCH_ACTIONS = {RequestAction.add, RequestAction.delete, RequestAction.cancel}
+# Actions which only read alarms, they're served from the published state.
+READ_ACTIONS = {
+    RequestAction.list,
+    RequestAction.watch,
+    RequestAction.export,
+    RequestAction.stats,
+}
+# Actions which may change the time of the next alarm.
+SCHEDULE_ACTIONS = BATCH_ACTIONS | {
+    RequestAction.batch,
+    RequestAction.import_,
+    RequestAction.snooze,
+}
+# Journal is merged into snapshot once it grows bigger than this.
+COMPACT_SIZE = 256 * 1024
+# Kinds of ring timers.
+SNOOZE = "snooze"
+ESCALATION = "escalation"
+# Skipped alarms listed in the import reply, the rest are only counted.
+REPORTED_SKIPS = 10
+
+
+class RingTimer(NamedTuple):
+    """
+    Payload of timers which play alarms of the profile again.
+    """
+
+    kind: str
+    profile: str
+    # Number of sound to play, 0 is the main one.
+    step: int = 0
 
 
 class AlarmManager:
     """
     AlarmManager manipulates your alarms
+
+    Changes are made by one writer at a time and published
+    as `AlarmState`, which readers use without waiting for writers.
+    Sets of alarms, cancellations and list views are shared
+    with the published state until the writer changes them.
     """
 
-    def __init__(self, dump_file: str):
+    def __init__(
+        self,
+        dump_file: str,
+        clock: Optional[Clock] = None,
+        scheduler: Optional[AlarmScheduler] = None,
+        profile: str = DEFAULT_PROFILE,
+        journal_changed: Optional[threading.Event] = None,
+        timers: Optional[TimerWheel] = None,
+    ):
         self.dump_file = dump_file
-        self.alarm_pid: Optional[int] = None
-        self.alarms: DefaultDict[str, Set[Union[time, datetime]]] = defaultdict(set)
-        self.canceled: DefaultDict[str, Set[CanceledAlarm]] = defaultdict(set)
+        self.clock = clock or Clock()
+        self.profile = profile
+        # Set by buzzer, alarms are never played without it.
+        self.players: Optional[PlayerPool] = None
+        self.alarms: Alarms = defaultdict(set)
+        self.canceled: Set[CancelKey] = set()
+        self.canceled_day = self.clock.now().date()
+        # Profiles served by one daemon share the scheduler and timers.
+        self.scheduler = scheduler or AlarmScheduler()
+        # Empty wheel is falsy, so it's compared with None.
+        self.timers = TimerWheel(self.clock.now()) if timers is None else timers
+        # Pending timers of snoozed or ringing alarms.
+        self.snooze_timer: Optional[Timer] = None
+        self.escalation_timer: Optional[Timer] = None
+        self.journal = AlarmJournal(f"{dump_file}.journal", journal_changed)
+        self.snapshot_lock = threading.Lock()
+        # Generations of the last prepared and the last written snapshots.
+        self.prepared_generation = 0
+        self.written_generation = 0
+        # Held while journal is rotated or rotated records are dropped,
+        # never while snapshot is written.
+        self.rotation_lock = threading.Lock()
+        self.list_views = {False: AlarmListView(False), True: AlarmListView(True)}
+        # Increased on every visible change, so watchers know when to update.
+        self.version = 0
+        self.state = AlarmState({}, frozenset(), dict(self.list_views))
 
     def process_message(self, msg: TimeMessageSocket) -> str:
         """
         Update alarms by TimeMessageSocket action.
-        Delete|Add|List|Stop.
+        Delete|Add|Cancel|Batch|Import|Export|List|Watch|Stop|Snooze|Stats.
         """
+        if msg.action in READ_ACTIONS:
+            return self.read_message(msg)
+        try:
+            return self.change(msg)
+        finally:
+            self.publish()
+
+    def read_message(self, msg: TimeMessageSocket) -> str:
+        """
+        Answer request which doesn't change alarms.
+        Only the published state is used, so no lock is needed.
+        """
+        if msg.action == RequestAction.export:
+            return "\n".join(self.state.export_records())
+        if msg.action == RequestAction.stats:
+            return json.dumps(stats.summary())
+        # Watchers without framed protocol get only one update.
+        rows = self.state.list_rows(msg.full_list, self.clock.now())
+        return encode_info_list(rows)
+
+    def change(self, msg: TimeMessageSocket) -> str:
         message = "Something happened"
-        if msg.action == RequestAction.delete:
-            self.del_alarm(msg.time, msg.when)
-            self.dump_alarms()
-            message = "Successfully deleted"
-        elif msg.action == RequestAction.add:
-            self.add_alarm(msg.time, msg.when)
-            self.dump_alarms()
-            message = "Successfully added"
-        elif msg.action == RequestAction.cancel:
-            self.cancel_alarm(msg.time)
-            self.dump_alarms()
-            message = "Alarm cancelled"
-        elif msg.action == RequestAction.list:
-            message = self.list_formatted(msg.full_list).json()
+        if msg.action in BATCH_ACTIONS:
+            message = self.apply_operation(msg)
+        elif msg.action == RequestAction.batch:
+            message = self.process_batch(msg.operations)
+        elif msg.action == RequestAction.import_:
+            message = import_summary(*self.import_alarms(msg.records))
         elif msg.action == RequestAction.stop:
             message = self.stop_alarm()
+        elif msg.action == RequestAction.snooze:
+            message = self.snooze_alarm(msg.minutes)
         return message
 
+    def publish(self) -> None:
+        """
+        Make alarms visible to readers.
+
+        Called at the end of every change. Containers are shared
+        with the new state, they're copied by the next change instead.
+        """
+        self.state = AlarmState(dict(self.alarms), self.canceled, dict(self.list_views))
+
+    def writable_alarms(self, when: When) -> Set[AlarmTarget]:
+        """
+        Alarms of the rule which may be changed, copied if they're published.
+        """
+        targets = self.alarms[when.value]
+        if targets is self.state.alarms.get(when.value):
+            targets = self.alarms[when.value] = set(targets)
+        return targets
+
+    def writable_canceled(self) -> Set[CancelKey]:
+        if self.canceled is self.state.canceled:
+            self.canceled = set(self.canceled)
+        return self.canceled
+
+    def writable_views(self) -> List[AlarmListView]:
+        """
+        List views which may be changed. Published views are copied
+        and outdated ones are rebuilt, so views must be taken
+        before alarms are changed.
+        """
+        today = self.clock.now().date()
+        for all_alarms, view in list(self.list_views.items()):
+            if view.day != today:
+                view = AlarmListView(all_alarms)
+                view.rebuild(self.alarms, today)
+                self.list_views[all_alarms] = view
+            elif view is self.state.views.get(all_alarms):
+                self.list_views[all_alarms] = view.copy()
+        return list(self.list_views.values())
+
+    def invalidate_views(self) -> None:
+        """
+        Views are replaced instead of being changed, readers may use them.
+        """
+        self.list_views = {False: AlarmListView(False), True: AlarmListView(True)}
+
+    def apply_operation(self, msg: TimeMessageSocket) -> str:
+        """
+        Apply single add|delete|cancel operation.
+        """
+        if msg.action == RequestAction.delete:
+            self.del_alarm(msg.time, msg.when, msg.day)
+            return "Successfully deleted"
+        elif msg.action == RequestAction.add:
+            rule = self.parse_rule(msg.when, msg.rule)
+            self.add_alarm(msg.time, msg.when, rule, msg.day)
+            return "Successfully added"
+        self.cancel_alarm(msg.time)
+        return "Alarm cancelled"
+
+    def parse_rule(self, when: When, rule: Optional[str]) -> Optional[Recurrence]:
+        """
+        Parse recurrence rule of custom alarm.
+
+        :raises ValueError: if rule is malformed or alarm isn't custom.
+        """
+        if rule is None:
+            return None
+        if when != When.custom:
+            raise ValueError("Only custom alarms have recurrence rules")
+        return parse_recurrence(rule, self.clock.now().date())
+
+    def process_batch(self, operations: List[TimeMessageSocket]) -> str:
+        """
+        Apply all operations at once.
+
+        Operations are checked before applying,
+        so either all of them are applied or none.
+        """
+        for operation in operations:
+            if operation.action not in BATCH_ACTIONS or operation.time is None:
+                raise ValueError(f"Operation '{operation.action}' can't be batched")
+            self.parse_rule(operation.when, operation.rule)
+        messages = [self.apply_operation(operation) for operation in operations]
+        return "\n".join(messages)
+
+    def stream_message(self, msg: TimeMessageSocket) -> Iterator[str]:
+        """
+        Same as process_message, but splits alarms list
+        into several InfoList parts.
+        """
+        if msg.action != RequestAction.list:
+            yield self.process_message(msg)
+            return
+        yield from self.list_reply(msg.full_list)
+
+    def list_reply(self, all_alarms: bool) -> List[str]:
+        """
+        Encoded parts of list reply made from the published state.
+        """
+        return self.state.list_reply(all_alarms, self.clock.now())
+
+    def list_rows(
+        self,
+        all_alarms: bool = False,
+        now: Optional[datetime] = None,
+    ) -> List[AlarmRow]:
+        """
+        Information about alarms sorted by time.
+        """
+        now = now or self.clock.now()
+        return alarm_rows(self.list_alarms(all_alarms, now), self.canceled, now)
+
     def list_formatted(self, all_alarms: bool = False) -> InfoList:
         """
         Returns information about alarms
+
+        Fields are already valid here, so models are made
+        without pydantic validation.
         """
-        alarms = self.list_alarms(all_alarms)
-        info_list = list()
-        for alarm in alarms:
-            when_str = alarm.when.value
-            if alarm.when == When.auto:
-                date_time = calculate_auto_time(
-                    alarm.time,
-                )
-                when_str = str(date_time.date())
-            info_list.append(
-                AlarmInfo(
-                    time=alarm.time,
-                    remaining=str(alarm.delta).split(".")[0],
-                    when=when_str,
-                    canceled=self.is_canceled(alarm.time, when=alarm.when),
-                )
-            )
-        return InfoList(alarms=info_list)
+        rows = self.list_rows(all_alarms)
+        alarms = [AlarmInfo.construct(**row._asdict()) for row in rows]
+        return InfoList.construct(alarms=alarms)
 
-    def add_alarm(self, event_time: time, when: When) -> None:
+    def add_alarm(
+        self,
+        event_time: time,
+        when: When,
+        rule: Optional[Recurrence] = None,
+        day: Optional[date] = None,
+    ) -> None:
+        """
+        Add alarm to the schedule.
+
+        Auto alarms ring at the nearest moment or on the given day,
+        custom alarms must have a recurrence rule.
+        """
         logger.debug(f"Adding {event_time}")
-        target = event_time
+        now = self.clock.now()
+        target = self.make_target(event_time, when, rule, day, now)
+        if target not in self.alarms[when.value]:
+            views = self.writable_views()
+            self.writable_alarms(when).add(target)
+            for view in views:
+                view.add(target, when)
+            self.version += 1
+        self.journal.append("add", when, target)
+        self.scheduler.schedule(target, when, now, self.profile)
+
+    def make_target(
+        self,
+        event_time: time,
+        when: When,
+        rule: Optional[Recurrence],
+        day: Optional[date],
+        now: datetime,
+    ) -> AlarmTarget:
+        """
+        Build the value alarm is stored as.
+
+        :raises AlarmInPast: if auto alarm is in the past.
+        :raises ValueError: if custom alarm has no rule.
+        """
         if when == When.auto:
-            target = calculate_auto_time(event_time)
-        self.alarms[when.value].add(target)
+            if day is None:
+                return calculate_auto_time(event_time, now=now)
+            target = datetime.combine(day, event_time.replace(second=0))
+            if target < now:
+                raise AlarmInPast(target)
+            return target
+        if when == When.custom:
+            if rule is None:
+                raise ValueError("Custom alarms need a recurrence rule")
+            return RuleAlarm(event_time, rule)
+        return event_time
+
+    def import_alarms(self, records: List[AlarmRecord]) -> Tuple[int, List[datetime]]:
+        """
+        Add all imported alarms as one change.
+
+        Records are checked before adding, so either all of them
+        are added or none. Auto alarms of passed days, e.g. from an old export,
+        are skipped instead. Added alarms are journaled as a single record
+        and persisted together. Returns number of new alarms and skipped ones.
+        """
+        now = self.clock.now()
+        targets: Dict[Tuple[When, AlarmTarget], None] = {}
+        skipped: List[datetime] = []
+        for record in records:
+            rule = self.parse_rule(record.when, record.rule)
+            try:
+                target = self.make_target(
+                    record.time, record.when, rule, record.day, now
+                )
+            except AlarmInPast as err:
+                skipped.append(err.target)
+                continue
+            targets[record.when, target] = None
+        added = [
+            (when, target)
+            for when, target in targets
+            if target not in self.alarms[when.value]
+        ]
+        views = self.writable_views() if added else []
+        for when, target in added:
+            self.writable_alarms(when).add(target)
+            for view in views:
+                view.add(target, when)
+            self.scheduler.schedule(target, when, now, self.profile)
+        if added:
+            self.journal.append_import(added)
+            self.version += 1
+        logger.debug(
+            f"Imported {len(added)} alarms of '{self.profile}', skipped {len(skipped)}"
+        )
+        return len(added), skipped
+
+    def export_records(self) -> Iterator[str]:
+        """
+        Published alarms are never changed,
+        so they're encoded to JSON lines while the reply is sent.
+        """
+        return self.state.export_records()
 
-    def del_alarm(self, event_time: time, when: When) -> None:
+    def del_alarm(
+        self,
+        event_time: time,
+        when: When,
+        day: Optional[date] = None,
+    ) -> None:
         """
-        Delete alarm from queue
+        Delete alarm from queue.
+        All custom alarms with this time are deleted.
         """
         logger.debug(f"Trying delete {event_time}")
-        target = event_time
+        targets: List[AlarmTarget] = [event_time]
         if when == When.auto:
-            target = calculate_auto_time(event_time)
-        self.alarms[when.value].discard(target)
+            if day is None:
+                targets = [calculate_auto_time(event_time, now=self.clock.now())]
+            else:
+                targets = [datetime.combine(day, event_time.replace(second=0))]
+        elif when == When.custom:
+            targets = [
+                alarm
+                for alarm in self.alarms[when.value]
+                if isinstance(alarm, RuleAlarm) and alarm.time == event_time
+            ]
+        for target in targets:
+            if target in self.alarms[when.value]:
+                views = self.writable_views()
+                self.writable_alarms(when).discard(target)
+                for view in views:
+                    view.discard(target, when)
+                self.version += 1
+            self.journal.append("delete", when, target)
 
     def cancel_alarm(self, event_time: time) -> None:
         """
         Cancel alarm for today
         """
-        alarms = self.list_alarms()
-        for alarm in alarms:
+        now = self.clock.now()
+        today = now.date()
+        for alarm in self.list_alarms(now=now):
             if alarm.time == event_time:
                 if alarm.when == When.auto:
                     self.del_alarm(event_time, When.auto)
                 else:
-                    self.canceled[alarm.when.value].add(CanceledAlarm(time=event_time))
+                    self.writable_canceled().add((alarm.when, event_time, today))
+                    self.version += 1
+                    self.journal.append(
+                        "cancel", alarm.when, datetime.combine(today, event_time)
+                    )
 
-    def is_canceled(self, event_time: time, when: When) -> bool:
-        today = date.today()
-        for alarm in self.canceled[when.value]:
-            if alarm.time == event_time and alarm.canceled == today:
-                return True
-        return False
+    def is_scheduled(
+        self,
+        fire_at: datetime,
+        when: When,
+        event_time: Union[time, RuleAlarm],
+    ) -> bool:
+        """
+        Check that alarm popped from the scheduler still exists.
+        """
+        if when == When.auto:
+            return fire_at in self.alarms[When.auto.value]
+        return event_time in self.alarms[when.value]
+
+    def is_canceled(self, event_time: time, when: When, day: date) -> bool:
+        return (when, event_time, day) in self.canceled
 
-    def list_alarms(self, all_alarms: bool = False) -> List[DeltaAlarm]:
+    def list_alarms(
+        self,
+        all_alarms: bool = False,
+        now: Optional[datetime] = None,
+    ) -> List[DeltaAlarm]:
         """
         List alarms sorted by time
         """
-        needed_keys = [When.everyday.value]
-        if date.today().weekday() < 5 or all_alarms:
-            needed_keys.append(When.weekdays.value)
-        if date.today().weekday() >= 5 or all_alarms:
-            needed_keys.append(When.weekends.value)
-        alarms = set()
-        for key in needed_keys:
-            for alarm in self.alarms[key]:
-                alarms.add(Alarm(time=alarm, when=key))
-
-        for alarm in self.alarms[When.auto.value]:
-            if date.today() == alarm.date() or all_alarms:  # type: ignore
-                alarms.add(Alarm(time=alarm.time(), when=When.auto))  # type: ignore
-        delta_alarms = add_delta_to_alarms(alarms)
-        return list(sorted(delta_alarms, key=attrgetter("delta")))
+        now = now or self.clock.now()
+        view = self.list_views[all_alarms]
+        if view.day != now.date():
+            # Rebuilt as a new view, since the outdated one may be published.
+            view = self.list_views[all_alarms] = AlarmListView(all_alarms)
+            view.rebuild(self.alarms, now.date())
+        return view.read(now)
 
     def stop_alarm(self) -> str:
         """
-        Stop alarm by pid.
-        Buzzer thread updates alarm_pid variable.
+        Stop all ringing alarms of the profile, snoozed ones too.
         """
-        if self.alarm_pid:
-            os.kill(self.alarm_pid, signal.SIGTERM)
-            self.alarm_pid = None
+        snoozed = self.snooze_timer is not None
+        self.cancel_ring_timers()
+        if self.players is not None and self.players.stop_all(self.profile):
+            self.version += 1
+            return "Alarm stopped"
+        if snoozed:
+            self.version += 1
             return "Alarm stopped"
         return "Alarm isn't running"
 
+    def snooze_alarm(self, minutes: float) -> str:
+        """
+        Stop ringing alarms and play them again after a while.
+        Snoozed alarm may be snoozed again when it rings.
+        """
+        check_snooze_minutes(minutes)
+        if self.players is None or not self.players.stop_all(self.profile):
+            return "Alarm isn't running"
+        self.cancel_ring_timers()
+        wake_at = self.clock.now() + timedelta(minutes=minutes)
+        self.snooze_timer = self.timers.schedule(
+            wake_at, RingTimer(SNOOZE, self.profile)
+        )
+        self.version += 1
+        return f"Alarm snoozed until {wake_at:%H:%M:%S}"
+
+    def cancel_ring_timers(self) -> None:
+        for timer in (self.snooze_timer, self.escalation_timer):
+            if timer is not None:
+                self.timers.cancel(timer)
+        self.snooze_timer = None
+        self.escalation_timer = None
+
     def cleanup(self) -> None:
         """
-        Remove all outdated auto calculated alarms.
+        Remove all outdated auto calculated alarms,
+        custom alarms whose rules are over
+        and cancellations made before today.
+
+        Auto alarms are kept until buzzer takes them from the scheduler,
+        so late ones are caught up instead of being dropped unplayed.
         """
-        now = datetime.now()
-        auto_alarms = self.alarms[When.auto.value]
-        self.alarms[When.auto.value] = {
-            alarm for alarm in auto_alarms if alarm >= now  # type: ignore
+        now = self.clock.now()
+        version = self.version
+        outdated = {
+            alarm
+            for alarm in self.alarms[When.auto.value]
+            if isinstance(alarm, datetime)
+            and alarm < now
+            and not self.scheduler.is_queued(
+                (alarm, When.auto, alarm.time(), self.profile)
+            )
         }
-        today = date.today()
-        for key in self.canceled.keys():
-            self.canceled[key] = {
-                alarm for alarm in self.canceled[key] if alarm.canceled >= today
-            }
+        if outdated:
+            views = self.writable_views()
+            self.writable_alarms(When.auto).difference_update(outdated)
+            for view in views:
+                for alarm in outdated:
+                    view.discard(alarm, When.auto)
+            self.version += len(outdated)
+        today = now.date()
+        if today != self.canceled_day:
+            self.drop_finished_rules(today)
+            self.canceled = {key for key in self.canceled if key[2] >= today}
+            self.canceled_day = today
+            self.publish()
+        elif self.version != version:
+            self.publish()
 
-    def dump_alarms(self) -> None:
-        with open(self.dump_file, "wb") as file:
-            pickle.dump(self, file)
+    def drop_finished_rules(self, today: date) -> None:
+        finished = {
+            alarm
+            for alarm in self.alarms[When.custom.value]
+            if isinstance(alarm, RuleAlarm) and alarm.rule.until < today
+        }
+        if not finished:
+            return
+        views = self.writable_views()
+        self.writable_alarms(When.custom).difference_update(finished)
+        for view in views:
+            for alarm in finished:
+                view.discard(alarm, When.custom)
+        self.version += len(finished)
+
+    def apply_record(self, op: str, when: When, target: AlarmTarget) -> None:
+        """
+        Apply change read from the journal.
+        Views are invalidated by the caller.
+        """
+        if op == "add":
+            self.writable_alarms(when).add(target)
+        elif op == "delete":
+            self.writable_alarms(when).discard(target)
+        elif op == "cancel" and isinstance(target, datetime):
+            self.writable_canceled().add((when, target.time(), target.date()))
+
+    def prepare_persist(self, force: bool = False) -> Optional[PendingSnapshot]:
+        """
+        Start syncing the journal and take a snapshot if it grew too big.
 
-    def load_alarms(self) -> None:
-        if not os.path.exists(self.dump_file):
+        Snapshot is started by rotating the journal,
+        so it must be called while nobody changes alarms.
+        Alarms are published and the published state is taken
+        without copying, returned snapshot is encoded
+        and written by `finish_persist`.
+        """
+        self.journal.start_sync()
+        # Snapshot which failed to be written is taken again.
+        failed = self.prepared_generation > self.written_generation
+        if not force and not failed and self.journal.size < COMPACT_SIZE:
             return None
+        with self.rotation_lock:
+            self.prepared_generation += 1
+            self.journal.rotate()
+        self.publish()
+        return PendingSnapshot(
+            self.prepared_generation, self.state.alarms, self.state.canceled
+        )
+
+    def write_snapshot(self, snapshot: PendingSnapshot) -> None:
+        """
+        Atomically replace dump file with the snapshot.
+
+        Snapshots prepared before the last written one are skipped.
+        Rotated journal is kept until the latest prepared snapshot
+        is written, since it holds records missing in older ones.
+        """
+        with self.snapshot_lock, stats.timer("snapshot_seconds"):
+            if snapshot.generation <= self.written_generation:
+                logger.debug(f"Skipping outdated snapshot of '{self.profile}'")
+                return
+            data = encode_snapshot(snapshot.alarms, snapshot.canceled)
+            dump_dir = os.path.dirname(os.path.abspath(self.dump_file))
+            fd, tmp_path = tempfile.mkstemp(dir=dump_dir, prefix=".alarms-")
+            with os.fdopen(fd, "wb") as file:
+                file.write(data)
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(tmp_path, self.dump_file)
+            self.written_generation = snapshot.generation
+            with self.rotation_lock:
+                if snapshot.generation == self.prepared_generation:
+                    self.journal.drop_rotated()
+
+    def finish_persist(self, snapshot: Optional[PendingSnapshot]) -> None:
+        """
+        Sync journal records taken by `prepare_persist` and write the snapshot.
+        Journal stays dirty if any of them fails, so it's persisted again.
+        """
+        self.journal.fsync()
+        if snapshot is not None:
+            self.write_snapshot(snapshot)
+        self.journal.finish_sync()
+
+    def dump_alarms(self) -> None:
+        self.finish_persist(self.prepare_persist(force=True))
+
+    def load_alarms(self, after: Optional[datetime] = None) -> None:
+        """
+        Load alarms and plan their fires.
+        Fires after `after` moment are planned even if they're already late.
+        """
+        converted = False
+        if os.path.exists(self.dump_file):
+            if is_legacy_dump(self.dump_file):
+                self.load_legacy_dump()
+                converted = True
+            else:
+                self.alarms, self.canceled = read_snapshot(self.dump_file)
+        replayed = 0
+        for record in self.journal.replay():
+            self.apply_record(*record)
+            replayed += 1
+        self.invalidate_views()
+        self.version += 1
+        self.publish()
+        self.scheduler.plan(self.alarms, after or self.clock.now(), self.profile)
+        logger.debug(
+            f"Alarms of '{self.profile}' loaded, {replayed} journal records replayed"
+        )
+        if replayed or converted:
+            self.dump_alarms()
+
+    def load_legacy_dump(self) -> None:
+        """
+        Load pickled manager made by older versions.
+        It's converted to snapshot right after loading.
+        """
         with open(self.dump_file, "rb") as file:
             old_manager: AlarmManager = pickle.load(file)
-            self.alarms = old_manager.alarms
-            self.canceled = old_manager.canceled
-            logger.debug("Alarms loaded")
+        self.alarms = old_manager.alarms
+        self.canceled = migrate_canceled(old_manager.canceled)
+        logger.info(f"Converting {self.dump_file} to the new format")
+
+
+def migrate_canceled(
+    canceled: Union[Set[CancelKey], Dict[str, Set[CanceledAlarm]]],
+) -> Set[CancelKey]:
+    """
+    Convert cancellations from dumps made by older versions.
+    """
+    if isinstance(canceled, set):
+        return canceled
+    return {
+        (When(when), alarm.time, alarm.canceled)
+        for when, alarms in canceled.items()
+        for alarm in alarms
+    }
+
+
+def import_summary(added: int, skipped: List[datetime]) -> str:
+    """
+    Reply to the import request.
+    """
+    message = f"Imported {added} alarms"
+    if skipped:
+        listed = ", ".join(str(target) for target in skipped[:REPORTED_SKIPS])
+        if len(skipped) > REPORTED_SKIPS:
+            listed += ", ..."
+        message += f", skipped {len(skipped)} in the past: {listed}"
+    return message
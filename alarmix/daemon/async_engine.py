@@ -0,0 +1,383 @@
+import asyncio
+import os
+import signal
+import socket
+from argparse import Namespace
+from typing import Iterable, List, Optional, Set
+
+from loguru import logger
+
+from alarmix.constants import RequestAction
+from alarmix.daemon.alarm_manager import SCHEDULE_ACTIONS
+from alarmix.daemon.buzzer import Buzzer
+from alarmix.daemon.codec import (
+    MAX_IMPORT_RECORDS,
+    decode_records,
+    decode_request,
+    encode_info_list,
+)
+from alarmix.daemon.persistence import SYNC_INTERVAL
+from alarmix.daemon.profiles import AlarmProfiles, peer_uid, profile_key
+from alarmix.daemon.stats import METRICS_INTERVAL, stats
+from alarmix.exceptions import ProtocolError
+from alarmix.protocol import (
+    FRAME_HEADER,
+    LEGACY_MESSAGE_SIZE,
+    encode_frame,
+    encode_handshake,
+    parse_frame_size,
+    parse_handshake,
+)
+from alarmix.schema import AlarmRecord, TimeMessageSocket
+from alarmix.utils import remove_if_exists
+
+
+async def read_frame(reader: asyncio.StreamReader) -> Optional[bytes]:
+    """
+    Asyncio version of `alarmix.protocol.recv_frame`.
+    """
+    try:
+        size = parse_frame_size(await reader.readexactly(FRAME_HEADER.size))
+        if size == 0:
+            return None
+        return await reader.readexactly(size)
+    except asyncio.IncompleteReadError:
+        raise ProtocolError("connection closed in the middle of a frame")
+
+
+class AsyncDaemon:
+    """
+    Single-threaded daemon built on asyncio, serving all profiles.
+
+    Clients are served concurrently and alarms are fired
+    by loop timers, so no locking is required.
+    """
+
+    def __init__(self, profiles: AlarmProfiles, args: Namespace):
+        self.profiles = profiles
+        self.socket = args.socket
+        self.shared = args.shared
+        # Socket passed by the service manager, it owns the socket file.
+        self.listen_socket: Optional[socket.socket] = args.listen_socket
+        self.exit_idle: float = args.exit_idle
+        # Set to stop serving, e.g. when daemon is idle. It's made by `serve`,
+        # since events of python 3.8 and 3.9 are bound to the current loop.
+        self.stopped: Optional[asyncio.Event] = None
+        self.last_request = 0.0
+        self.metrics_file: Optional[str] = args.metrics_file
+        self.buzzer = Buzzer.from_args(profiles, args)
+        self.timer: Optional[asyncio.TimerHandle] = None
+        self.persist_timer: Optional[asyncio.TimerHandle] = None
+        # Every watcher waits for its own event to be set.
+        self.watchers: Set[asyncio.Event] = set()
+
+    async def serve(self) -> None:
+        logger.info("Started async daemon")
+        stopped = self.stopped = asyncio.Event()
+        if self.listen_socket is not None:
+            logger.debug("Using socket passed by the service manager")
+            server = await asyncio.start_unix_server(
+                self.handle_client, sock=self.listen_socket
+            )
+        else:
+            remove_if_exists(self.socket)
+            server = await asyncio.start_unix_server(
+                self.handle_client, path=self.socket
+            )
+            if self.shared:
+                # Every user gets own alarms, they're told apart by peer uid.
+                os.chmod(self.socket, 0o666)
+            logger.debug(f"Successfully bound {self.socket}")
+        loop = asyncio.get_running_loop()
+        loop.add_signal_handler(signal.SIGCHLD, self.on_child_exit)
+        # `alarmd kill` stops serving, so alarms are saved by `finalize`.
+        loop.add_signal_handler(signal.SIGTERM, stopped.set)
+        wall_fd = self.buzzer.wall_timer.fd
+        if wall_fd is not None:
+            os.set_blocking(wall_fd, False)
+            loop.add_reader(wall_fd, self.on_wall_timer)
+        self.plan_buzzer()
+        if self.metrics_file is not None:
+            loop.create_task(self.dump_metrics(self.metrics_file))
+        if self.exit_idle:
+            self.last_request = loop.time()
+            loop.call_later(self.exit_idle, self.check_idle)
+        async with server:
+            await stopped.wait()
+
+    def check_idle(self) -> None:
+        """
+        Stop serving once daemon had no clients
+        and nothing to do for `exit_idle` seconds.
+        """
+        loop = asyncio.get_running_loop()
+        elapsed = loop.time() - self.last_request
+        if elapsed < self.exit_idle:
+            loop.call_later(self.exit_idle - elapsed, self.check_idle)
+        elif self.watchers or self.persist_timer or not self.profiles.is_idle():
+            loop.call_later(self.exit_idle, self.check_idle)
+        else:
+            logger.info(f"Idle for {self.exit_idle:g} seconds, exiting")
+            if self.stopped is not None:
+                self.stopped.set()
+
+    async def handle_client(
+        self,
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+    ) -> None:
+        try:
+            await self.handle_connection(reader, writer)
+        except asyncio.CancelledError:
+            # Connections are cancelled when daemon stops. The task ends here,
+            # since asyncio of python 3.11 logs cancelled handlers as failed.
+            logger.debug("Connection cancelled")
+        except Exception as ex:
+            logger.exception(ex)
+        finally:
+            writer.close()
+            self.last_request = asyncio.get_running_loop().time()
+
+    async def handle_connection(
+        self,
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+    ) -> None:
+        msg_str = await reader.read(LEGACY_MESSAGE_SIZE)
+        if not msg_str:
+            return
+        uid = peer_uid(writer.get_extra_info("socket"))
+        version = parse_handshake(msg_str)
+        if version is None:
+            # Old clients send a single message and read a single reply.
+            reply = "\n".join(self.answer(msg_str, uid, False))
+            writer.write(reply.encode("utf-8"))
+            await writer.drain()
+            return
+        writer.write(encode_handshake(version))
+        payload = await read_frame(reader)
+        if payload is None:
+            return
+        parts: Iterable[str]
+        try:
+            request = decode_request(payload)
+            if request.action == RequestAction.import_:
+                request.records.extend(await self.receive_records(reader))
+        except ValueError as err:
+            logger.exception(err)
+            parts = [str(err)]
+        else:
+            if request.action == RequestAction.watch:
+                await self.watch(request, uid, writer)
+                return
+            parts = self.process(request, uid, True)
+        for part in parts:
+            writer.write(encode_frame(part.encode("utf-8")))
+            await writer.drain()
+        writer.write(encode_frame(b""))
+        await writer.drain()
+
+    async def receive_records(self, reader: asyncio.StreamReader) -> List[AlarmRecord]:
+        """
+        Read imported alarms until the empty frame.
+
+        Frames are read till the end even if some records are malformed
+        or there are too many of them, so the client gets the error
+        instead of a broken pipe. Frames after the error are dropped.
+
+        :raises ValueError: if any of records is malformed
+            or there are more than MAX_IMPORT_RECORDS.
+        """
+        records: List[AlarmRecord] = []
+        error: Optional[ValueError] = None
+        payload = await read_frame(reader)
+        while payload is not None:
+            if error is None:
+                try:
+                    records.extend(decode_records(payload))
+                    if len(records) > MAX_IMPORT_RECORDS:
+                        raise ValueError(
+                            f"Can't import more than {MAX_IMPORT_RECORDS} alarms"
+                        )
+                except ValueError as err:
+                    error = err
+                    records = []
+            payload = await read_frame(reader)
+        if error is not None:
+            raise error
+        return records
+
+    def answer(self, payload: bytes, uid: Optional[int], streaming: bool) -> List[str]:
+        try:
+            return list(self.process(decode_request(payload), uid, streaming))
+        except ValueError as err:
+            logger.exception(err)
+            return [str(err)]
+
+    def process(
+        self,
+        request: TimeMessageSocket,
+        uid: Optional[int],
+        streaming: bool,
+    ) -> Iterable[str]:
+        parts: Iterable[str]
+        try:
+            with stats.timer("request_seconds", action=request.action.value):
+                key = profile_key(uid, request.profile)
+                loaded = key not in self.profiles.managers
+                manager = self.profiles.get(key)
+                version = manager.version
+                if streaming and request.action == RequestAction.export:
+                    # Published alarms are encoded while sent.
+                    parts = manager.export_records()
+                elif streaming:
+                    parts = list(manager.stream_message(request))
+                else:
+                    parts = [manager.process_message(request)]
+            if request.action in SCHEDULE_ACTIONS:
+                self.plan_buzzer()
+                self.plan_persist()
+            elif loaded:
+                # Profile loaded by the request may have alarms to catch up.
+                self.plan_buzzer()
+            if manager.version != version:
+                self.notify_watchers()
+            return parts
+        except Exception as ex:
+            logger.exception(ex)
+            return [str(ex)]
+
+    async def watch(
+        self,
+        request: TimeMessageSocket,
+        uid: Optional[int],
+        writer: asyncio.StreamWriter,
+    ) -> None:
+        """
+        Send alarms list every time it changes and at least once per tick.
+
+        Watchers are woken up by changes of any profile,
+        but send updates only when their own profile is changed.
+        """
+        try:
+            key = profile_key(uid, request.profile)
+        except ValueError as err:
+            writer.write(encode_frame(str(err).encode("utf-8")))
+            writer.write(encode_frame(b""))
+            await writer.drain()
+            return
+        if key not in self.profiles.managers:
+            self.profiles.get(key)
+            self.plan_buzzer()
+        manager = self.profiles.managers[key]
+        loop = asyncio.get_running_loop()
+        changed = asyncio.Event()
+        self.watchers.add(changed)
+        try:
+            while True:
+                seen_version = manager.version
+                rows = manager.state.list_rows(request.full_list, manager.clock.now())
+                update = encode_info_list(rows)
+                writer.write(encode_frame(update.encode("utf-8")))
+                await writer.drain()
+                deadline = loop.time() + request.tick
+                while manager.version == seen_version and loop.time() < deadline:
+                    changed.clear()
+                    try:
+                        await asyncio.wait_for(changed.wait(), deadline - loop.time())
+                    except asyncio.TimeoutError:
+                        pass
+        except ConnectionError:
+            logger.debug("Watcher disconnected")
+        except asyncio.CancelledError:
+            # Watchers are cancelled when daemon stops.
+            logger.debug("Watcher cancelled")
+            raise
+        finally:
+            self.watchers.discard(changed)
+
+    def notify_watchers(self) -> None:
+        for changed in self.watchers:
+            changed.set()
+
+    def plan_buzzer(self) -> None:
+        """
+        Set loop timer to the next alarm deadline.
+        """
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        delay = self.buzzer.plan_wakeup()
+        if delay is None:
+            return
+        loop = asyncio.get_running_loop()
+        self.timer = loop.call_at(loop.time() + delay, self.on_deadline)
+
+    def plan_persist(self) -> None:
+        """
+        Sync all changes made during SYNC_INTERVAL at once.
+        """
+        if self.persist_timer is None:
+            loop = asyncio.get_running_loop()
+            self.persist_timer = loop.call_later(
+                SYNC_INTERVAL, lambda: loop.create_task(self.persist())
+            )
+
+    async def persist(self) -> None:
+        loop = asyncio.get_running_loop()
+        try:
+            with stats.timer("persist_seconds"):
+                changed = [
+                    manager
+                    for manager in self.profiles.managers.values()
+                    if manager.journal.dirty
+                ]
+                snapshots = [manager.prepare_persist() for manager in changed]
+                for manager, snapshot in zip(changed, snapshots):
+                    await loop.run_in_executor(None, manager.finish_persist, snapshot)
+        except OSError as err:
+            # Journals which weren't synced stay dirty, they're retried.
+            logger.exception(err)
+        finally:
+            self.persist_timer = None
+        if any(manager.journal.dirty for manager in self.profiles.managers.values()):
+            self.plan_persist()
+
+    async def dump_metrics(self, path: str) -> None:
+        """
+        Periodically write metrics file for Prometheus textfile collectors.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(METRICS_INTERVAL)
+            try:
+                await loop.run_in_executor(None, stats.dump_prometheus, path)
+            except OSError as err:
+                logger.warning(f"Can't write metrics: {err}")
+
+    def on_child_exit(self) -> None:
+        version = self.profiles.version
+        self.buzzer.reap_players()
+        if self.profiles.version != version:
+            self.notify_watchers()
+
+    def on_wall_timer(self) -> None:
+        if self.buzzer.wall_timer.wait():
+            logger.debug("Wall clock was set")
+        self.on_deadline()
+
+    def on_deadline(self) -> None:
+        self.timer = None
+        version = self.profiles.version
+        with stats.timer("buzzer_tick_seconds"):
+            self.buzzer.check_clock()
+            self.buzzer.fire_due_alarms()
+            self.profiles.cleanup()
+        if self.profiles.version != version:
+            self.notify_watchers()
+        self.plan_buzzer()
+
+    def finalize(self) -> None:
+        if self.listen_socket is None:
+            remove_if_exists(self.socket)
+        self.buzzer.finalize()
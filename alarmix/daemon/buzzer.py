@@ -1,56 +1,374 @@
-import os.path
-import subprocess
+import os
+import signal
 import threading
 from argparse import Namespace
-from datetime import datetime
-from time import sleep
+from datetime import datetime, timedelta
+from typing import List, NamedTuple, Optional, Set, Type, TypeVar
 
 from loguru import logger
 
-from alarmix.daemon import lock
-from alarmix.daemon.alarm_manager import AlarmManager
+from alarmix.constants import CatchUp
+from alarmix.daemon import lock, schedule_changed
+from alarmix.daemon.alarm_manager import ESCALATION, SNOOZE, RingTimer
+from alarmix.daemon.clock import ClockWatch
+from alarmix.daemon.player import PlayerPool
+from alarmix.daemon.profiles import AlarmProfiles
+from alarmix.daemon.scheduler import ScheduleEntry
+from alarmix.daemon.stats import stats
+from alarmix.daemon.wall_timer import MAX_SLEEP, WallTimer
 from alarmix.exceptions import SoundFileNotFound
+from alarmix.recurrence import alarm_time
+from alarmix.schema import When
 
+# Alarms found late by less than this are played as usual,
+# later ones are handled by the catch-up policy.
+FIRE_WINDOW = timedelta(minutes=1)
+# Smaller differences between wall and monotonic clocks aren't jumps.
+JUMP_TOLERANCE = timedelta(seconds=5)
 
-class BuzzerThread(threading.Thread):
-    def __init__(self, manager: AlarmManager, args: Namespace) -> None:
+BuzzerType = TypeVar("BuzzerType", bound="Buzzer")
+
+
+class BuzzerConfig(NamedTuple):
+    """
+    How alarms are played, see options of alarmd.
+    """
+
+    # The main sound goes first, then escalation ones.
+    sounds: List[str]
+    escalate_after: timedelta
+    catch_up: CatchUp
+    catch_up_window: timedelta
+
+
+def read_config(args: Namespace) -> BuzzerConfig:
+    """
+    :raises SoundFileNotFound: if any of sounds doesn't exist.
+    """
+    sounds = [args.sound, *args.escalation_sounds]
+    for sound in sounds:
+        if not os.path.exists(sound):
+            raise SoundFileNotFound(sound)
+    return BuzzerConfig(
+        sounds=sounds,
+        escalate_after=timedelta(seconds=args.escalate_after),
+        catch_up=CatchUp(args.catch_up),
+        catch_up_window=timedelta(minutes=args.catch_up_window),
+    )
+
+
+class Buzzer:
+    """
+    Plays alarms of all profiles at the time scheduled by their managers.
+
+    Buzzer doesn't wait on its own, engines decide
+    how to sleep until the next deadline.
+
+    Alarm which isn't stopped in `escalate_after` seconds
+    is played again with the next escalation sound.
+
+    Alarms found after their minute, e.g. after suspend
+    or restart, are played according to the catch-up policy
+    if they're late by less than `catch_up_window`.
+    """
+
+    def __init__(
+        self,
+        profiles: AlarmProfiles,
+        players: PlayerPool,
+        config: BuzzerConfig,
+    ) -> None:
+        self.profiles = profiles
+        self.sounds = config.sounds
+        self.escalate_after = config.escalate_after
+        self.catch_up = config.catch_up
+        self.catch_up_window = config.catch_up_window
+        self.players = players
+        profiles.attach_players(players)
+        # Deadline the player was preloaded for.
+        self.warmed_for: Optional[datetime] = None
+        # Alarms due by this moment were handled.
+        self.checked: Optional[datetime] = None
+        self.clock_watch = ClockWatch(profiles.clock)
+        self.wall_timer = WallTimer()
+
+    @classmethod
+    def from_args(
+        cls: Type[BuzzerType], profiles: AlarmProfiles, args: Namespace
+    ) -> BuzzerType:
+        """
+        :raises SoundFileNotFound: if any of sounds doesn't exist.
+        """
+        config = read_config(args)
+        players = PlayerPool(args.player, config.sounds[0], args.preload)
+        return cls(profiles, players, config)
+
+    def seconds_to_next_alarm(self) -> Optional[float]:
+        """
+        Time to sleep until the next alarm.
+        None means that there is nothing to wait for.
+
+        Buzzer wakes up earlier to preload a player.
+        """
+        now = self.profiles.clock.now()
+        deadline = self.profiles.scheduler.next_deadline()
+        delay = None
+        if deadline is not None:
+            delay = (deadline - now).total_seconds()
+            if self.warmed_for != deadline and delay > self.players.preload:
+                delay -= self.players.preload
+        timer_deadline = self.profiles.timers.next_deadline()
+        if timer_deadline is not None:
+            timer_delay = (timer_deadline - now).total_seconds()
+            delay = timer_delay if delay is None else min(delay, timer_delay)
+        return None if delay is None else max(delay, 0)
+
+    def plan_wakeup(self) -> Optional[float]:
+        """
+        Arm the wall timer and return how long engines may sleep.
+        Without timerfd sleeps are capped, so jumps are noticed in time.
+        Idle daemon has nothing to be late for, so it sleeps
+        until somebody wakes it up.
+        """
+        delay = self.seconds_to_next_alarm()
+        if self.wall_timer.fd is None:
+            return None if delay is None else min(delay, MAX_SLEEP)
+        deadline = None
+        if delay is not None:
+            deadline = self.profiles.clock.now() + timedelta(seconds=delay)
+        self.wall_timer.arm(deadline)
+        return delay
+
+    def check_clock(self) -> None:
+        """
+        Notice jumps of the wall clock, engines call it on every wake up.
+
+        Alarms skipped by a jump forward are handled by the catch-up policy.
+        Timers are moved back with the clock, so snoozes never last
+        longer than they were set for.
+        """
+        jump = self.clock_watch.jump()
+        if abs(jump) < JUMP_TOLERANCE:
+            return
+        logger.warning(f"Wall clock jumped by {jump}")
+        stats.observe("clock_jump_seconds", abs(jump.total_seconds()))
+        if jump < timedelta(0):
+            self.profiles.timers.shift(jump)
+
+    def fire_due_alarms(self) -> None:
+        """
+        Play alarms whose time has come and schedule their next fires.
+        """
+        scheduler = self.profiles.scheduler
+        now = self.profiles.clock.now()
+        # Profiles which are caught up during this evaluation.
+        caught_up: Set[str] = set()
+        due = scheduler.pop_due(now)
+        handled = bool(due)
+        while due:
+            for entry in due:
+                self.fire_entry(entry, now, caught_up)
+            # Alarms missed for days have more fires to catch up.
+            due = scheduler.pop_due(now)
+        # The first evaluation is saved too, so alarms are caught up
+        # even if daemon crashes before it plays anything.
+        if handled or self.checked is None:
+            self.mark_checked(now)
+        self.checked = now
+        self.fire_timers(now)
+        self.warm_up(now)
+
+    def fire_entry(
+        self, entry: ScheduleEntry, now: datetime, caught_up: Set[str]
+    ) -> None:
+        """
+        Play alarm taken from the scheduler and schedule its next fire.
+        """
+        fire_at, when, event_time, profile = entry
+        manager = self.profiles.managers.get(profile)
+        if manager is None or not manager.is_scheduled(fire_at, when, event_time):
+            return
+        if when != When.auto:
+            # Fires which are too late to be caught up are skipped at once.
+            window = self.catch_up_window
+            if self.catch_up == CatchUp.skip:
+                window = timedelta(0)
+            after = max(fire_at + timedelta(minutes=1), now - window)
+            self.profiles.scheduler.schedule(event_time, when, after, profile)
+        event_time = alarm_time(event_time)
+        if manager.is_canceled(event_time, when, fire_at.date()):
+            return
+        late = now - fire_at
+        if late >= FIRE_WINDOW:
+            if self.catch_up == CatchUp.skip or late > self.catch_up_window:
+                logger.warning(f"Alarm {event_time} of '{profile}' was missed")
+                return
+            if self.catch_up == CatchUp.once and profile in caught_up:
+                return
+            caught_up.add(profile)
+            logger.warning(f"Alarm {event_time} of '{profile}' is {late} late")
+        pid = self.start_alarm(fire_at, when, profile)
+        manager.version += 1
+        lateness = (self.profiles.clock.now() - fire_at).total_seconds()
+        stats.observe("fire_lateness_seconds", lateness)
+        logger.debug(f"Alarm {event_time} of '{profile}' is played by {pid}")
+
+    def mark_checked(self, now: datetime) -> None:
+        try:
+            self.profiles.mark_checked(now)
+        except OSError as err:
+            logger.warning(f"Can't save the moment alarms were checked at: {err}")
+
+    def fire_timers(self, now: datetime) -> None:
+        """
+        Play snoozed alarms again and escalate ones nobody stopped.
+        """
+        for timer in self.profiles.timers.advance(now):
+            ring: RingTimer = timer.payload
+            manager = self.profiles.managers.get(ring.profile)
+            if manager is None:
+                continue
+            if ring.kind == SNOOZE:
+                manager.snooze_timer = None
+                logger.debug(f"Snoozed alarm of '{ring.profile}' rings again")
+                self.ring(ring.profile)
+            elif ring.kind == ESCALATION:
+                manager.escalation_timer = None
+                if not self.players.is_playing(ring.profile):
+                    continue
+                logger.debug(f"Alarm of '{ring.profile}' is escalated")
+                self.players.stop_all(ring.profile)
+                self.ring(ring.profile, ring.step)
+            manager.version += 1
+
+    def warm_up(self, now: datetime) -> None:
+        """
+        Preload a player if the next deadline is close.
+        """
+        deadline = self.profiles.scheduler.next_deadline()
+        if deadline is None or deadline == self.warmed_for:
+            return
+        if (deadline - now).total_seconds() <= self.players.preload:
+            self.warmed_for = deadline
+            self.players.warm()
+
+    def start_alarm(self, fire_at: datetime, when: When, profile: str) -> int:
+        return self.ring(profile)
+
+    def ring(self, profile: str, step: int = 0) -> int:
+        """
+        Play sound of the escalation step and schedule the next step.
+        """
+        pid = self.players.play(profile, self.sounds[step])
+        manager = self.profiles.managers[profile]
+        if manager.escalation_timer is not None:
+            self.profiles.timers.cancel(manager.escalation_timer)
+            manager.escalation_timer = None
+        if step + 1 < len(self.sounds):
+            manager.escalation_timer = self.profiles.timers.schedule(
+                self.profiles.clock.now() + self.escalate_after,
+                RingTimer(ESCALATION, profile, step + 1),
+            )
+        return pid
+
+    def reap_players(self) -> None:
+        """
+        Collect exited players, engines call it on SIGCHLD.
+        """
+        for profile in self.players.reap():
+            manager = self.profiles.managers.get(profile)
+            if manager is not None:
+                manager.version += 1
+
+    def finalize(self) -> None:
+        if self.checked is not None:
+            self.mark_checked(self.checked)
+        self.profiles.cleanup()
+        self.profiles.dump_alarms()
+        self.players.close()
+        self.wall_timer.close()
+
+
+class BuzzerThread(Buzzer, threading.Thread):
+    def __init__(
+        self,
+        profiles: AlarmProfiles,
+        players: PlayerPool,
+        config: BuzzerConfig,
+    ) -> None:
         threading.Thread.__init__(self)
-        self.manager = manager
-        self.sound = args.sound
-        self.last_played_time = None
-        if not os.path.exists(self.sound):
-            raise SoundFileNotFound(self.sound)
+        Buzzer.__init__(self, profiles, players, config)
 
     def run(self) -> None:
         logger.debug("Started buzzer thread.")
-        while True:
-            lock.acquire()
-            alarms = self.manager.list_alarms()
-            self.manager.cleanup()
-            lock.release()
-            if len(alarms) > 0:
-                now = datetime.now().time().replace(second=0, microsecond=0)
-                alarm = alarms[0]
-                if alarm.time == now:
-                    lock.acquire()
-                    if (
-                        not self.manager.is_canceled(alarm.time, alarm.when)
-                        and self.manager.alarm_pid is None
-                        and now != self.last_played_time
-                    ):
-                        self.manager.alarm_pid = self.start_alarm()
-                        self.last_played_time = alarm.time
-                    lock.release()
-            sleep(10)
-
-    def start_alarm(self) -> int:
-        process = subprocess.Popen(
-            ["mpv", "--really-quiet", "--loop", "--no-video", self.sound]
-        )
-        return process.pid
+        with schedule_changed:
+            while True:
+                version = self.profiles.version
+                with stats.timer("buzzer_tick_seconds"):
+                    self.check_clock()
+                    self.fire_due_alarms()
+                    self.profiles.cleanup()
+                if self.profiles.version != version:
+                    schedule_changed.notify_all()
+                schedule_changed.wait(self.plan_wakeup())
 
     def finalize(self) -> None:
         lock.acquire()
-        self.manager.cleanup()
-        self.manager.dump_alarms()
+        Buzzer.finalize(self)
         lock.release()
+
+
+class ReaperThread(threading.Thread):
+    """
+    Reaps exited players on SIGCHLD.
+
+    Python signal handlers run only in the main thread,
+    which is blocked on join, so the signal wakes this thread
+    through the signal wakeup fd instead.
+    """
+
+    def __init__(self, buzzer: Buzzer) -> None:
+        threading.Thread.__init__(self)
+        self.buzzer = buzzer
+        self.wakeup_fd: Optional[int] = None
+
+    def install_handler(self) -> None:
+        """
+        Must be called from the main thread.
+        """
+        self.wakeup_fd, write_fd = os.pipe()
+        os.set_blocking(write_fd, False)
+        signal.signal(signal.SIGCHLD, lambda signum, frame: None)
+        signal.set_wakeup_fd(write_fd, warn_on_full_buffer=False)
+
+    def run(self) -> None:
+        logger.debug("Started reaper thread.")
+        if self.wakeup_fd is None:
+            raise RuntimeError("SIGCHLD handler isn't installed")
+        while True:
+            # Any signal wakes the thread up, reaping is cheap.
+            os.read(self.wakeup_fd, 64)
+            with schedule_changed:
+                version = self.buzzer.profiles.version
+                self.buzzer.reap_players()
+                if self.buzzer.profiles.version != version:
+                    schedule_changed.notify_all()
+
+
+class WakeupThread(threading.Thread):
+    """
+    Wakes buzzer up when its wall timer fires or the wall clock is set.
+    Buzzer re-arms the timer before every sleep.
+    """
+
+    def __init__(self, buzzer: Buzzer) -> None:
+        threading.Thread.__init__(self)
+        self.buzzer = buzzer
+
+    def run(self) -> None:
+        logger.debug("Started wakeup thread.")
+        while True:
+            if self.buzzer.wall_timer.wait():
+                logger.debug("Wall clock was set")
+            with schedule_changed:
+                schedule_changed.notify_all()
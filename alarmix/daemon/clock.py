@@ -0,0 +1,66 @@
+import time
+from datetime import datetime, timedelta
+
+
+class Clock:
+    """
+    Source of the current time for the daemon.
+
+    Every evaluation reads the clock once and passes
+    the moment down, so all alarms are compared with the same time.
+    """
+
+    def now(self) -> datetime:
+        return datetime.now()
+
+    def monotonic(self) -> float:
+        return time.monotonic()
+
+
+class SimulatedClock(Clock):
+    """
+    Clock which moves only when told to.
+    """
+
+    def __init__(self, start: datetime) -> None:
+        self.start = start
+        self.current = start
+
+    def now(self) -> datetime:
+        return self.current
+
+    def monotonic(self) -> float:
+        # Simulated time only passes, it never jumps.
+        return (self.current - self.start).total_seconds()
+
+    def advance(self, delta: timedelta) -> None:
+        self.current += delta
+
+    def set(self, moment: datetime) -> None:
+        self.current = moment
+
+
+class ClockWatch:
+    """
+    Notices jumps of the wall clock.
+
+    Wall and monotonic clocks move together unless the wall clock
+    is set or the machine was suspended, monotonic clock
+    stands still during suspend.
+    """
+
+    def __init__(self, clock: Clock) -> None:
+        self.clock = clock
+        self.wall = clock.now()
+        self.ticks = clock.monotonic()
+
+    def jump(self) -> timedelta:
+        """
+        How far the wall clock has jumped since the previous call.
+        """
+        wall = self.clock.now()
+        ticks = self.clock.monotonic()
+        skew = (wall - self.wall) - timedelta(seconds=ticks - self.ticks)
+        self.wall = wall
+        self.ticks = ticks
+        return skew
@@ -0,0 +1,261 @@
+"""
+Fast encoding of socket messages.
+
+Requests of known actions are decoded without pydantic validation,
+anything fast decoders don't understand is validated by the model.
+List replies are encoded straight from rows, without building models.
+"""
+import json
+import math
+import re
+from datetime import date, datetime, time
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from alarmix.constants import MIN_WATCH_TICK
+from alarmix.recurrence import AlarmTarget, RuleAlarm, format_recurrence
+from alarmix.schema import AlarmRecord, AlarmRow, RequestAction, TimeMessageSocket, When
+
+# Number of alarms sent in one frame of an export reply.
+RECORDS_CHUNK_SIZE = 500
+# Imported alarms are kept in memory until all of them are received.
+MAX_IMPORT_RECORDS = 50_000
+# Formats accepted by pydantic, other ones are left to it.
+TIME_PATTERN = re.compile(r"(\d{1,2}):(\d{1,2})(?::(\d{1,2}))?")
+DATE_PATTERN = re.compile(r"(\d{4})-(\d{1,2})-(\d{1,2})")
+WHENS = {when.value: when for when in When}
+ACTIONS = {action.value: action for action in RequestAction}
+# Requests with other fields are validated by pydantic.
+REQUEST_FIELDS = frozenset(TimeMessageSocket.__fields__) - {"records", "minutes"}
+TEXT_FIELDS = ("time", "day", "profile", "rule")
+# Immutable defaults of request fields, lists are made for every request.
+REQUEST_DEFAULTS = {
+    name: field.default
+    for name, field in TimeMessageSocket.__fields__.items()
+    if not isinstance(field.default, list)
+}
+
+# Decoder returns None if request must be validated by pydantic.
+RequestDecoder = Callable[[Dict[str, Any]], Optional[TimeMessageSocket]]
+
+
+def decode_request(payload: bytes) -> TimeMessageSocket:
+    """
+    Parse request sent by client.
+
+    :raises ValueError: if request is malformed.
+    """
+    data = json.loads(payload.decode("utf-8"))
+    if not isinstance(data, dict):
+        raise ValueError("Request must be a JSON object")
+    request = decode_fast(data)
+    if request is None:
+        request = TimeMessageSocket(**data)
+    return request
+
+
+def decode_fast(data: Dict[str, Any]) -> Optional[TimeMessageSocket]:
+    action = data.get("action")
+    if not isinstance(action, str) or not data.keys() <= REQUEST_FIELDS:
+        return None
+    decoder = DECODERS.get(action)
+    if decoder is None:
+        return None
+    return decoder(data)
+
+
+def decode_fields(data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    Convert fields shared by all requests.
+    """
+    when = data.get("when")
+    if not isinstance(when, str) or when not in WHENS:
+        return None
+    if not isinstance(data.get("full_list", False), bool):
+        return None
+    for key in TEXT_FIELDS:
+        if not isinstance(data.get(key), (str, type(None))):
+            return None
+    fields = dict(data, when=WHENS[when], action=ACTIONS[data["action"]])
+    if "tick" in data:
+        tick = data["tick"]
+        if isinstance(tick, bool) or not isinstance(tick, (int, float)):
+            return None
+        # Pydantic rejects it with a proper error.
+        if not math.isfinite(tick) or tick < MIN_WATCH_TICK:
+            return None
+        fields["tick"] = float(tick)
+    return fields
+
+
+def decode_query(data: Dict[str, Any]) -> Optional[TimeMessageSocket]:
+    """
+    Decode request which doesn't carry alarms, e.g. list or stop.
+    """
+    fields = decode_fields(data)
+    if fields is None or fields.get("time") is not None:
+        return None
+    if fields.get("day") is not None:
+        return None
+    if fields.get("operations"):
+        return None
+    fields["time"] = None
+    fields["day"] = None
+    fields["operations"] = []
+    return build_request(fields)
+
+
+def decode_operation(data: Dict[str, Any]) -> Optional[TimeMessageSocket]:
+    """
+    Decode add, delete or cancel request.
+    """
+    fields = decode_fields(data)
+    if fields is None or fields.get("operations"):
+        return None
+    try:
+        fields["time"] = parse_time(fields.get("time"))
+        fields["day"] = parse_date(fields.get("day"))
+    except ValueError:
+        return None
+    fields["operations"] = []
+    return build_request(fields)
+
+
+def decode_batch(data: Dict[str, Any]) -> Optional[TimeMessageSocket]:
+    fields = decode_fields(data)
+    operations = data.get("operations")
+    if fields is None or fields.get("time") is not None:
+        return None
+    if fields.get("day") is not None or not isinstance(operations, list):
+        return None
+    decoded = []
+    for operation in operations:
+        if not isinstance(operation, dict):
+            return None
+        request = decode_fast(operation)
+        if request is None:
+            return None
+        decoded.append(request)
+    fields["time"] = None
+    fields["day"] = None
+    fields["operations"] = decoded
+    return build_request(fields)
+
+
+def build_request(fields: Dict[str, Any]) -> TimeMessageSocket:
+    """
+    Same as `TimeMessageSocket.construct`, but defaults aren't looked up
+    and copied for every request.
+    """
+    request = TimeMessageSocket.__new__(TimeMessageSocket)
+    values = dict(REQUEST_DEFAULTS, records=[], **fields)
+    object.__setattr__(request, "__dict__", values)
+    object.__setattr__(request, "__fields_set__", set(fields))
+    return request
+
+
+def parse_time(value: Optional[str]) -> Optional[time]:
+    """
+    :raises ValueError: if value isn't a plain time.
+    """
+    if value is None:
+        return None
+    match = TIME_PATTERN.fullmatch(value)
+    if match is None:
+        raise ValueError(f"Time {value} is left to pydantic")
+    hour, minute, second = match.groups()
+    return time(int(hour), int(minute), int(second or 0))
+
+
+def parse_date(value: Optional[str]) -> Optional[date]:
+    """
+    :raises ValueError: if value isn't a plain date.
+    """
+    if value is None:
+        return None
+    match = DATE_PATTERN.fullmatch(value)
+    if match is None:
+        raise ValueError(f"Date {value} is left to pydantic")
+    year, month, day = match.groups()
+    return date(int(year), int(month), int(day))
+
+
+DECODERS: Dict[str, RequestDecoder] = {
+    RequestAction.list.value: decode_query,
+    RequestAction.watch.value: decode_query,
+    RequestAction.stop.value: decode_query,
+    RequestAction.stats.value: decode_query,
+    RequestAction.export.value: decode_query,
+    RequestAction.add.value: decode_operation,
+    RequestAction.delete.value: decode_operation,
+    RequestAction.cancel.value: decode_operation,
+    RequestAction.batch.value: decode_batch,
+}
+
+
+def encode_info_list(rows: Iterable[AlarmRow]) -> str:
+    """
+    Same JSON as `InfoList.json()`, but made without models.
+    """
+    alarms = [
+        {
+            "time": row.time.isoformat(),
+            "remaining": row.remaining,
+            "when": row.when,
+            "canceled": row.canceled,
+        }
+        for row in rows
+    ]
+    return json.dumps({"alarms": alarms})
+
+
+def decode_records(payload: bytes) -> List[AlarmRecord]:
+    """
+    Parse chunk of imported alarms written as JSON lines.
+
+    :raises ValueError: if any of records is malformed, the error names its line.
+    """
+    records = []
+    for line in payload.decode("utf-8").splitlines():
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+            if not isinstance(record, dict):
+                raise ValueError("it must be an object")
+            records.append(AlarmRecord(**record))
+        except ValueError as err:
+            raise ValueError(f"Invalid alarm record {line.strip()}: {err}")
+    return records
+
+
+def encode_record(when: When, target: AlarmTarget) -> Dict[str, Any]:
+    """
+    Write alarm as a record which is imported back to the same alarm.
+    """
+    if isinstance(target, datetime):
+        return {
+            "time": target.time().isoformat(),
+            "when": when.value,
+            "day": target.date().isoformat(),
+        }
+    if isinstance(target, RuleAlarm):
+        return {
+            "time": target.time.isoformat(),
+            "when": when.value,
+            "rule": format_recurrence(target.rule),
+        }
+    return {"time": target.isoformat(), "when": when.value}
+
+
+def encode_records(alarms: Iterable[Tuple[When, AlarmTarget]]) -> Iterator[str]:
+    """
+    Write alarms as JSON lines split into chunks.
+    """
+    chunk = []
+    for when, target in alarms:
+        chunk.append(json.dumps(encode_record(when, target)))
+        if len(chunk) == RECORDS_CHUNK_SIZE:
+            yield "\n".join(chunk)
+            chunk = []
+    if chunk:
+        yield "\n".join(chunk)
@@ -0,0 +1,166 @@
+import json
+import os
+import shutil
+import threading
+from datetime import datetime, time
+from typing import IO, Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from loguru import logger
+
+from alarmix.recurrence import (
+    AlarmTarget,
+    RuleAlarm,
+    format_recurrence,
+    parse_recurrence,
+)
+from alarmix.schema import When
+from alarmix.utils import remove_if_exists
+
+# Operation, alarm rule and alarm time.
+# Cancellations and auto alarms are stored with their dates,
+# custom alarms with their recurrence rules.
+JournalRecord = Tuple[str, When, AlarmTarget]
+# Imported alarms are written as one record,
+# so an interrupted import is never replayed partially.
+IMPORT_OP = "import"
+
+
+class AlarmJournal:
+    """
+    Append-only log of changes made after the last snapshot.
+
+    Records are written as JSON lines and passed to OS right away,
+    so acknowledged changes survive the daemon being killed,
+    but they are synced to disk in batches by persistence workers.
+    """
+
+    def __init__(self, path: str, changed: Optional[threading.Event] = None):
+        self.path = path
+        self.rotated_path = f"{path}.old"
+        self.file: Optional[IO[str]] = None
+        # Counters of records, synced ones reached the disk.
+        self.written = 0
+        self.syncing = 0
+        self.synced = 0
+        # Journals of all profiles may share one event.
+        self.changed = changed or threading.Event()
+
+    @property
+    def dirty(self) -> bool:
+        """
+        Some records aren't synced yet, they stay dirty if syncing fails.
+        """
+        return self.synced != self.written
+
+    @property
+    def size(self) -> int:
+        if self.file is None:
+            return 0
+        return self.file.tell()
+
+    def append(self, op: str, when: When, target: AlarmTarget) -> None:
+        self.write({"op": op, **encode_target(when, target)})
+
+    def append_import(self, alarms: Iterable[Tuple[When, AlarmTarget]]) -> None:
+        """
+        Write all added alarms as a single record.
+        """
+        records = [encode_target(when, target) for when, target in alarms]
+        self.write({"op": IMPORT_OP, "alarms": records})
+
+    def write(self, record: Dict[str, Any]) -> None:
+        if self.file is None:
+            self.file = open(self.path, "a", encoding="utf-8")
+        self.file.write(json.dumps(record) + "\n")
+        self.file.flush()
+        self.written += 1
+        self.changed.set()
+
+    def start_sync(self) -> None:
+        """
+        Take written records for the next `fsync`.
+        """
+        self.syncing = self.written
+
+    def fsync(self) -> None:
+        """
+        Make sure flushed records reached the disk.
+        """
+        file = self.file
+        if file is not None and not file.closed:
+            os.fsync(file.fileno())
+
+    def finish_sync(self) -> None:
+        """
+        Records taken by `start_sync` reached the disk.
+        """
+        self.synced = self.syncing
+
+    def rotate(self) -> None:
+        """
+        Move current records aside, so new ones are written to a fresh file.
+        Rotated records are removed once the snapshot is written.
+
+        If records rotated before still wait for their snapshot,
+        current ones are appended to them.
+        """
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        if not os.path.exists(self.path):
+            return
+        if not os.path.exists(self.rotated_path):
+            os.replace(self.path, self.rotated_path)
+            return
+        with open(self.rotated_path, "ab") as rotated, open(self.path, "rb") as current:
+            shutil.copyfileobj(current, rotated)
+        os.remove(self.path)
+
+    def drop_rotated(self) -> None:
+        remove_if_exists(self.rotated_path)
+
+    def replay(self) -> Iterator[JournalRecord]:
+        for path in (self.rotated_path, self.path):
+            if not os.path.exists(path):
+                continue
+            with open(path, "r", encoding="utf-8") as file:
+                for line in file:
+                    try:
+                        records = parse_line(line)
+                    except (ValueError, KeyError, TypeError):
+                        logger.warning(f"Skipping broken journal record: {line!r}")
+                        continue
+                    yield from records
+
+
+def encode_target(when: When, target: AlarmTarget) -> Dict[str, Any]:
+    record: Dict[str, Any] = {"when": when.value}
+    if isinstance(target, RuleAlarm):
+        record["at"] = target.time.isoformat()
+        record["rule"] = format_recurrence(target.rule)
+    else:
+        record["at"] = target.isoformat()
+    return record
+
+
+def parse_line(line: str) -> List[JournalRecord]:
+    """
+    Parse journal line, import records hold several added alarms.
+    """
+    record = json.loads(line)
+    if record["op"] == IMPORT_OP:
+        return [parse_record("add", alarm) for alarm in record["alarms"]]
+    return [parse_record(record["op"], record)]
+
+
+def parse_record(op: str, record: Dict[str, Any]) -> JournalRecord:
+    when = When(record["when"])
+    target: AlarmTarget
+    if op == "cancel" or when == When.auto:
+        target = datetime.fromisoformat(record["at"])
+    elif when == When.custom:
+        rule = parse_recurrence(record["rule"])
+        target = RuleAlarm(time.fromisoformat(record["at"]), rule)
+    else:
+        target = time.fromisoformat(record["at"])
+    return op, when, target
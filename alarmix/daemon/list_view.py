@@ -0,0 +1,285 @@
+import bisect
+import heapq
+from collections import defaultdict
+from datetime import date, datetime, time, timedelta
+from itertools import repeat
+from operator import attrgetter
+from typing import DefaultDict, Iterable, List, Mapping, Optional, Set, Tuple
+
+from alarmix.constants import WHEN_INDEX
+from alarmix.recurrence import AlarmTarget, RuleAlarm, next_rule_fire
+from alarmix.schema import DeltaAlarm, When
+from alarmix.utils import (
+    MINUTES_IN_DAY,
+    applies_on,
+    calculate_day_offset,
+    next_fire_offsets,
+)
+
+# Time of the day and alarm rule.
+ViewEntry = Tuple[time, When]
+
+# Views with more alarms compute remaining time for all of them at once.
+BATCH_THRESHOLD = 512
+
+
+class AlarmListView:
+    """
+    Cached alarms list returned by `AlarmManager.list_alarms`.
+
+    Alarms are grouped by day offset and kept sorted by time.
+    The list ordered by remaining time is made by rotating
+    every group at the current minute, so nothing is sorted on read.
+    The view is rebuilt once a day and updated in place on every change.
+    Copies share lists with the original view until they change them,
+    so views published to readers are copied cheaply.
+
+    Minutes and rule codes of entries are kept next to every group
+    for `next_fire_offsets`, which is used for big views.
+
+    Auto alarms may be set for any future date and custom alarms
+    may skip days, so they're kept aside with their exact fire moments
+    and merged into the rotated list.
+    """
+
+    def __init__(self, all_alarms: bool) -> None:
+        self.all_alarms = all_alarms
+        self.day: Optional[date] = None
+        self.groups: DefaultDict[int, List[ViewEntry]] = defaultdict(list)
+        self.minutes: DefaultDict[int, List[int]] = defaultdict(list)
+        self.kinds: DefaultDict[int, List[int]] = defaultdict(list)
+        # Number of entries in groups.
+        self.size = 0
+        # Sorted fire moments of auto alarms.
+        self.dated: List[datetime] = []
+        self.custom: Set[RuleAlarm] = set()
+        # Lists shared with the view this one was copied from.
+        self.shared_offsets: Set[int] = set()
+        self.shared_dated = False
+        self.shared_custom = False
+
+    def copy(self) -> "AlarmListView":
+        """
+        Copy which shares all lists with this view.
+        Lists are copied before they're changed,
+        so changes of the copy never affect this view.
+        """
+        view = AlarmListView(self.all_alarms)
+        view.day = self.day
+        view.groups.update(self.groups)
+        view.minutes.update(self.minutes)
+        view.kinds.update(self.kinds)
+        view.size = self.size
+        view.dated = self.dated
+        view.custom = self.custom
+        view.shared_offsets = set(self.groups)
+        view.shared_dated = True
+        view.shared_custom = True
+        return view
+
+    def writable_group(
+        self, offset: int
+    ) -> Tuple[List[ViewEntry], List[int], List[int]]:
+        if offset in self.shared_offsets:
+            self.shared_offsets.discard(offset)
+            self.groups[offset] = self.groups[offset].copy()
+            self.minutes[offset] = self.minutes[offset].copy()
+            self.kinds[offset] = self.kinds[offset].copy()
+        return self.groups[offset], self.minutes[offset], self.kinds[offset]
+
+    def writable_dated(self) -> List[datetime]:
+        if self.shared_dated:
+            self.shared_dated = False
+            self.dated = self.dated.copy()
+        return self.dated
+
+    def writable_custom(self) -> Set[RuleAlarm]:
+        if self.shared_custom:
+            self.shared_custom = False
+            self.custom = self.custom.copy()
+        return self.custom
+
+    def includes(self, target: AlarmTarget, when: When) -> bool:
+        if self.day is None:
+            return False
+        if self.all_alarms:
+            return True
+        if isinstance(target, datetime):
+            return target.date() == self.day
+        if isinstance(target, RuleAlarm):
+            return target.rule.occurs_on(self.day)
+        return applies_on(when, self.day)
+
+    def add(self, target: AlarmTarget, when: When) -> None:
+        if not self.includes(target, when):
+            return
+        if isinstance(target, datetime):
+            bisect.insort(self.writable_dated(), target)
+            return
+        if isinstance(target, RuleAlarm):
+            self.writable_custom().add(target)
+            return
+        entry = (target, when)
+        offset = self.offset(when)
+        group = self.groups.get(offset, [])
+        index = bisect.bisect_left(group, entry)
+        if index < len(group) and group[index] == entry:
+            return
+        group, minutes, kinds = self.writable_group(offset)
+        group.insert(index, entry)
+        minutes.insert(index, to_minute(target))
+        kinds.insert(index, WHEN_INDEX[when])
+        self.size += 1
+
+    def discard(self, target: AlarmTarget, when: When) -> None:
+        if not self.includes(target, when):
+            return
+        if isinstance(target, datetime):
+            index = bisect.bisect_left(self.dated, target)
+            if index < len(self.dated) and self.dated[index] == target:
+                del self.writable_dated()[index]
+            return
+        if isinstance(target, RuleAlarm):
+            if target in self.custom:
+                self.writable_custom().discard(target)
+            return
+        entry = (target, when)
+        offset = self.offset(when)
+        group = self.groups.get(offset, [])
+        index = bisect.bisect_left(group, entry)
+        if index < len(group) and group[index] == entry:
+            group, minutes, kinds = self.writable_group(offset)
+            del group[index]
+            del minutes[index]
+            del kinds[index]
+            self.size -= 1
+
+    def rebuild(
+        self,
+        alarms: Mapping[str, Iterable[AlarmTarget]],
+        day: date,
+    ) -> None:
+        """
+        Fill the view with alarms of the day, lists are made anew.
+        """
+        self.day = day
+        self.groups.clear()
+        self.minutes.clear()
+        self.kinds.clear()
+        self.dated = []
+        self.custom = set()
+        self.shared_offsets = set()
+        self.shared_dated = False
+        self.shared_custom = False
+        entries: List[ViewEntry] = []
+        for when_key, targets in alarms.items():
+            when = When(when_key)
+            for target in targets:
+                if not self.includes(target, when):
+                    continue
+                if isinstance(target, datetime):
+                    self.dated.append(target)
+                elif isinstance(target, RuleAlarm):
+                    self.custom.add(target)
+                else:
+                    entries.append((target, when))
+        self.size = len(entries)
+        self.dated.sort()
+        for entry in entries:
+            self.groups[self.offset(entry[1])].append(entry)
+        for offset, group in self.groups.items():
+            group.sort()
+            self.minutes[offset] = [to_minute(event_time) for event_time, _ in group]
+            self.kinds[offset] = [WHEN_INDEX[when] for _, when in group]
+
+    def read(self, now: datetime) -> List[DeltaAlarm]:
+        """
+        List alarms sorted by remaining time.
+        """
+        if self.day != now.date():
+            raise ValueError("Alarm list view is outdated")
+        if self.size >= BATCH_THRESHOLD:
+            alarms = self.read_batch(now)
+        else:
+            alarms = self.read_groups(now)
+        if not self.dated and not self.custom:
+            return alarms
+        return list(
+            heapq.merge(
+                alarms,
+                self.read_dated(now),
+                self.read_custom(now),
+                key=attrgetter("delta"),
+            )
+        )
+
+    def read_groups(self, now: datetime) -> List[DeltaAlarm]:
+        now_minute = now.hour * 60 + now.minute
+        minute_passed = now - now.replace(second=0, microsecond=0)
+        pivot = (time(now.hour, now.minute),)
+        alarms = []
+        for offset in sorted(self.groups):
+            group = self.groups[offset]
+            split = bisect.bisect_left(group, pivot)
+            for event_time, when in group[split:] + group[:split]:
+                alarm_minute = event_time.hour * 60 + event_time.minute
+                minutes = (alarm_minute - now_minute) % MINUTES_IN_DAY
+                delta = timedelta(days=offset, minutes=minutes) - minute_passed
+                alarms.append(DeltaAlarm(time=event_time, when=when, delta=delta))
+        return alarms
+
+    def read_batch(self, now: datetime) -> List[DeltaAlarm]:
+        """
+        Same as `read`, but remaining time is computed in one pass.
+        """
+        pivot = (time(now.hour, now.minute),)
+        entries: List[ViewEntry] = []
+        minutes: List[int] = []
+        kinds: List[int] = []
+        for offset in sorted(self.groups):
+            group = self.groups[offset]
+            split = bisect.bisect_left(group, pivot)
+            entries += group[split:] + group[:split]
+            group_minutes = self.minutes[offset]
+            minutes += group_minutes[split:] + group_minutes[:split]
+            group_kinds = self.kinds[offset]
+            kinds += group_kinds[split:] + group_kinds[:split]
+        if not entries:
+            return []
+        deltas = next_fire_offsets(minutes, kinds, now)
+        times, whens = zip(*entries)
+        return list(map(DeltaAlarm._make, zip(times, whens, deltas, repeat(None))))
+
+    def read_dated(self, now: datetime) -> List[DeltaAlarm]:
+        return [
+            DeltaAlarm(time=target.time(), when=When.auto, delta=target - now)
+            for target in self.dated
+        ]
+
+    def read_custom(self, now: datetime) -> List[DeltaAlarm]:
+        """
+        Custom alarms sorted by their next fires.
+        Alarms whose rules are over are skipped.
+        """
+        after = now.replace(second=0, microsecond=0)
+        alarms = []
+        for alarm in self.custom:
+            fire_at = next_rule_fire(alarm, after)
+            if fire_at is not None:
+                alarms.append(
+                    DeltaAlarm(
+                        time=alarm.time,
+                        when=When.custom,
+                        delta=fire_at - now,
+                        rule=alarm.rule,
+                    )
+                )
+        alarms.sort(key=attrgetter("delta"))
+        return alarms
+
+    def offset(self, when: When) -> int:
+        return calculate_day_offset(when, self.day)
+
+
+def to_minute(event_time: time) -> int:
+    return event_time.hour * 60 + event_time.minute
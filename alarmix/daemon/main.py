@@ -1,30 +1,49 @@
 import os
 import signal
 from argparse import ArgumentParser, Namespace
+from datetime import datetime, timedelta
 from pathlib import Path
-from typing import Callable, List
+from time import perf_counter
+from types import FrameType
+from typing import Callable, List, Optional
 
-from daemonize import Daemonize
 from loguru import logger
 
-from alarmix.daemon.alarm_manager import AlarmManager
-from alarmix.daemon.buzzer import BuzzerThread
-from alarmix.daemon.server import ServerThread
-from alarmix.exceptions import SoundFileNotFound
-from alarmix.utils import SOCKET_NAME
+from alarmix.constants import DAEMON_LOG_FILE, DAEMON_PID_FILE, SOCKET_NAME, CatchUp
+from alarmix.exceptions import SnapshotCorrupted, SoundFileNotFound
+
+# Modules of engines, simulation and daemonize are imported
+# only by commands which use them, so the daemon starts fast
+# and `alarmd kill` doesn't load the whole daemon.
+
+DEFAULT_BACKUP = f"{Path.home()}/.alarms.bin"
+# Older versions pickled alarms to this file.
+LEGACY_BACKUP = f"{Path.home()}/.alarms.pickle"
 
 
 def parse_args() -> Namespace:
     arg_parse = ArgumentParser()
     sub_parsers = arg_parse.add_subparsers(dest="namespace")
     kill_parser = sub_parsers.add_parser("kill", help="Kill running daemon if any")
+    simulate_parser = sub_parsers.add_parser(
+        "simulate", help="Show when stored alarms will fire without waiting"
+    )
+    simulate_parser.add_argument(
+        "--days", type=float, default=7, help="Number of days to simulate"
+    )
+    simulate_parser.add_argument(
+        "--start",
+        type=datetime.fromisoformat,
+        default=None,
+        help="Simulation start in ISO format, now by default",
+    )
     arg_parse.add_argument(
         "--socket", type=str, default=SOCKET_NAME, help="Socket file to listen"
     )
     arg_parse.add_argument(
         "--backup",
         type=str,
-        default=f"{Path.home()}/.alarms.pickle",
+        default=DEFAULT_BACKUP,
         help="File where to store all alarms data",
     )
     arg_parse.add_argument(
@@ -34,6 +53,44 @@ def parse_args() -> Namespace:
         default=f"{Path.home()}/alarm.mp3",
         help="Sound to play when alarm clock fires",
     )
+    arg_parse.add_argument(
+        "--escalation-sound",
+        dest="escalation_sounds",
+        action="append",
+        default=[],
+        help="Sound to play if alarm isn't stopped in time, may be repeated",
+    )
+    arg_parse.add_argument(
+        "--escalate-after",
+        type=float,
+        default=60,
+        help="Play the next escalation sound after this number of seconds",
+    )
+    arg_parse.add_argument(
+        "--catch-up",
+        type=str,
+        default=CatchUp.once.value,
+        choices=[policy.value for policy in CatchUp],
+        help="What to do with alarms missed during suspend, clock jumps or restarts",
+    )
+    arg_parse.add_argument(
+        "--catch-up-window",
+        type=float,
+        default=60,
+        help="Alarms missed by more than this number of minutes are skipped",
+    )
+    arg_parse.add_argument(
+        "--player",
+        type=str,
+        default="mpv",
+        help="Player to run, it gets the same options as mpv",
+    )
+    arg_parse.add_argument(
+        "--preload",
+        type=float,
+        default=10,
+        help="Start paused player this number of seconds before alarm, 0 disables",
+    )
     arg_parse.add_argument(
         "-d",
         "--daemonize",
@@ -45,40 +102,167 @@ def parse_args() -> Namespace:
         "--log-file",
         type=str,
         dest="log_file",
-        default="/tmp/alarmd.log",
+        default=DAEMON_LOG_FILE,
         help="Log file",
     )
+    arg_parse.add_argument(
+        "--engine",
+        type=str,
+        choices=["threads", "asyncio"],
+        default="threads",
+        help="Serve clients with a pair of threads or with asyncio event loop",
+    )
+    arg_parse.add_argument(
+        "--shared",
+        action="store_true",
+        help="Let all users connect, everyone gets their own alarms",
+    )
+    arg_parse.add_argument(
+        "--metrics-file",
+        type=str,
+        dest="metrics_file",
+        default=None,
+        help="Periodically dump stats to this file in Prometheus text format",
+    )
+    arg_parse.add_argument(
+        "--exit-idle",
+        type=float,
+        default=0,
+        help=(
+            "Exit after this number of seconds without alarms, timers and clients, "
+            "0 keeps daemon running"
+        ),
+    )
     for parser in (arg_parse, kill_parser):
         parser.add_argument(
             "-p",
             "--pid-file",
             type=str,
             dest="pid",
-            default="/tmp/alarmd.pid",
+            default=DAEMON_PID_FILE,
             help="Daemon process ID file",
         )
     return arg_parse.parse_args()
 
 
+def migrate_legacy_backup(backup: str) -> None:
+    """
+    Move alarms from the old default location.
+    AlarmManager converts them to the new format on load.
+    """
+    if backup != DEFAULT_BACKUP or os.path.exists(backup):
+        return
+    for suffix in ("", ".journal", ".journal.old"):
+        if os.path.exists(f"{LEGACY_BACKUP}{suffix}"):
+            os.replace(f"{LEGACY_BACKUP}{suffix}", f"{backup}{suffix}")
+
+
+def dump_metrics(args: Namespace) -> None:
+    from alarmix.daemon.stats import stats
+
+    if args.metrics_file is not None:
+        stats.dump_prometheus(args.metrics_file)
+
+
+def exit_on_sigterm(signum: int, frame: Optional[FrameType]) -> None:
+    """
+    Stop threads engine, `alarmd kill` sends SIGTERM.
+    Exit is raised in the main thread, so alarms are saved while it unwinds.
+    """
+    raise SystemExit(0)
+
+
 def run_threads(args: Namespace) -> None:
-    local_manager = AlarmManager(args.backup)
-    local_manager.load_alarms()
-    server = ServerThread(local_manager, args)
-    buzzer = BuzzerThread(local_manager, args)
+    from alarmix.daemon.buzzer import BuzzerThread, ReaperThread, WakeupThread
+    from alarmix.daemon.persistence import PersistenceThread
+    from alarmix.daemon.profiles import AlarmProfiles
+    from alarmix.daemon.server import ServerThread
+    from alarmix.daemon.stats import MetricsThread
+
+    profiles = AlarmProfiles(args.backup)
+    profiles.load_all()
+    server = ServerThread(profiles, args)
+    buzzer = BuzzerThread.from_args(profiles, args)
+    persistence = PersistenceThread(profiles)
+    reaper = ReaperThread(buzzer)
     try:
         server.daemon = True
         buzzer.daemon = True
+        persistence.daemon = True
+        reaper.daemon = True
 
+        reaper.install_handler()
+        signal.signal(signal.SIGTERM, exit_on_sigterm)
         server.start()
         buzzer.start()
+        persistence.start()
+        reaper.start()
+        if buzzer.wall_timer.fd is not None:
+            wakeup = WakeupThread(buzzer)
+            wakeup.daemon = True
+            wakeup.start()
+        if args.metrics_file is not None:
+            metrics = MetricsThread(args.metrics_file)
+            metrics.daemon = True
+            metrics.start()
 
+        # Server returns only when daemon exits being idle.
         server.join()
-        buzzer.join()
     finally:
         server.finalize()
         buzzer.finalize()
+        dump_metrics(args)
+        logger.info("Goodbye, cowboy")
+
+
+def run_asyncio(args: Namespace) -> None:
+    import asyncio
+
+    from alarmix.daemon.async_engine import AsyncDaemon
+    from alarmix.daemon.profiles import AlarmProfiles
+
+    profiles = AlarmProfiles(args.backup)
+    profiles.load_all()
+    daemon = AsyncDaemon(profiles, args)
+    try:
+        asyncio.run(daemon.serve())
+    finally:
+        daemon.finalize()
+        dump_metrics(args)
         logger.info("Goodbye, cowboy")
-        raise
+
+
+def simulate_schedule(args: Namespace) -> None:
+    """
+    Replay stored alarms of all profiles on a simulated clock.
+    Backup is copied, so running daemon isn't affected.
+    """
+    import shutil
+    import tempfile
+
+    from alarmix.daemon.clock import SimulatedClock
+    from alarmix.daemon.profiles import AlarmProfiles
+    from alarmix.daemon.simulation import simulate
+
+    start = args.start or datetime.now()
+    with tempfile.TemporaryDirectory() as work_dir:
+        dump_file = os.path.join(work_dir, os.path.basename(args.backup))
+        for suffix in ("", ".journal", ".journal.old"):
+            if os.path.exists(f"{args.backup}{suffix}"):
+                shutil.copy(f"{args.backup}{suffix}", f"{dump_file}{suffix}")
+        profiles = AlarmProfiles(dump_file, SimulatedClock(start))
+        if os.path.isdir(f"{args.backup}.profiles"):
+            shutil.copytree(f"{args.backup}.profiles", profiles.profiles_dir)
+        profiles.load_all()
+        started = perf_counter()
+        fires = simulate(profiles, start + timedelta(days=args.days))
+        elapsed = perf_counter() - started
+    for fire in fires:
+        print(f"{fire.fire_at:%a %Y-%m-%d %H:%M}\t{fire.when}\t{fire.profile}")
+    print(
+        f"{len(fires)} alarms fired in {args.days:g} days, "
+        f"simulated in {elapsed * 1000:.1f} ms"
+    )
 
 
 def gracefully_kill_daemon(pid_file: str) -> None:
@@ -91,12 +275,16 @@ def gracefully_kill_daemon(pid_file: str) -> None:
 
 def start_program(args: Namespace) -> None:
     logger.add(args.log_file, rotation="10 MB")
+    migrate_legacy_backup(args.backup)
     try:
-        run_threads(args)
+        if args.engine == "asyncio":
+            run_asyncio(args)
+        else:
+            run_threads(args)
     except KeyboardInterrupt:
         print()
         logger.debug("Stopped by keyboard.")
-    except SoundFileNotFound as e:
+    except (SoundFileNotFound, SnapshotCorrupted) as e:
         logger.debug(f"Exception found: {e}")
 
 
@@ -111,13 +299,25 @@ def main() -> None:
     args = parse_args()
     if args.namespace == "kill":
         gracefully_kill_daemon(args.pid)
+    elif args.namespace == "simulate":
+        simulate_schedule(args)
     else:
+        from alarmix.daemon.activation import inherited_socket
+
+        # Taken before daemonizing, since LISTEN_PID is the pid of this process.
+        args.listen_socket = inherited_socket()
         if args.daemonize:
+            from daemonize import Daemonize
+
+            keep_fds = []
+            if args.listen_socket is not None:
+                keep_fds.append(args.listen_socket.fileno())
             daemon = Daemonize(
                 "alarmix-daemon",
                 args.pid,
                 start_program,
                 privileged_action=privileged_args(args),
+                keep_fds=keep_fds,
             )
             daemon.start()
         else:
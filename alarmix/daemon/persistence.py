@@ -0,0 +1,51 @@
+import threading
+from time import sleep
+
+from loguru import logger
+
+from alarmix.daemon import lock
+from alarmix.daemon.profiles import AlarmProfiles
+from alarmix.daemon.stats import stats
+
+# Changes made during this period are synced to disk together.
+SYNC_INTERVAL = 1.0
+
+
+class PersistenceThread(threading.Thread):
+    """
+    Syncs journals of all profiles to disk and compacts them
+    into snapshots, so requests never wait for disk.
+
+    Changes made during SYNC_INTERVAL are persisted together.
+    Only copies of alarms are taken under the lock,
+    snapshots are encoded and written after it's released.
+    """
+
+    def __init__(self, profiles: AlarmProfiles):
+        threading.Thread.__init__(self)
+        self.profiles = profiles
+
+    def run(self) -> None:
+        logger.debug("Started persistence thread.")
+        while True:
+            self.profiles.journal_changed.wait()
+            sleep(SYNC_INTERVAL)
+            try:
+                self.persist()
+            except OSError as err:
+                # Journals which weren't synced stay dirty, they're retried.
+                logger.exception(err)
+                self.profiles.journal_changed.set()
+
+    def persist(self) -> None:
+        with stats.timer("persist_seconds"):
+            with stats.locked(lock, "persistence"):
+                self.profiles.journal_changed.clear()
+                changed = [
+                    manager
+                    for manager in self.profiles.managers.values()
+                    if manager.journal.dirty
+                ]
+                snapshots = [manager.prepare_persist() for manager in changed]
+            for manager, snapshot in zip(changed, snapshots):
+                manager.finish_persist(snapshot)
@@ -0,0 +1,195 @@
+import os
+import shutil
+import socket
+import subprocess
+import tempfile
+import time
+from typing import Dict, List, Optional, Set
+
+from loguru import logger
+
+# Options passed to every player, any player must accept them.
+PLAYER_OPTIONS = ["--really-quiet", "--loop", "--no-video"]
+# mpv IPC command which starts a paused player.
+RESUME_COMMAND = b'{"command": ["set_property", "pause", false]}\n'
+IPC_TIMEOUT = 0.5
+# Player creates IPC socket shortly after it starts,
+# so connection is retried for this number of seconds.
+IPC_CONNECT_TIMEOUT = 1.0
+IPC_RETRY_DELAY = 0.02
+# Preloading is disabled after this number of failed resumes in a row.
+MAX_RESUME_FAILURES = 3
+
+
+class Player:
+    """
+    Player process of one alarm.
+    """
+
+    def __init__(
+        self,
+        process: "subprocess.Popen[bytes]",
+        ipc_path: Optional[str] = None,
+    ) -> None:
+        self.process = process
+        self.ipc_path = ipc_path
+        # Profile of the alarm, set when the player starts playing.
+        self.owner: Optional[str] = None
+
+    @property
+    def pid(self) -> int:
+        return self.process.pid
+
+    def is_running(self) -> bool:
+        return self.process.poll() is None
+
+    def resume(self) -> bool:
+        """
+        Unpause preloaded player through its IPC socket.
+        """
+        if self.ipc_path is None:
+            return False
+        deadline = time.monotonic() + IPC_CONNECT_TIMEOUT
+        while self.is_running():
+            try:
+                with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as conn:
+                    conn.settimeout(IPC_TIMEOUT)
+                    conn.connect(self.ipc_path)
+                    conn.sendall(RESUME_COMMAND)
+                return True
+            except (FileNotFoundError, ConnectionRefusedError) as err:
+                # Socket isn't created yet or isn't listened yet.
+                if time.monotonic() >= deadline:
+                    logger.warning(f"Can't resume preloaded player: {err}")
+                    return False
+                time.sleep(IPC_RETRY_DELAY)
+            except OSError as err:
+                logger.warning(f"Can't resume preloaded player: {err}")
+                return False
+        return False
+
+
+class PlayerPool:
+    """
+    Player processes of ringing alarms of all profiles.
+
+    Before the next deadline a paused player is preloaded,
+    so at fire time it's only unpaused. Players which can't be
+    controlled through mpv IPC are replaced by a player started
+    at fire time, preloading is disabled if it fails repeatedly.
+    Finished players are reaped by `reap`, engines call it on SIGCHLD.
+    """
+
+    def __init__(self, player: str, sound: str, preload: float) -> None:
+        self.player = player
+        self.sound = sound
+        self.preload = preload
+        self.runtime_dir: Optional[str] = None
+        self.preloaded: Optional[Player] = None
+        self.playing: Dict[int, Player] = {}
+        # Stopped players which haven't exited yet.
+        self.stopping: List[Player] = []
+        self.spawned = 0
+        # Preloaded players which failed to resume in a row.
+        self.resume_failures = 0
+
+    def spawn(self, paused: bool, sound: Optional[str] = None) -> Player:
+        options = list(PLAYER_OPTIONS)
+        ipc_path = None
+        if paused:
+            if self.runtime_dir is None:
+                self.runtime_dir = tempfile.mkdtemp(prefix="alarmd-")
+            self.spawned += 1
+            ipc_path = os.path.join(self.runtime_dir, f"player-{self.spawned}.sock")
+            options += ["--pause", f"--input-ipc-server={ipc_path}"]
+        process = subprocess.Popen([self.player, *options, sound or self.sound])
+        return Player(process, ipc_path)
+
+    def warm(self) -> None:
+        """
+        Preload paused player if there's none.
+        """
+        if self.preload <= 0:
+            return
+        if self.preloaded is not None and self.preloaded.is_running():
+            return
+        logger.debug("Preloading player")
+        self.preloaded = self.spawn(paused=True)
+
+    def play(self, owner: str, sound: Optional[str] = None) -> int:
+        """
+        Start playing alarm of the profile and return player's pid.
+        Preloaded player is used only for the main sound.
+        """
+        player = self.preloaded
+        if sound is not None and sound != self.sound:
+            player = None
+        else:
+            self.preloaded = None
+        if player is not None and player.resume():
+            self.resume_failures = 0
+        else:
+            if player is not None:
+                self.drop_preloaded(player)
+            player = self.spawn(paused=False, sound=sound)
+        player.owner = owner
+        self.playing[player.pid] = player
+        return player.pid
+
+    def drop_preloaded(self, player: Player) -> None:
+        """
+        Kill player which failed to resume, e.g. one without mpv IPC.
+        """
+        if player.is_running():
+            player.process.kill()
+            self.stopping.append(player)
+        self.resume_failures += 1
+        if self.resume_failures >= MAX_RESUME_FAILURES:
+            logger.warning(
+                f"Preloaded players failed to resume {self.resume_failures} times "
+                "in a row, preloading disabled"
+            )
+            self.preload = 0
+
+    def is_playing(self, owner: str) -> bool:
+        return any(player.owner == owner for player in self.playing.values())
+
+    def stop_all(self, owner: str) -> int:
+        """
+        Stop all ringing alarms of the profile and return how many were stopped.
+        """
+        stopped = [pid for pid, player in self.playing.items() if player.owner == owner]
+        for pid in stopped:
+            player = self.playing.pop(pid)
+            player.process.terminate()
+            self.stopping.append(player)
+        return len(stopped)
+
+    def reap(self) -> Set[str]:
+        """
+        Collect exited players.
+        Returns profiles whose alarms stopped ringing by themselves.
+        """
+        finished = [
+            pid for pid, player in self.playing.items() if not player.is_running()
+        ]
+        owners = set()
+        for pid in finished:
+            owner = self.playing.pop(pid).owner
+            if owner is not None:
+                owners.add(owner)
+        self.stopping = [player for player in self.stopping if player.is_running()]
+        if self.preloaded is not None and not self.preloaded.is_running():
+            self.preloaded = None
+        return owners
+
+    def close(self) -> None:
+        """
+        Kill preloaded player. Ringing alarms are left playing.
+        """
+        if self.preloaded is not None:
+            self.preloaded.process.kill()
+            self.preloaded.process.wait()
+            self.preloaded = None
+        if self.runtime_dir is not None:
+            shutil.rmtree(self.runtime_dir, ignore_errors=True)
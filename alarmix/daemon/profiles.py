@@ -0,0 +1,220 @@
+import json
+import os
+import re
+import socket
+import struct
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, Optional, Set
+
+from loguru import logger
+
+from alarmix.constants import DEFAULT_PROFILE
+from alarmix.daemon.alarm_manager import AlarmManager
+from alarmix.daemon.clock import Clock
+from alarmix.daemon.player import PlayerPool
+from alarmix.daemon.scheduler import AlarmScheduler
+from alarmix.daemon.timer_wheel import TimerWheel
+
+PROFILE_NAME = re.compile(r"[A-Za-z0-9_-]{1,64}")
+# Profiles of other users are prefixed with their uid.
+PROFILE_KEY = re.compile(r"(\d+\.)?[A-Za-z0-9_-]{1,64}")
+# pid, uid and gid of the connected process.
+PEER_CREDENTIALS = struct.Struct("3i")
+DUMP_SUFFIX = ".bin"
+
+
+class AlarmProfiles:
+    """
+    Alarm sets of all users and profiles served by one daemon.
+
+    Every profile has its own AlarmManager and persistence files,
+    but all of them share the clock, scheduler heap, timers
+    and player pool, so the daemon waits for a single deadline
+    whatever number of profiles it serves.
+
+    The default profile is stored in the backup file,
+    others are kept in the directory next to it.
+    Moments up to which alarms of every profile were handled
+    are kept next to it too, so alarms missed while daemon
+    wasn't running are caught up whenever the profile is loaded.
+    """
+
+    def __init__(self, backup: str, clock: Optional[Clock] = None) -> None:
+        self.backup = backup
+        self.profiles_dir = f"{backup}.profiles"
+        self.checked_file = f"{backup}.checked"
+        self.clock = clock or Clock()
+        self.scheduler = AlarmScheduler()
+        # Timers of snoozed and escalating alarms.
+        self.timers = TimerWheel(self.clock.now())
+        # Set by journals of all profiles, so one worker persists them.
+        self.journal_changed = threading.Event()
+        self.players: Optional[PlayerPool] = None
+        self.managers: Dict[str, AlarmManager] = {}
+        # Minutes up to which alarms of profiles were handled, as saved on disk.
+        self.checked = self.read_checked()
+
+    @property
+    def version(self) -> int:
+        """
+        Changed every time any of profiles is changed.
+        """
+        return sum(manager.version for manager in self.managers.values())
+
+    def dump_file(self, key: str) -> str:
+        if key == DEFAULT_PROFILE:
+            return self.backup
+        return os.path.join(self.profiles_dir, f"{key}{DUMP_SUFFIX}")
+
+    def get(self, key: str) -> AlarmManager:
+        """
+        Get manager of the profile, loading it on the first request.
+        """
+        manager = self.managers.get(key)
+        if manager is not None:
+            return manager
+        if key != DEFAULT_PROFILE:
+            os.makedirs(self.profiles_dir, mode=0o700, exist_ok=True)
+        manager = AlarmManager(
+            self.dump_file(key),
+            self.clock,
+            self.scheduler,
+            key,
+            self.journal_changed,
+            self.timers,
+        )
+        manager.players = self.players
+        manager.load_alarms(self.resume_point(key))
+        self.managers[key] = manager
+        return manager
+
+    def stored_keys(self) -> Set[str]:
+        keys = {DEFAULT_PROFILE}
+        if os.path.isdir(self.profiles_dir):
+            for file_name in os.listdir(self.profiles_dir):
+                key = file_name.partition(DUMP_SUFFIX)[0]
+                if PROFILE_KEY.fullmatch(key):
+                    keys.add(key)
+        return keys
+
+    def load_all(self) -> None:
+        """
+        Load every profile stored on disk, so their alarms are fired.
+        """
+        keys = self.stored_keys()
+        for key in sorted(keys):
+            self.get(key)
+        logger.debug(f"Loaded {len(keys)} profiles")
+
+    def read_checked(self) -> Dict[str, datetime]:
+        try:
+            with open(self.checked_file, "r") as file:
+                content = file.read().strip()
+        except OSError:
+            return {}
+        try:
+            if not content.startswith("{"):
+                # Older versions kept a single moment for all profiles.
+                moment = datetime.fromisoformat(content)
+                return {key: moment for key in self.stored_keys()}
+            return {
+                key: datetime.fromisoformat(value)
+                for key, value in json.loads(content).items()
+            }
+        except (ValueError, TypeError, AttributeError) as err:
+            logger.warning(f"Ignoring malformed {self.checked_file}: {err}")
+            return {}
+
+    def resume_point(self, key: str) -> Optional[datetime]:
+        """
+        The first minute whose alarms of the profile weren't handled.
+        None if nothing is known about it or the clock was set back since.
+        """
+        checked = self.checked.get(key)
+        if checked is None:
+            return None
+        after = checked.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        if after > self.clock.now():
+            return None
+        return after
+
+    def mark_checked(self, moment: datetime) -> None:
+        """
+        Remember that alarms of loaded profiles due by the moment were handled.
+
+        Fires are planned by minutes, so the file is written
+        only when the minute of some profile changes.
+        """
+        minute = moment.replace(second=0, microsecond=0)
+        checked = dict(self.checked)
+        checked.update((key, minute) for key in self.managers)
+        if checked == self.checked:
+            return
+        temp_file = f"{self.checked_file}.tmp"
+        with open(temp_file, "w") as file:
+            json.dump({key: value.isoformat() for key, value in checked.items()}, file)
+        os.replace(temp_file, self.checked_file)
+        self.checked = checked
+
+    def attach_players(self, players: PlayerPool) -> None:
+        """
+        Called by buzzer, alarms are never played without players.
+        """
+        self.players = players
+        for manager in self.managers.values():
+            manager.players = players
+
+    def is_idle(self) -> bool:
+        """
+        Nothing is scheduled, ringing or waiting to be saved,
+        so daemon may exit until somebody needs it.
+        """
+        if len(self.timers) or (self.players is not None and self.players.playing):
+            return False
+        for manager in self.managers.values():
+            if manager.journal.dirty or any(manager.alarms.values()):
+                return False
+        return True
+
+    def cleanup(self) -> None:
+        for manager in self.managers.values():
+            manager.cleanup()
+
+    def dump_alarms(self) -> None:
+        for manager in self.managers.values():
+            manager.dump_alarms()
+
+
+def profile_key(uid: Optional[int], profile: Optional[str]) -> str:
+    """
+    Key of the profile requested by client.
+
+    Profiles of the daemon owner are keyed by their names,
+    other users get their uid prepended, so they can reach
+    only their own alarms.
+
+    :raises ValueError: if profile name is invalid.
+    """
+    name = profile or DEFAULT_PROFILE
+    if not PROFILE_NAME.fullmatch(name):
+        raise ValueError(f"Invalid profile name '{name}'")
+    if uid is None or uid == os.getuid():
+        return name
+    return f"{uid}.{name}"
+
+
+def peer_uid(sock: socket.socket) -> Optional[int]:
+    """
+    Get uid of the process connected to unix socket.
+    None means that the platform doesn't tell it.
+    """
+    option = getattr(socket, "SO_PEERCRED", None)
+    if option is None:
+        return None
+    try:
+        credentials = sock.getsockopt(socket.SOL_SOCKET, option, PEER_CREDENTIALS.size)
+    except OSError:
+        return None
+    _, uid, _ = PEER_CREDENTIALS.unpack(credentials)
+    return uid
@@ -0,0 +1,94 @@
+import heapq
+from datetime import datetime, time
+from typing import Iterable, List, Mapping, Optional, Set, Tuple, Union
+
+from alarmix.constants import DEFAULT_PROFILE
+from alarmix.recurrence import AlarmTarget, RuleAlarm, next_rule_fire
+from alarmix.schema import When
+from alarmix.utils import next_fire_time
+
+# Fire moment, alarm rule, time of the day (or custom alarm)
+# and profile of the alarm.
+ScheduleEntry = Tuple[datetime, When, Union[time, RuleAlarm], str]
+
+
+class AlarmScheduler:
+    """
+    Min-heap of upcoming alarm fires.
+
+    One heap is shared by all profiles served by the daemon.
+    Deleted and cancelled alarms are not removed from the heap,
+    they're dropped when they reach the top of it.
+    """
+
+    def __init__(self) -> None:
+        self.heap: List[ScheduleEntry] = []
+        self.queued: Set[ScheduleEntry] = set()
+
+    def push(
+        self,
+        fire_at: datetime,
+        when: When,
+        event_time: Union[time, RuleAlarm],
+        profile: str = DEFAULT_PROFILE,
+    ) -> None:
+        entry = (fire_at, when, event_time, profile)
+        if entry in self.queued:
+            return
+        self.queued.add(entry)
+        heapq.heappush(self.heap, entry)
+
+    def schedule(
+        self,
+        target: AlarmTarget,
+        when: When,
+        now: datetime,
+        profile: str = DEFAULT_PROFILE,
+    ) -> None:
+        """
+        Add next fire of the alarm to the heap.
+        Custom alarms whose rules are over
+        and auto alarms earlier than `now` aren't added.
+        """
+        after = now.replace(second=0, microsecond=0)
+        if isinstance(target, datetime):
+            if target >= after:
+                self.push(target, when, target.time(), profile)
+        elif isinstance(target, RuleAlarm):
+            fire_at = next_rule_fire(target, after)
+            if fire_at is not None:
+                self.push(fire_at, when, target, profile)
+        else:
+            self.push(next_fire_time(target, when, after), when, target, profile)
+
+    def plan(
+        self,
+        alarms: Mapping[str, Iterable[AlarmTarget]],
+        now: datetime,
+        profile: str = DEFAULT_PROFILE,
+    ) -> None:
+        """
+        Add next fires of all alarms of the profile.
+        """
+        for when_key, targets in alarms.items():
+            for target in targets:
+                self.schedule(target, When(when_key), now, profile)
+
+    def is_queued(self, entry: ScheduleEntry) -> bool:
+        return entry in self.queued
+
+    def next_deadline(self) -> Optional[datetime]:
+        if not self.heap:
+            return None
+        return self.heap[0][0]
+
+    def pop_due(self, now: datetime) -> List[ScheduleEntry]:
+        """
+        Remove and return all entries which should have been fired by now.
+        """
+        due = []
+        while self.heap and self.heap[0][0] <= now:
+            entry = heapq.heappop(self.heap)
+            self.queued.discard(entry)
+            due.append(entry)
+        return due
@@ -1,47 +1,255 @@
-import json
+import os
 import socket
 import threading
 from argparse import Namespace
+from typing import Iterable, List, Optional, Set
 
 from loguru import logger
 
-from alarmix.daemon import lock
-from alarmix.daemon.alarm_manager import AlarmManager
-from alarmix.schema import TimeMessageSocket
+from alarmix.constants import RequestAction
+from alarmix.daemon import schedule_changed
+from alarmix.daemon.alarm_manager import READ_ACTIONS, AlarmManager
+from alarmix.daemon.codec import (
+    MAX_IMPORT_RECORDS,
+    decode_records,
+    decode_request,
+    encode_info_list,
+)
+from alarmix.daemon.profiles import AlarmProfiles, peer_uid, profile_key
+from alarmix.daemon.stats import stats
+from alarmix.protocol import (
+    LEGACY_MESSAGE_SIZE,
+    encode_handshake,
+    parse_handshake,
+    recv_frame,
+    send_frame,
+)
+from alarmix.schema import AlarmRecord, TimeMessageSocket
 from alarmix.utils import remove_if_exists
 
 
 class ServerThread(threading.Thread):
-    def __init__(self, manager: AlarmManager, args: Namespace):
+    """
+    Serves clients one by one.
+
+    If `exit_idle` is set, thread returns once daemon
+    had no clients and nothing to do for that number of seconds.
+    """
+
+    def __init__(self, profiles: AlarmProfiles, args: Namespace):
         threading.Thread.__init__(self)
-        self.manager = manager
+        self.profiles = profiles
         self.socket = args.socket
+        self.shared = args.shared
+        # Socket passed by the service manager, it owns the socket file.
+        self.listen_socket: Optional[socket.socket] = args.listen_socket
+        self.exit_idle: float = args.exit_idle
+        self.watchers: Set[threading.Thread] = set()
 
     def finalize(self) -> None:
-        remove_if_exists(self.socket)
+        if self.listen_socket is None:
+            remove_if_exists(self.socket)
 
-    def run(self) -> None:
-        logger.info("Started daemon")
+    def bind(self) -> socket.socket:
+        if self.listen_socket is not None:
+            logger.debug("Using socket passed by the service manager")
+            return self.listen_socket
         remove_if_exists(self.socket)
         server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
         server.bind(self.socket)
+        if self.shared:
+            # Every user gets own alarms, they're told apart by peer uid.
+            os.chmod(self.socket, 0o666)
         logger.debug(f"Successfully bound {self.socket}")
+        return server
+
+    def is_idle(self) -> bool:
+        self.watchers = {watcher for watcher in self.watchers if watcher.is_alive()}
+        with schedule_changed:
+            return not self.watchers and self.profiles.is_idle()
+
+    def run(self) -> None:
+        logger.info("Started daemon")
+        server = self.bind()
+        if self.exit_idle:
+            server.settimeout(self.exit_idle)
         while True:
             server.listen(1)
-            conn, addr = server.accept()
-            msg_str = conn.recv(1024)
-            if msg_str:
-                params = msg_str.decode("utf-8")
+            try:
+                conn, addr = server.accept()
+            except socket.timeout:
+                if self.is_idle():
+                    logger.info(f"Idle for {self.exit_idle:g} seconds, exiting")
+                    return
+                continue
+            with conn:
                 try:
-                    message = TimeMessageSocket(**json.loads(params))
-                    lock.acquire()
-                    message = self.manager.process_message(message)
-                    lock.release()
-                    conn.sendall(message.encode("utf-8"))
-                except ValueError as err:
-                    logger.exception(err)
-                    conn.sendall(str(err).encode("utf-8"))
+                    self.handle_connection(conn)
                 except Exception as ex:
                     logger.exception(ex)
-                    conn.sendall(str(ex).encode("utf-8"))
-                conn.close()
+
+    def handle_connection(self, conn: socket.socket) -> None:
+        msg_str = conn.recv(LEGACY_MESSAGE_SIZE)
+        if not msg_str:
+            return
+        uid = peer_uid(conn)
+        version = parse_handshake(msg_str)
+        if version is None:
+            # Old clients send a single message and read a single reply.
+            reply = "\n".join(self.answer(msg_str, uid, False))
+            conn.sendall(reply.encode("utf-8"))
+            return
+        conn.sendall(encode_handshake(version))
+        payload = recv_frame(conn)
+        if payload is None:
+            return
+        parts: Iterable[str]
+        try:
+            request = decode_request(payload)
+            if request.action == RequestAction.import_:
+                request.records.extend(self.receive_records(conn))
+        except ValueError as err:
+            logger.exception(err)
+            parts = [str(err)]
+        else:
+            if request.action == RequestAction.watch:
+                self.watch(conn, request, uid)
+                return
+            parts = self.process(request, uid, True)
+        for part in parts:
+            send_frame(conn, part.encode("utf-8"))
+        send_frame(conn, b"")
+
+    def receive_records(self, conn: socket.socket) -> List[AlarmRecord]:
+        """
+        Read imported alarms until the empty frame.
+
+        Frames are read till the end even if some records are malformed
+        or there are too many of them, so the client gets the error
+        instead of a broken pipe. Frames after the error are dropped.
+
+        :raises ValueError: if any of records is malformed
+            or there are more than MAX_IMPORT_RECORDS.
+        """
+        records: List[AlarmRecord] = []
+        error: Optional[ValueError] = None
+        payload = recv_frame(conn)
+        while payload is not None:
+            if error is None:
+                try:
+                    records.extend(decode_records(payload))
+                    if len(records) > MAX_IMPORT_RECORDS:
+                        raise ValueError(
+                            f"Can't import more than {MAX_IMPORT_RECORDS} alarms"
+                        )
+                except ValueError as err:
+                    error = err
+                    records = []
+            payload = recv_frame(conn)
+        if error is not None:
+            raise error
+        return records
+
+    def answer(self, payload: bytes, uid: Optional[int], streaming: bool) -> List[str]:
+        try:
+            return list(self.process(decode_request(payload), uid, streaming))
+        except ValueError as err:
+            logger.exception(err)
+            return [str(err)]
+
+    def process(
+        self,
+        request: TimeMessageSocket,
+        uid: Optional[int],
+        streaming: bool,
+    ) -> Iterable[str]:
+        parts: Iterable[str]
+        try:
+            with stats.timer("request_seconds", action=request.action.value):
+                key = profile_key(uid, request.profile)
+                manager = self.profiles.managers.get(key)
+                if manager is not None and request.action in READ_ACTIONS:
+                    # Reads use the state published by the last change,
+                    # so they never wait for writers.
+                    return self.respond(manager, request, streaming)
+                with stats.locked(schedule_changed, "server"):
+                    # Profile loaded by the request may have alarms to catch up.
+                    version = self.profiles.version
+                    manager = self.profiles.get(key)
+                    parts = self.respond(manager, request, streaming)
+                    if self.profiles.version != version:
+                        schedule_changed.notify_all()
+            return parts
+        except Exception as ex:
+            logger.exception(ex)
+            return [str(ex)]
+
+    def respond(
+        self,
+        manager: AlarmManager,
+        request: TimeMessageSocket,
+        streaming: bool,
+    ) -> Iterable[str]:
+        if streaming and request.action == RequestAction.export:
+            # Published alarms are encoded while sent.
+            return manager.export_records()
+        if streaming:
+            return list(manager.stream_message(request))
+        return [manager.process_message(request)]
+
+    def watch(
+        self,
+        conn: socket.socket,
+        request: TimeMessageSocket,
+        uid: Optional[int],
+    ) -> None:
+        try:
+            with schedule_changed:
+                version = self.profiles.version
+                manager = self.profiles.get(profile_key(uid, request.profile))
+                if self.profiles.version != version:
+                    schedule_changed.notify_all()
+        except ValueError as err:
+            send_frame(conn, str(err).encode("utf-8"))
+            send_frame(conn, b"")
+            return
+        watcher = WatchThread(manager, conn.dup(), request)
+        watcher.start()
+        self.watchers.add(watcher)
+
+
+class WatchThread(threading.Thread):
+    """
+    Sends alarms list to a subscribed client
+    every time it changes and at least once per tick.
+    """
+
+    def __init__(
+        self,
+        manager: AlarmManager,
+        conn: socket.socket,
+        request: TimeMessageSocket,
+    ):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.manager = manager
+        self.conn = conn
+        self.request = request
+
+    def run(self) -> None:
+        seen_version = -1
+        with self.conn:
+            try:
+                while True:
+                    with schedule_changed:
+                        schedule_changed.wait_for(
+                            lambda: self.manager.version != seen_version,
+                            self.request.tick,
+                        )
+                        seen_version = self.manager.version
+                    rows = self.manager.state.list_rows(
+                        self.request.full_list, self.manager.clock.now()
+                    )
+                    send_frame(self.conn, encode_info_list(rows).encode("utf-8"))
+            except OSError:
+                logger.debug("Watcher disconnected")
@@ -0,0 +1,82 @@
+from datetime import datetime, timedelta
+from typing import List, NamedTuple, Optional
+
+from alarmix.constants import CatchUp
+from alarmix.daemon.buzzer import Buzzer, BuzzerConfig
+from alarmix.daemon.clock import SimulatedClock
+from alarmix.daemon.player import Player, PlayerPool
+from alarmix.daemon.profiles import AlarmProfiles
+from alarmix.schema import When
+
+# Simulation doesn't play anything, so it has nothing to escalate
+# and nothing is late in it.
+SIMULATION_CONFIG = BuzzerConfig(
+    sounds=[],
+    escalate_after=timedelta(0),
+    catch_up=CatchUp.once,
+    catch_up_window=timedelta(0),
+)
+
+
+class SimulatedFire(NamedTuple):
+    fire_at: datetime
+    when: When
+    profile: str
+
+
+class SilentPlayers(PlayerPool):
+    """
+    Player pool of simulation, nothing is preloaded or played.
+    """
+
+    def __init__(self) -> None:
+        super().__init__(player="", sound="", preload=0)
+
+    def spawn(self, paused: bool, sound: Optional[str] = None) -> Player:
+        raise RuntimeError("Players aren't started in simulation")
+
+
+class SimulatedBuzzer(Buzzer):
+    """
+    Buzzer which records fires instead of playing them.
+    """
+
+    def __init__(
+        self, profiles: AlarmProfiles, config: BuzzerConfig = SIMULATION_CONFIG
+    ) -> None:
+        super().__init__(profiles, SilentPlayers(), config)
+        self.fires: List[SimulatedFire] = []
+
+    def start_alarm(self, fire_at: datetime, when: When, profile: str) -> int:
+        self.fires.append(SimulatedFire(fire_at=fire_at, when=when, profile=profile))
+        return len(self.fires)
+
+    def mark_checked(self, now: datetime) -> None:
+        """
+        Files of the daemon are left untouched.
+        """
+
+
+def simulate(profiles: AlarmProfiles, until: datetime) -> List[SimulatedFire]:
+    """
+    Replay schedule evaluation until the given moment.
+
+    The clock jumps straight to every deadline, so nothing sleeps.
+    Profiles must use `SimulatedClock`.
+    """
+    clock = profiles.clock
+    if not isinstance(clock, SimulatedClock):
+        raise ValueError("Simulation requires SimulatedClock")
+    buzzer = SimulatedBuzzer(profiles)
+    while True:
+        deadline = profiles.scheduler.next_deadline()
+        if deadline is None or deadline > until:
+            break
+        clock.set(max(deadline, clock.now()))
+        buzzer.fire_due_alarms()
+        profiles.cleanup()
+    clock.set(until)
+    profiles.cleanup()
+    # Simulation never sleeps on the wall timer.
+    buzzer.wall_timer.close()
+    return buzzer.fires
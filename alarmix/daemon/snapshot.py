@@ -0,0 +1,156 @@
+"""
+Compact on-disk format of alarms.
+
+Snapshot starts with a header: magic bytes, format version,
+record size and number of records. Every record has the same size:
+
+    kind, when, minute of the day, date ordinal,
+    until ordinal, interval, weekdays mask, second.
+
+Date is 0 for alarms without date. Custom alarms keep
+the first day of their recurrence rule in the date field,
+the last day (0 if endless), interval and weekdays in the fields
+before the second. Version 1 didn't have custom alarms.
+"""
+import mmap
+import os
+import struct
+from collections import defaultdict
+from datetime import date, datetime, time
+from typing import AbstractSet, DefaultDict, Iterable, Mapping, NamedTuple, Set, Tuple
+
+from alarmix.constants import WHEN_CODES, WHEN_INDEX
+from alarmix.exceptions import SnapshotCorrupted
+from alarmix.recurrence import ALL_WEEKDAYS, NO_END, AlarmTarget, Recurrence, RuleAlarm
+from alarmix.schema import When
+
+# Alarm rule, alarm time and the day it was cancelled for.
+CancelKey = Tuple[When, time, date]
+Alarms = DefaultDict[str, Set[AlarmTarget]]
+
+SNAPSHOT_MAGIC = b"ALMS"
+SNAPSHOT_VERSION = 2
+# Versions with the same records layout.
+READABLE_VERSIONS = (1, SNAPSHOT_VERSION)
+HEADER = struct.Struct("<4sHHI")
+RECORD = struct.Struct("<BBHIIHBB")
+
+KIND_ALARM = 0
+KIND_CANCEL = 1
+# First byte of pickle protocol 2 and newer.
+PICKLE_MARKER = b"\x80"
+
+
+class PendingSnapshot(NamedTuple):
+    """
+    Alarms published while nobody changes them.
+    They're never changed, so snapshot is encoded
+    and written without holding the lock.
+    """
+
+    # Snapshots are numbered, so an older one never replaces a newer one.
+    generation: int
+    alarms: Mapping[str, AbstractSet[AlarmTarget]]
+    canceled: AbstractSet[CancelKey]
+
+
+def pack_record(kind: int, when: When, event_time: time, day: int) -> bytes:
+    minute = event_time.hour * 60 + event_time.minute
+    return RECORD.pack(kind, WHEN_INDEX[when], minute, day, 0, 0, 0, event_time.second)
+
+
+def pack_rule_record(alarm: RuleAlarm) -> bytes:
+    minute = alarm.time.hour * 60 + alarm.time.minute
+    rule = alarm.rule
+    until = 0 if rule.until == NO_END else rule.until.toordinal()
+    return RECORD.pack(
+        KIND_ALARM,
+        WHEN_INDEX[When.custom],
+        minute,
+        rule.start.toordinal(),
+        until,
+        rule.interval,
+        rule.weekdays,
+        alarm.time.second,
+    )
+
+
+def encode_snapshot(
+    alarms: Mapping[str, Iterable[AlarmTarget]],
+    canceled: Iterable[CancelKey],
+) -> bytes:
+    records = []
+    for when_key, targets in alarms.items():
+        when = When(when_key)
+        for target in targets:
+            if isinstance(target, RuleAlarm):
+                records.append(pack_rule_record(target))
+            elif isinstance(target, datetime):
+                day = target.toordinal()
+                records.append(pack_record(KIND_ALARM, when, target.time(), day))
+            else:
+                records.append(pack_record(KIND_ALARM, when, target, 0))
+    for when, event_time, canceled_day in canceled:
+        day = canceled_day.toordinal()
+        records.append(pack_record(KIND_CANCEL, when, event_time, day))
+    header = HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, RECORD.size, len(records))
+    return header + b"".join(records)
+
+
+def decode_snapshot(path: str, buffer: memoryview) -> Tuple[Alarms, Set[CancelKey]]:
+    if len(buffer) < HEADER.size:
+        raise SnapshotCorrupted(path, "file is too short")
+    magic, version, record_size, count = HEADER.unpack_from(buffer)
+    if magic != SNAPSHOT_MAGIC:
+        raise SnapshotCorrupted(path, "unknown file format")
+    if version not in READABLE_VERSIONS or record_size != RECORD.size:
+        raise SnapshotCorrupted(path, f"unsupported version {version}")
+    if len(buffer) != HEADER.size + count * RECORD.size:
+        raise SnapshotCorrupted(path, "file size doesn't match records count")
+    alarms: Alarms = defaultdict(set)
+    canceled: Set[CancelKey] = set()
+    records = RECORD.iter_unpack(buffer[HEADER.size :])
+    for kind, when_code, minute, day, until, interval, weekdays, second in records:
+        if when_code >= len(WHEN_CODES) or minute >= 24 * 60 or second >= 60:
+            raise SnapshotCorrupted(path, "record is out of range")
+        if kind == KIND_CANCEL and not day:
+            raise SnapshotCorrupted(path, "cancellation without date")
+        when = WHEN_CODES[when_code]
+        event_time = time(minute // 60, minute % 60, second)
+        if kind == KIND_CANCEL:
+            canceled.add((when, event_time, date.fromordinal(day)))
+        elif when == When.custom:
+            if not day or not interval or not 0 < weekdays <= ALL_WEEKDAYS:
+                raise SnapshotCorrupted(path, "recurrence rule is out of range")
+            rule = Recurrence(
+                weekdays,
+                interval,
+                date.fromordinal(day),
+                date.fromordinal(until) if until else NO_END,
+            )
+            alarms[when.value].add(RuleAlarm(event_time, rule))
+        elif day:
+            alarms[when.value].add(datetime.combine(date.fromordinal(day), event_time))
+        else:
+            alarms[when.value].add(event_time)
+    return alarms, canceled
+
+
+def read_snapshot(path: str) -> Tuple[Alarms, Set[CancelKey]]:
+    """
+    Load alarms from snapshot file mapped into memory.
+    """
+    with open(path, "rb") as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            raise SnapshotCorrupted(path, "file is empty")
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            with memoryview(mapped) as buffer:
+                return decode_snapshot(path, buffer)
+
+
+def is_legacy_dump(path: str) -> bool:
+    """
+    Check if file was made by older versions with pickle.
+    """
+    with open(path, "rb") as file:
+        return file.read(1) == PICKLE_MARKER
@@ -0,0 +1,120 @@
+"""
+Alarms of a profile published for readers.
+
+Writers change alarms while holding the daemon lock and publish
+a new state at the end of every change. Published state is never
+changed, so requests which only read alarms use it without the lock.
+
+Sets of alarms and list views are shared between the state
+and the writer, which copies them before changing,
+so publishing itself copies nothing.
+"""
+from datetime import datetime
+from typing import AbstractSet, Dict, Iterable, Iterator, List, Mapping, Tuple
+
+from alarmix.daemon.codec import encode_info_list, encode_records
+from alarmix.daemon.list_view import AlarmListView
+from alarmix.daemon.snapshot import CancelKey
+from alarmix.recurrence import AlarmTarget, format_recurrence
+from alarmix.schema import AlarmRow, DeltaAlarm, When
+
+# Number of alarms sent in one frame of a list reply.
+LIST_CHUNK_SIZE = 100
+
+PublishedAlarms = Mapping[str, AbstractSet[AlarmTarget]]
+
+
+class AlarmState:
+    """
+    Alarms and cancellations of a profile as of the last change.
+    """
+
+    def __init__(
+        self,
+        alarms: PublishedAlarms,
+        canceled: AbstractSet[CancelKey],
+        views: Mapping[bool, AlarmListView],
+    ) -> None:
+        self.alarms = alarms
+        self.canceled = canceled
+        self.views = views
+        # Views made by readers when published ones are outdated, e.g. at midnight.
+        self.rebuilt: Dict[bool, AlarmListView] = {}
+        # Encoded list replies by full_list flag with the second they were made at.
+        # Remaining time is shown in whole seconds,
+        # so it doesn't change within one second.
+        self.replies: Dict[bool, Tuple[datetime, List[str]]] = {}
+
+    def list_alarms(self, all_alarms: bool, now: datetime) -> List[DeltaAlarm]:
+        """
+        List alarms sorted by time.
+
+        Concurrent readers may rebuild the same view,
+        the last one is kept and all of them are equal.
+        """
+        today = now.date()
+        view = self.views[all_alarms]
+        if view.day != today:
+            view = self.rebuilt.get(all_alarms) or view
+        if view.day != today:
+            view = AlarmListView(all_alarms)
+            view.rebuild(self.alarms, today)
+            self.rebuilt[all_alarms] = view
+        return view.read(now)
+
+    def list_rows(self, all_alarms: bool, now: datetime) -> List[AlarmRow]:
+        return alarm_rows(self.list_alarms(all_alarms, now), self.canceled, now)
+
+    def list_reply(self, all_alarms: bool, now: datetime) -> List[str]:
+        """
+        Encoded parts of list reply.
+        Repeated requests made within the same second reuse them.
+        """
+        second = now.replace(microsecond=0)
+        cached = self.replies.get(all_alarms)
+        if cached is not None and cached[0] == second:
+            return cached[1]
+        rows = self.list_rows(all_alarms, now)
+        parts = [
+            encode_info_list(rows[start : start + LIST_CHUNK_SIZE])
+            for start in range(0, max(len(rows), 1), LIST_CHUNK_SIZE)
+        ]
+        self.replies[all_alarms] = (second, parts)
+        return parts
+
+    def export_records(self) -> Iterator[str]:
+        """
+        Alarms encoded to JSON lines chunk by chunk while the reply is sent.
+        """
+        return encode_records(
+            (When(when), target)
+            for when, targets in self.alarms.items()
+            for target in targets
+        )
+
+
+def alarm_rows(
+    alarms: Iterable[DeltaAlarm],
+    canceled: AbstractSet[CancelKey],
+    now: datetime,
+) -> List[AlarmRow]:
+    """
+    Information about alarms sorted by time.
+    """
+    today = now.date()
+    rows = []
+    for alarm in alarms:
+        when_str = alarm.when.value
+        if alarm.when == When.auto:
+            when_str = str((now + alarm.delta).date())
+        elif alarm.rule is not None:
+            when_str = format_recurrence(alarm.rule)
+        rows.append(
+            AlarmRow(
+                alarm.time,
+                str(alarm.delta).split(".")[0],
+                when_str,
+                (alarm.when, alarm.time, today) in canceled,
+            )
+        )
+    return rows
@@ -0,0 +1,185 @@
+import bisect
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+from time import monotonic, perf_counter, sleep
+from typing import Any, ContextManager, Dict, Iterator, Tuple
+
+from loguru import logger
+
+# Upper bounds of histogram buckets in seconds.
+BUCKETS = (
+    0.00001,
+    0.000025,
+    0.00005,
+    0.0001,
+    0.00025,
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+)
+METRICS_PREFIX = "alarmd_"
+# How often metrics file is rewritten.
+METRICS_INTERVAL = 15.0
+
+# Metric name and sorted label pairs.
+MetricKey = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+
+class Histogram:
+    """
+    Histogram of durations with fixed buckets.
+    """
+
+    def __init__(self) -> None:
+        self.buckets = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        self.buckets[bisect.bisect_left(BUCKETS, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, fraction: float) -> float:
+        """
+        Upper bound of the bucket holding the quantile.
+        """
+        rank = fraction * self.count
+        seen = 0
+        for index, bucket_count in enumerate(self.buckets):
+            seen += bucket_count
+            if seen >= rank and bucket_count:
+                if index == len(BUCKETS):
+                    return self.max
+                return min(BUCKETS[index], self.max)
+        return 0.0
+
+
+class DaemonStats:
+    """
+    Registry of all histograms collected by daemon.
+    """
+
+    def __init__(self) -> None:
+        self.histograms: Dict[MetricKey, Histogram] = {}
+        self.lock = threading.Lock()
+        self.started = monotonic()
+
+    def observe(self, name: str, value: float, **labels: str) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    @contextmanager
+    def timer(self, name: str, **labels: str) -> Iterator[None]:
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, perf_counter() - start, **labels)
+
+    @contextmanager
+    def locked(self, lock: ContextManager[Any], holder: str) -> Iterator[None]:
+        """
+        Acquire the lock and measure how long it was awaited and held.
+        """
+        start = perf_counter()
+        with lock:
+            acquired = perf_counter()
+            self.observe("lock_wait_seconds", acquired - start, holder=holder)
+            try:
+                yield
+            finally:
+                hold = perf_counter() - acquired
+                self.observe("lock_hold_seconds", hold, holder=holder)
+
+    def summary(self) -> Dict[str, Any]:
+        with self.lock:
+            histograms = [
+                {
+                    "name": name,
+                    "labels": dict(labels),
+                    "count": histogram.count,
+                    "sum": histogram.sum,
+                    "max": histogram.max,
+                    "p50": histogram.quantile(0.5),
+                    "p99": histogram.quantile(0.99),
+                }
+                for (name, labels), histogram in sorted(self.histograms.items())
+            ]
+        return {"uptime": monotonic() - self.started, "histograms": histograms}
+
+    def to_prometheus(self) -> str:
+        uptime = f"{METRICS_PREFIX}uptime_seconds"
+        lines = [f"# TYPE {uptime} gauge", f"{uptime} {monotonic() - self.started}"]
+        previous = None
+        with self.lock:
+            for (name, labels), histogram in sorted(self.histograms.items()):
+                metric = f"{METRICS_PREFIX}{name}"
+                if name != previous:
+                    lines.append(f"# TYPE {metric} histogram")
+                    previous = name
+                label_str = ",".join(f'{key}="{value}"' for key, value in labels)
+                cumulative = 0
+                for bound, bucket_count in zip(BUCKETS, histogram.buckets):
+                    cumulative += bucket_count
+                    bucket_labels = ",".join(filter(None, [label_str, f'le="{bound}"']))
+                    lines.append(f"{metric}_bucket{{{bucket_labels}}} {cumulative}")
+                inf_labels = ",".join(filter(None, [label_str, 'le="+Inf"']))
+                lines.append(f"{metric}_bucket{{{inf_labels}}} {histogram.count}")
+                lines.append(f"{metric}_sum{{{label_str}}} {histogram.sum}")
+                lines.append(f"{metric}_count{{{label_str}}} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def dump_prometheus(self, path: str) -> None:
+        """
+        Atomically write metrics in Prometheus text format.
+        """
+        metrics_dir = os.path.dirname(os.path.abspath(path))
+        fd, tmp_path = tempfile.mkstemp(dir=metrics_dir, prefix=".alarmd-metrics-")
+        with os.fdopen(fd, "w") as file:
+            file.write(self.to_prometheus())
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+
+
+class MetricsThread(threading.Thread):
+    """
+    Periodically writes metrics file for Prometheus textfile collectors.
+    """
+
+    def __init__(self, path: str):
+        threading.Thread.__init__(self)
+        self.path = path
+
+    def run(self) -> None:
+        logger.debug("Started metrics thread.")
+        while True:
+            sleep(METRICS_INTERVAL)
+            try:
+                stats.dump_prometheus(self.path)
+            except OSError as err:
+                logger.warning(f"Can't write metrics: {err}")
+
+
+stats = DaemonStats()
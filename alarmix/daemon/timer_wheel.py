@@ -0,0 +1,169 @@
+"""
+Hierarchical timer wheel for short-lived timers, e.g. snoozes.
+
+Time is split into ticks. Level 0 has a slot for every tick
+of the current block of SLOTS ticks, every next level has a slot
+for every block of the level below. Timer is put into the lowest level
+whose block holds its deadline, and timers of a slot are moved
+to lower levels when the wheel reaches it. So timers are added
+and cancelled in O(1) whatever number of them is pending.
+"""
+import math
+from datetime import datetime, timedelta
+from typing import Any, List, Optional, Set
+
+BITS = 6
+SLOTS = 1 << BITS
+MASK = SLOTS - 1
+# Four levels cover 2 ** 24 ticks, farther timers wait in overflow.
+LEVELS = 4
+TICK = timedelta(seconds=1)
+
+
+class Timer:
+    __slots__ = ("deadline", "payload", "bucket", "level")
+
+    def __init__(self, deadline: int, payload: Any) -> None:
+        self.deadline = deadline
+        self.payload = payload
+        # Slot the timer is stored in, None once it fired or was cancelled.
+        self.bucket: Optional[Set["Timer"]] = None
+        # -1 for timers which are out of levels.
+        self.level = -1
+
+
+class TimerWheel:
+    def __init__(self, origin: datetime, tick: timedelta = TICK) -> None:
+        self.origin = origin
+        self.tick = tick
+        # The first tick which isn't processed yet.
+        self.current = self.to_tick(origin)
+        self.wheels: List[List[Set[Timer]]] = [
+            [set() for _ in range(SLOTS)] for _ in range(LEVELS)
+        ]
+        self.counts = [0] * LEVELS
+        self.overflow: Set[Timer] = set()
+        # Timers added after their tick was processed.
+        self.due: Set[Timer] = set()
+
+    def __len__(self) -> int:
+        return sum(self.counts) + len(self.overflow) + len(self.due)
+
+    def to_tick(self, moment: datetime) -> int:
+        return math.floor((moment - self.origin) / self.tick)
+
+    def to_datetime(self, tick: int) -> datetime:
+        return self.origin + tick * self.tick
+
+    def shift(self, delta: timedelta) -> None:
+        """
+        Move all timers by delta, e.g. after the wall clock was set back.
+        """
+        self.origin += delta
+
+    def schedule(self, deadline: datetime, payload: Any) -> Timer:
+        """
+        Add timer which fires once the deadline has come.
+        """
+        # Rounded up, so timers never fire early.
+        timer = Timer(math.ceil((deadline - self.origin) / self.tick), payload)
+        self.place(timer)
+        return timer
+
+    def cancel(self, timer: Timer) -> None:
+        if timer.bucket is None:
+            return
+        timer.bucket.discard(timer)
+        if timer.level >= 0:
+            self.counts[timer.level] -= 1
+        timer.bucket = None
+
+    def place(self, timer: Timer) -> None:
+        deadline = timer.deadline
+        timer.level = -1
+        if deadline < self.current:
+            self.due.add(timer)
+            timer.bucket = self.due
+            return
+        for level in range(LEVELS):
+            shift = BITS * (level + 1)
+            if deadline >> shift == self.current >> shift:
+                bucket = self.wheels[level][deadline >> (BITS * level) & MASK]
+                self.counts[level] += 1
+                timer.level = level
+                break
+        else:
+            bucket = self.overflow
+        bucket.add(timer)
+        timer.bucket = bucket
+
+    def advance(self, now: datetime) -> List[Timer]:
+        """
+        Process ticks up to `now` and return timers which fired.
+        """
+        target = self.to_tick(now)
+        expired = list(self.due)
+        for timer in expired:
+            timer.bucket = None
+        self.due.clear()
+        while self.current <= target:
+            if not len(self):
+                self.current = target + 1
+                break
+            bucket = self.wheels[0][self.current & MASK]
+            if bucket:
+                self.counts[0] -= len(bucket)
+                for timer in bucket:
+                    timer.bucket = None
+                expired.extend(bucket)
+                bucket.clear()
+            # Skip ticks until the next slot of the lowest level with timers.
+            level = next((lvl for lvl in range(LEVELS) if self.counts[lvl]), LEVELS)
+            span = 1 << (BITS * level)
+            self.current = min((self.current | (span - 1)) + 1, target + 1)
+            if not self.current & MASK:
+                self.cascade()
+        return expired
+
+    def cascade(self) -> None:
+        """
+        Move timers of the block the wheel has just entered to lower levels.
+        Higher levels go first, since their timers may end up in lower slots.
+        """
+        top = 1
+        while top < LEVELS and not self.current >> (BITS * top) & MASK:
+            top += 1
+        if top == LEVELS:
+            timers, self.overflow = self.overflow, set()
+            for timer in timers:
+                self.place(timer)
+            top -= 1
+        for level in range(top, 0, -1):
+            index = self.current >> (BITS * level) & MASK
+            timers = self.wheels[level][index]
+            self.wheels[level][index] = set()
+            self.counts[level] -= len(timers)
+            for timer in timers:
+                self.place(timer)
+
+    def next_deadline(self) -> Optional[datetime]:
+        """
+        The moment wheel must be advanced at.
+
+        It's the exact deadline for the nearest timers,
+        farther ones only need the wheel to reach their slot.
+        """
+        if self.due:
+            return self.to_datetime(self.current - 1)
+        for level in range(LEVELS):
+            if not self.counts[level]:
+                continue
+            shift = BITS * level
+            first = self.current >> shift & MASK
+            for index in range(first, SLOTS):
+                if self.wheels[level][index]:
+                    block = self.current >> (shift + BITS) << (shift + BITS)
+                    return self.to_datetime(max(block | index << shift, self.current))
+        if self.overflow:
+            return self.to_datetime(min(timer.deadline for timer in self.overflow))
+        return None
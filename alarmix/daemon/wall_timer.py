@@ -0,0 +1,71 @@
+"""
+Wake-ups at wall clock moments.
+
+Engines sleep on the monotonic clock, which stands still
+while the machine is suspended and ignores changes of the wall clock.
+On Linux with Python 3.13+ a timerfd armed with TFD_TIMER_CANCEL_ON_SET
+wakes the daemon right at the deadline and as soon as
+the wall clock is set, elsewhere sleeps are capped instead.
+"""
+import errno
+import os
+import sys
+import time
+from datetime import datetime
+from typing import Optional
+
+from loguru import logger
+
+# Sleeps until deadlines are capped by this number of seconds without timerfd.
+MAX_SLEEP = 30.0
+# Timer is armed even if there is nothing to wait for,
+# since only armed timers report changes of the clock.
+IDLE_WAKEUP = 24 * 60 * 60
+# Linux value of the flag, the os module doesn't export it.
+TFD_TIMER_CANCEL_ON_SET = getattr(os, "TFD_TIMER_CANCEL_ON_SET", 1 << 1)
+
+
+class WallTimer:
+    def __init__(self) -> None:
+        self.fd: Optional[int] = None
+        if sys.version_info >= (3, 13) and sys.platform == "linux":
+            try:
+                self.fd = os.timerfd_create(time.CLOCK_REALTIME, flags=os.TFD_CLOEXEC)
+            except OSError as err:
+                logger.warning(f"Can't create timerfd, sleeps are capped: {err}")
+
+    def arm(self, deadline: Optional[datetime]) -> None:
+        """
+        Set the moment to wake up at, None waits only for clock changes.
+        """
+        moment = time.time() + IDLE_WAKEUP
+        if deadline is not None:
+            moment = deadline.timestamp()
+        if sys.version_info >= (3, 13) and sys.platform == "linux":
+            if self.fd is None:
+                return
+            flags = os.TFD_TIMER_ABSTIME | TFD_TIMER_CANCEL_ON_SET
+            # Zero disarms the timer.
+            os.timerfd_settime(self.fd, flags=flags, initial=max(moment, 1))
+
+    def wait(self) -> bool:
+        """
+        Wait for the deadline and tell if the wall clock was set.
+        Non-blocking timers return at once if nothing happened.
+        """
+        if self.fd is None:
+            raise RuntimeError("timerfd isn't available")
+        try:
+            os.read(self.fd, 8)
+        except BlockingIOError:
+            return False
+        except OSError as err:
+            if err.errno == errno.ECANCELED:
+                return True
+            raise
+        return False
+
+    def close(self) -> None:
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
@@ -1,3 +1,6 @@
+from datetime import datetime
+
+
 class AlarmDaemonIsNotRunning(Exception):
     ...
 
@@ -8,3 +11,36 @@ class SoundFileNotFound(Exception):
 
     def __str__(self) -> str:
         return f"Sound file '{self.sound}' was not found."
+
+
+class ProtocolError(Exception):
+    def __init__(self, reason: str):
+        self.reason = reason
+
+    def __str__(self) -> str:
+        return f"Protocol error: {self.reason}."
+
+
+class DaemonSpawnFailed(Exception):
+    def __init__(self, reason: str):
+        self.reason = reason
+
+    def __str__(self) -> str:
+        return f"Can't start alarmd: {self.reason}."
+
+
+class AlarmInPast(ValueError):
+    def __init__(self, target: datetime):
+        self.target = target
+
+    def __str__(self) -> str:
+        return f"Alarm {self.target} is in the past"
+
+
+class SnapshotCorrupted(Exception):
+    def __init__(self, path: str, reason: str):
+        self.path = path
+        self.reason = reason
+
+    def __str__(self) -> str:
+        return f"Alarms snapshot '{self.path}' is corrupted: {self.reason}."
@@ -0,0 +1,92 @@
+"""
+Framed protocol between alarmc and alarmd.
+
+Client starts with a handshake: magic bytes and the highest protocol
+version it speaks. Daemon answers with the same header holding
+the version they agreed on. Then the client sends one request frame
+and reads reply frames until the empty one. Import requests
+are followed by frames of alarm records ending with the empty one.
+
+Every frame is a 4-byte big-endian length followed by the payload.
+Clients which send raw JSON without handshake are served
+with a single unframed reply as before.
+"""
+import socket
+import struct
+from typing import Optional
+
+from alarmix.exceptions import ProtocolError
+
+PROTOCOL_VERSION = 1
+MAGIC = b"ALMX"
+HANDSHAKE = struct.Struct("!4sB")
+FRAME_HEADER = struct.Struct("!I")
+# Frames bigger than this are rejected without reading them.
+MAX_FRAME_SIZE = 1024 * 1024
+# Maximum number of bytes read from a socket at once.
+RECV_CHUNK_SIZE = 64 * 1024
+# Size of a message sent by old clients without handshake.
+LEGACY_MESSAGE_SIZE = 1024
+
+
+def encode_handshake(version: int = PROTOCOL_VERSION) -> bytes:
+    return HANDSHAKE.pack(MAGIC, version)
+
+
+def parse_handshake(data: bytes) -> Optional[int]:
+    """
+    Get protocol version from the handshake.
+    None means that data was sent by an old client.
+    """
+    if len(data) != HANDSHAKE.size or not data.startswith(MAGIC):
+        return None
+    _, version = HANDSHAKE.unpack(data)
+    return min(version, PROTOCOL_VERSION)
+
+
+def encode_frame(payload: bytes) -> bytes:
+    if len(payload) > MAX_FRAME_SIZE:
+        raise ProtocolError(f"frame of {len(payload)} bytes is too big")
+    return FRAME_HEADER.pack(len(payload)) + payload
+
+
+def parse_frame_size(header: bytes) -> int:
+    (size,) = FRAME_HEADER.unpack(header)
+    if size > MAX_FRAME_SIZE:
+        raise ProtocolError(f"frame of {size} bytes is too big")
+    return size
+
+
+def recv_exactly(sock: socket.socket, size: int) -> bytes:
+    """
+    Read exactly `size` bytes from socket in bounded chunks.
+    """
+    buffer = bytearray()
+    while len(buffer) < size:
+        chunk = sock.recv(min(size - len(buffer), RECV_CHUNK_SIZE))
+        if not chunk:
+            raise ProtocolError("connection closed in the middle of a frame")
+        buffer.extend(chunk)
+    return bytes(buffer)
+
+
+def send_frame(sock: socket.socket, payload: bytes) -> None:
+    sock.sendall(encode_frame(payload))
+
+
+def recv_frame(sock: socket.socket) -> Optional[bytes]:
+    """
+    Read one frame. Returns None when the empty frame is received.
+    """
+    size = parse_frame_size(recv_exactly(sock, FRAME_HEADER.size))
+    if size == 0:
+        return None
+    return recv_exactly(sock, size)
+
+
+def client_handshake(sock: socket.socket) -> int:
+    sock.sendall(encode_handshake())
+    version = parse_handshake(recv_exactly(sock, HANDSHAKE.size))
+    if version is None:
+        raise ProtocolError("daemon doesn't support framed messages")
+    return version
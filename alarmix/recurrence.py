@@ -0,0 +1,224 @@
+"""
+Recurrence rules of custom alarms.
+
+Rule selects weekdays, rings on every `interval`-th day
+counted from its first day and stops after the `until` day.
+Rules are written as text, e.g. "mon,wed,fri",
+"every 3 days from 2026-11-01" or "weekdays until 2026-12-31".
+"""
+import bisect
+from datetime import date, datetime, time, timedelta
+from typing import Dict, List, NamedTuple, Optional, Tuple, Union
+
+WEEKDAY_NAMES = ("mon", "tue", "wed", "thu", "fri", "sat", "sun")
+ALL_WEEKDAYS = 0b1111111
+WEEKDAYS_MASK = 0b0011111
+WEEKENDS_MASK = 0b1100000
+WEEKDAY_ALIASES = {
+    "daily": ALL_WEEKDAYS,
+    "everyday": ALL_WEEKDAYS,
+    "weekdays": WEEKDAYS_MASK,
+    "weekends": WEEKENDS_MASK,
+}
+MASK_ALIASES = {WEEKDAYS_MASK: "weekdays", WEEKENDS_MASK: "weekends"}
+# Interval is stored in two bytes of snapshot records.
+MAX_INTERVAL = 0xFFFF
+# Number of upcoming days precomputed for every rule.
+PRECOMPUTED_OCCURRENCES = 16
+# Index is dropped once it holds more rules, deleted rules aren't tracked.
+MAX_INDEXED_RULES = 4096
+NO_END = date.max
+
+
+class Recurrence(NamedTuple):
+    weekdays: int = ALL_WEEKDAYS
+    interval: int = 1
+    start: date = date.min
+    until: date = NO_END
+
+    def occurs_on(self, day: date) -> bool:
+        if day < self.start or day > self.until:
+            return False
+        if not self.weekdays >> day.weekday() & 1:
+            return False
+        return (day - self.start).days % self.interval == 0
+
+    def next_day(self, after: date) -> Optional[date]:
+        """
+        First day not earlier than `after` when the rule rings.
+        None means that the rule is over.
+        """
+        day = max(after, self.start)
+        day += timedelta(days=-(day - self.start).days % self.interval)
+        # Weekdays repeat every 7 steps of the interval.
+        for _ in range(7):
+            if day > self.until:
+                return None
+            if self.weekdays >> day.weekday() & 1:
+                return day
+            day += timedelta(days=self.interval)
+        return None
+
+
+class RuleAlarm(NamedTuple):
+    """
+    Custom alarm, it's stored the same way as times of other alarms.
+    """
+
+    time: time
+    rule: Recurrence
+
+
+# Recurring alarms are times, auto alarms are dates with times.
+AlarmTarget = Union[time, datetime, RuleAlarm]
+
+
+class OccurrenceIndex:
+    """
+    Upcoming days of recurrence rules.
+
+    Every rule keeps a sorted window of the next days it rings on.
+    Lookups are binary searches in the window, passed days
+    are dropped lazily and the window is refilled when it runs out.
+    """
+
+    def __init__(self, size: int = PRECOMPUTED_OCCURRENCES) -> None:
+        self.size = size
+        # Rule -> first day covered by the window, days of the window
+        # and whether the rule is over after them.
+        self.windows: Dict[Recurrence, Tuple[date, List[date], bool]] = {}
+
+    def next_day(self, rule: Recurrence, after: date) -> Optional[date]:
+        window = self.windows.get(rule)
+        if window is None or after < window[0]:
+            window = self.fill(rule, after)
+        _, days, finished = window
+        index = bisect.bisect_left(days, after)
+        if index == len(days):
+            if finished:
+                return None
+            _, days, _ = self.fill(rule, after)
+            index = 0
+            if not days:
+                return None
+        if index:
+            del days[:index]
+            self.windows[rule] = (after, days, finished)
+        return days[0]
+
+    def fill(self, rule: Recurrence, after: date) -> Tuple[date, List[date], bool]:
+        if len(self.windows) >= MAX_INDEXED_RULES:
+            self.windows.clear()
+        days: List[date] = []
+        day = rule.next_day(after)
+        while day is not None and len(days) < self.size:
+            days.append(day)
+            day = rule.next_day(day + timedelta(days=1))
+        window = (after, days, day is None)
+        self.windows[rule] = window
+        return window
+
+
+occurrences = OccurrenceIndex()
+
+
+def next_rule_fire(alarm: RuleAlarm, after: datetime) -> Optional[datetime]:
+    """
+    Find the first moment not earlier than `after` when custom alarm rings.
+    None means that its rule is over.
+    """
+    event_time = alarm.time.replace(second=0, microsecond=0)
+    day = after.date()
+    if datetime.combine(day, event_time) < after:
+        day += timedelta(days=1)
+    fire_day = occurrences.next_day(alarm.rule, day)
+    if fire_day is None:
+        return None
+    return datetime.combine(fire_day, event_time)
+
+
+def alarm_time(target: AlarmTarget) -> time:
+    if isinstance(target, datetime):
+        return target.time()
+    if isinstance(target, RuleAlarm):
+        return target.time
+    return target
+
+
+def parse_weekdays(word: str) -> int:
+    """
+    Parse weekdays like "mon,wed", "mon-fri" or "weekends".
+    """
+    if word in WEEKDAY_ALIASES:
+        return WEEKDAY_ALIASES[word]
+    mask = 0
+    for part in word.split(","):
+        first, _, last = part.partition("-")
+        for name in (first, last or first):
+            if name not in WEEKDAY_NAMES:
+                raise ValueError(f"Unknown weekday '{name}'")
+        day = WEEKDAY_NAMES.index(first)
+        last_day = WEEKDAY_NAMES.index(last or first)
+        mask |= 1 << day
+        while day != last_day:
+            day = (day + 1) % 7
+            mask |= 1 << day
+    return mask
+
+
+def parse_recurrence(spec: str, today: Optional[date] = None) -> Recurrence:
+    """
+    Parse rule written as text.
+    Intervals are counted from today if the first day isn't set.
+
+    :raises ValueError: if rule is malformed.
+    """
+    weekdays = ALL_WEEKDAYS
+    interval = 1
+    start: Optional[date] = None
+    until = NO_END
+    words = spec.lower().split()
+    try:
+        while words:
+            word = words.pop(0)
+            if word == "every":
+                count = words.pop(0)
+                if count in ("day", "days"):
+                    continue
+                interval = int(count)
+                if words.pop(0) not in ("day", "days"):
+                    raise ValueError("Intervals are set in days")
+            elif word == "from":
+                start = date.fromisoformat(words.pop(0))
+            elif word == "until":
+                until = date.fromisoformat(words.pop(0))
+            else:
+                weekdays = parse_weekdays(word)
+    except IndexError:
+        raise ValueError(f"Rule '{spec}' is incomplete")
+    if not 1 <= interval <= MAX_INTERVAL:
+        raise ValueError(f"Interval must be from 1 to {MAX_INTERVAL} days")
+    if start is None:
+        start = (today or date.today()) if interval > 1 else date.min
+    if until < start:
+        raise ValueError(f"Rule '{spec}' ends before it starts")
+    return Recurrence(weekdays, interval, start, until)
+
+
+def format_recurrence(rule: Recurrence) -> str:
+    """
+    Write rule as text which is parsed back to the same rule.
+    """
+    parts = []
+    if rule.weekdays != ALL_WEEKDAYS:
+        names = [
+            name for day, name in enumerate(WEEKDAY_NAMES) if rule.weekdays >> day & 1
+        ]
+        parts.append(MASK_ALIASES.get(rule.weekdays, ",".join(names)))
+    if rule.interval != 1:
+        parts.append(f"every {rule.interval} days")
+    if rule.interval != 1 or rule.start != date.min:
+        parts.append(f"from {rule.start}")
+    if rule.until != NO_END:
+        parts.append(f"until {rule.until}")
+    return " ".join(parts) or "daily"
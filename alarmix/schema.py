@@ -1,54 +1,114 @@
-import enum
+import math
 from datetime import date, time, timedelta
-from typing import List, Optional
+from typing import List, NamedTuple, Optional
+
+from pydantic import BaseModel, Field, validator
+
+from alarmix.constants import (
+    MAX_SNOOZE_MINUTES,
+    MIN_WATCH_TICK,
+    SNOOZE_MINUTES,
+    RequestAction,
+    When,
+)
+from alarmix.recurrence import Recurrence
+
+
+def check_snooze_minutes(minutes: float) -> float:
+    """
+    :raises ValueError: if alarms can't be snoozed for this long.
+    """
+    # NaN fails the comparison too.
+    if not 0 < minutes <= MAX_SNOOZE_MINUTES:
+        raise ValueError(
+            "Alarms are snoozed for more than 0 "
+            f"and up to {MAX_SNOOZE_MINUTES:g} minutes"
+        )
+    return minutes
+
+
+class AlarmRecord(BaseModel):
+    """
+    Alarm of imported or exported schedule.
+    Fields have the same meaning as in TimeMessageSocket.
+    """
 
-from pydantic import BaseModel, Field
-
-
-@enum.unique
-class When(str, enum.Enum):
-    auto = "auto"
-    everyday = "everyday"
-    weekdays = "weekdays"
-    weekends = "weekends"
-
-    def __str__(self) -> str:
-        return str(self.value)
-
-
-@enum.unique
-class RequestAction(str, enum.Enum):
-    add = "add"
-    list = "list"
-    stop = "stop"
-    delete = "delete"
-    cancel = "cancel"
+    time: time
+    when: When = When.auto
+    day: Optional[date] = None
+    rule: Optional[str] = None
 
 
 class TimeMessageBase(BaseModel):
     when: When
     action: RequestAction
     full_list: bool = False
+    # Seconds between updates sent to watchers.
+    tick: float = 60
+    # Alarm set of the user, the default one is used if not set.
+    profile: Optional[str] = None
+    # Recurrence rule of custom alarms, e.g. "mon,wed,fri".
+    rule: Optional[str] = None
+    # Ringing alarms are played again after this number of minutes.
+    minutes: float = SNOOZE_MINUTES
+
+    @validator("tick")
+    def check_tick(cls, tick: float) -> float:
+        if not math.isfinite(tick) or tick < MIN_WATCH_TICK:
+            raise ValueError(f"Watch tick must be at least {MIN_WATCH_TICK:g} second")
+        return tick
+
+    @validator("minutes")
+    def check_minutes(cls, minutes: float) -> float:
+        return check_snooze_minutes(minutes)
 
 
 class TimeMessageClient(TimeMessageBase):
     time: Optional[str]
+    day: Optional[str] = None
+    operations: List["TimeMessageClient"] = []
 
 
 class TimeMessageSocket(TimeMessageBase):
     time: Optional[time]
+    # Date of auto alarm, the nearest one is used if not set.
+    day: Optional[date] = None
+    operations: List["TimeMessageSocket"] = []
+    # Imported alarms, framed clients send them in frames after the request.
+    records: List[AlarmRecord] = []
+
+
+TimeMessageClient.update_forward_refs()
+TimeMessageSocket.update_forward_refs()
 
 
-class Alarm(BaseModel):
+class Alarm(NamedTuple):
+    """
+    Alarms are created in hot loops, so they're plain tuples
+    and pydantic models are used only for socket messages.
+    """
+
     time: time
     when: When
 
-    def __hash__(self) -> int:
-        return self.time.__hash__() + self.when.__hash__()
-
 
-class DeltaAlarm(Alarm):
+class DeltaAlarm(NamedTuple):
+    time: time
+    when: When
     delta: timedelta
+    # Set only for custom alarms.
+    rule: Optional[Recurrence] = None
+
+
+class AlarmRow(NamedTuple):
+    """
+    Fields of AlarmInfo, list replies are encoded from rows without models.
+    """
+
+    time: time
+    remaining: str
+    when: str
+    canceled: bool
 
 
 class AlarmInfo(BaseModel):
@@ -63,6 +123,11 @@ class InfoList(BaseModel):
 
 
 class CanceledAlarm(BaseModel):
+    """
+    Cancellations aren't stored this way anymore,
+    the model is kept to load dumps of older versions.
+    """
+
     time: time
     canceled: date = Field(default_factory=date.today)
 
@@ -1,16 +1,31 @@
+import functools
 import os.path
 from datetime import date, datetime, time, timedelta
-from typing import Iterable, List, Optional
+from typing import Any, Iterable, List, Optional, Sequence
 
 from loguru import logger
 
-from alarmix.schema import Alarm, DeltaAlarm, When
+from alarmix.constants import WHEN_CODES, WHEN_INDEX, When
+from alarmix.schema import Alarm, DeltaAlarm
 
-SOCKET_NAME = "/tmp/timer_socket.sock"
+MINUTES_IN_DAY = 24 * 60
 
 
-def calculate_day_offset(to_when: When) -> int:
-    today = date.today().weekday()
+@functools.lru_cache(maxsize=None)
+def load_numpy() -> Any:
+    """
+    NumPy is optional, it only speeds up big schedules,
+    so it's imported on the first use to keep daemon start fast.
+    """
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+
+def calculate_day_offset(to_when: When, day: Optional[date] = None) -> int:
+    today = (day or date.today()).weekday()
     offset = 0
     if to_when == When.weekdays and today >= 5:
         offset = 7 - today
@@ -19,8 +34,12 @@ def calculate_day_offset(to_when: When) -> int:
     return offset
 
 
-def calculate_auto_time(event_time: time, day_offset: Optional[int] = None) -> datetime:
-    now = datetime.now()
+def calculate_auto_time(
+    event_time: time,
+    day_offset: Optional[int] = None,
+    now: Optional[datetime] = None,
+) -> datetime:
+    now = now or datetime.now()
     new_delta = now.replace(hour=event_time.hour, minute=event_time.minute) - now
     target = now + timedelta(seconds=new_delta.seconds)
     if day_offset:
@@ -29,17 +48,84 @@ def calculate_auto_time(event_time: time, day_offset: Optional[int] = None) -> d
     return target
 
 
-def add_delta_to_alarms(alarms_list: Iterable[Alarm]) -> List[DeltaAlarm]:
-    now = datetime.now()
-    alarms_with_delta = []
-    for alarm in alarms_list:
-        offset = calculate_day_offset(alarm.when)
-        alarm_time = calculate_auto_time(alarm.time, offset)
-        delta = alarm_time - now
-        alarms_with_delta.append(
-            DeltaAlarm(time=alarm.time, when=alarm.when, delta=delta)
+def applies_on(when: When, day: date) -> bool:
+    """
+    Check if alarms with such `when` can ring on the given day.
+    """
+    if when == When.weekdays:
+        return day.weekday() < 5
+    if when == When.weekends:
+        return day.weekday() >= 5
+    return True
+
+
+def next_fire_time(event_time: time, when: When, after: datetime) -> datetime:
+    """
+    Find the first moment not earlier than `after`
+    when the alarm should ring.
+    """
+    target = datetime.combine(after.date(), event_time.replace(second=0, microsecond=0))
+    if target < after:
+        target += timedelta(days=1)
+    while not applies_on(when, target.date()):
+        target += timedelta(days=1)
+    return target
+
+
+def next_fire_offsets(
+    minutes: Sequence[int],
+    kinds: Sequence[int],
+    now: datetime,
+) -> List[timedelta]:
+    """
+    Time left until the next fire of every alarm.
+
+    Alarms are given as minutes of the day and `WHEN_CODES` codes.
+    All offsets are computed at once with NumPy if it's installed.
+    Alarms of the current minute get small negative offsets.
+    """
+    today = now.date()
+    day_offsets = [calculate_day_offset(when, today) for when in WHEN_CODES]
+    now_minute = now.hour * 60 + now.minute
+    passed = now - now.replace(second=0, microsecond=0)
+    numpy = load_numpy()
+    if numpy is not None:
+        minutes_left = (
+            numpy.asarray(minutes, dtype=numpy.int64) - now_minute
+        ) % MINUTES_IN_DAY
+        minutes_left += (
+            numpy.asarray(day_offsets, dtype=numpy.int64)[
+                numpy.asarray(kinds, dtype=numpy.intp)
+            ]
+            * MINUTES_IN_DAY
         )
-    return alarms_with_delta
+        offsets = minutes_left.astype("timedelta64[m]") - numpy.timedelta64(
+            passed, "us"
+        )
+        return offsets.astype("timedelta64[us]").tolist()
+    minute = timedelta(minutes=1)
+    day_deltas = [timedelta(days=offset) - passed for offset in day_offsets]
+    return [
+        minute * ((alarm_minute - now_minute) % MINUTES_IN_DAY) + day_deltas[kind]
+        for alarm_minute, kind in zip(minutes, kinds)
+    ]
+
+
+def add_delta_to_alarms(
+    alarms_list: Iterable[Alarm],
+    now: Optional[datetime] = None,
+) -> List[DeltaAlarm]:
+    now = now or datetime.now()
+    alarms = list(alarms_list)
+    deltas = next_fire_offsets(
+        [alarm.time.hour * 60 + alarm.time.minute for alarm in alarms],
+        [WHEN_INDEX[When(alarm.when)] for alarm in alarms],
+        now,
+    )
+    return [
+        DeltaAlarm(time=alarm.time, when=alarm.when, delta=delta)
+        for alarm, delta in zip(alarms, deltas)
+    ]
 
 
 def remove_if_exists(filename: str) -> None:
@@ -49,18 +135,3 @@ def remove_if_exists(filename: str) -> None:
     if os.path.exists(filename):
         logger.debug(f"removing {filename}")
         os.remove(filename)
-
-
-def parse_relative_time(relative_time_str: str) -> str:
-    if relative_time_str.startswith("+"):
-        now = datetime.now().replace(second=0, microsecond=0)
-        time_values = relative_time_str.lstrip("+").split(":")
-        if len(time_values) == 2:
-            hours, minutes = time_values
-            new_time = now + timedelta(hours=int(hours), minutes=int(minutes))
-        elif len(time_values) == 1:
-            new_time = now + timedelta(minutes=int(time_values[0]))
-        else:
-            return relative_time_str
-        return f"{new_time.hour}:{new_time.minute}"
-    return relative_time_str
@@ -0,0 +1,64 @@
+"""
+Cold start budget of alarmc.
+
+Runs `python -X importtime` on the client module and fails
+if it takes longer than the budget or imports heavy modules.
+
+Usage:
+    poetry run python benchmarks/bench_client_import.py --budget-ms 50
+"""
+import subprocess
+import sys
+from argparse import ArgumentParser, Namespace
+from typing import Dict
+
+CLIENT_MODULE = "alarmix.client.main"
+# Modules which must not be imported on alarmc startup.
+FORBIDDEN_MODULES = {"pydantic", "loguru", "prettytable", "asyncio"}
+
+
+def parse_args() -> Namespace:
+    arg_parse = ArgumentParser(description="Check alarmc import time")
+    arg_parse.add_argument("--budget-ms", type=float, default=50.0)
+    arg_parse.add_argument("--repeat", type=int, default=5)
+    return arg_parse.parse_args()
+
+
+def import_times() -> Dict[str, int]:
+    """
+    Cumulative import time of every module in microseconds.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {CLIENT_MODULE}"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, module = line.split("|")
+        times[module.strip()] = int(cumulative)
+    return times
+
+
+def main() -> None:
+    args = parse_args()
+    best = None
+    for _ in range(args.repeat):
+        times = import_times()
+        client_time = times[CLIENT_MODULE] / 1000
+        best = client_time if best is None else min(best, client_time)
+    heavy = FORBIDDEN_MODULES.intersection(
+        module.split(".")[0] for module in times.keys()
+    )
+    print(f"{CLIENT_MODULE} imported in {best:.1f} ms (budget {args.budget_ms} ms)")
+    if heavy:
+        print(f"Heavy modules imported: {', '.join(sorted(heavy))}")
+    if heavy or best is None or best > args.budget_ms:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
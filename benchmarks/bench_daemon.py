@@ -0,0 +1,317 @@
+"""
+End-to-end benchmarks of alarmd.
+
+Starts alarmd in the foreground with a temporary socket, backup file
+and a fake player instead of mpv, then measures:
+    * add/list/delete requests per second with 1-64 concurrent clients;
+    * list_alarms/list_formatted latency with 10, 1k and 100k alarms;
+    * dump_alarms/load_alarms cost;
+    * how late alarms fire after their scheduled minute.
+
+Results are saved as JSON, so they can be compared across commits.
+
+Usage:
+    poetry run python benchmarks/bench_daemon.py --output results.json
+"""
+import json
+import multiprocessing
+import os
+import platform
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser, Namespace
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterator, List, Optional
+
+from bench_list import fill_manager, measure
+from loguru import logger
+
+from alarmix.client.main import make_message, request_parts
+from alarmix.constants import RequestAction, When
+from alarmix.daemon.alarm_manager import AlarmManager
+from alarmix.exceptions import AlarmDaemonIsNotRunning
+
+# Fake player writes the moment it started playing and waits to be stopped.
+# Preloaded players wait for a command on their IPC socket, like mpv does.
+FAKE_PLAYER = """#!{python}
+import socket
+import sys
+import time
+
+ipc_paths = [arg.split("=", 1)[1] for arg in sys.argv if "ipc-server=" in arg]
+if "--pause" in sys.argv and ipc_paths:
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(ipc_paths[0])
+    server.listen(1)
+    server.accept()[0].recv(1024)
+with open("{log}", "a") as log:
+    log.write(f"{{time.time()}}\\n")
+time.sleep(3600)
+"""
+THROUGHPUT_ACTIONS = [RequestAction.add, RequestAction.list, RequestAction.delete]
+STARTUP_TIMEOUT = 10.0
+# Alarms closer than this are moved to the next minute.
+FIRE_MARGIN = 5.0
+# How long to wait for the player after the scheduled minute.
+FIRE_WAIT = 3.0
+
+
+def parse_args() -> Namespace:
+    arg_parse = ArgumentParser(description="Benchmark alarmd end to end")
+    arg_parse.add_argument("--output", type=str, default="bench_daemon.json")
+    arg_parse.add_argument(
+        "--engines",
+        nargs="+",
+        choices=["threads", "asyncio"],
+        default=["threads", "asyncio"],
+    )
+    arg_parse.add_argument("--clients", nargs="+", type=int, default=[1, 4, 16, 64])
+    arg_parse.add_argument(
+        "--duration",
+        type=float,
+        default=2.0,
+        help="Seconds to send requests of every action",
+    )
+    arg_parse.add_argument("--alarms", nargs="+", type=int, default=[10, 1000, 100000])
+    arg_parse.add_argument("--repeat", type=int, default=5)
+    arg_parse.add_argument(
+        "--fires",
+        type=int,
+        default=1,
+        help="Number of alarms to wait for, every one takes up to a minute",
+    )
+    return arg_parse.parse_args()
+
+
+def request(socket_path: str, message: Dict[str, Any]) -> str:
+    return "\n".join(request_parts(socket_path, message))
+
+
+def wait_for_daemon(socket_path: str, process: "subprocess.Popen[bytes]") -> None:
+    deadline = time.monotonic() + STARTUP_TIMEOUT
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"alarmd exited with code {process.returncode}")
+        try:
+            request(socket_path, make_message(RequestAction.list))
+            return
+        except (OSError, AlarmDaemonIsNotRunning):
+            time.sleep(0.05)
+    raise RuntimeError("alarmd didn't start in time")
+
+
+@contextmanager
+def running_daemon(work_dir: str, name: str, engine: str) -> Iterator[str]:
+    """
+    Start alarmd in the foreground and yield its socket.
+    """
+    socket_path = os.path.join(work_dir, f"{name}.sock")
+    process = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "alarmix.daemon.main",
+            "--engine",
+            engine,
+            "--socket",
+            socket_path,
+            "--backup",
+            os.path.join(work_dir, f"{name}.bin"),
+            "--log-file",
+            os.path.join(work_dir, f"{name}.log"),
+            "--sound",
+            os.path.join(work_dir, "sound.mp3"),
+            "--player",
+            os.path.join(work_dir, "player"),
+        ],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        wait_for_daemon(socket_path, process)
+        yield socket_path
+    finally:
+        process.send_signal(signal.SIGINT)
+        try:
+            process.wait(STARTUP_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+
+
+def prepare_work_dir(work_dir: str) -> None:
+    """
+    Create sound file and fake player.
+    """
+    open(os.path.join(work_dir, "sound.mp3"), "wb").close()
+    player = os.path.join(work_dir, "player")
+    with open(player, "w") as file:
+        file.write(
+            FAKE_PLAYER.format(
+                python=sys.executable,
+                log=os.path.join(work_dir, "player.log"),
+            )
+        )
+    os.chmod(player, 0o755)
+
+
+def client_worker(
+    socket_path: str,
+    action: RequestAction,
+    worker: int,
+    start: float,
+    duration: float,
+) -> int:
+    """
+    Send requests until time is up and return number of answered ones.
+    """
+    time.sleep(max(start - time.time(), 0))
+    answered = 0
+    while time.time() < start + duration:
+        if action == RequestAction.list:
+            message = make_message(action)
+        else:
+            minutes = (worker * 97 + answered) % (24 * 60)
+            time_str = f"{minutes // 60}:{minutes % 60}"
+            message = make_message(action, When.everyday, time_str)
+        request(socket_path, message)
+        answered += 1
+    return answered
+
+
+def measure_throughput(
+    socket_path: str,
+    clients: int,
+    duration: float,
+) -> Dict[str, float]:
+    """
+    Requests per second of every action.
+    """
+    result = {}
+    with multiprocessing.Pool(clients) as pool:
+        for action in THROUGHPUT_ACTIONS:
+            start = time.time() + 0.5
+            answered = pool.starmap(
+                client_worker,
+                [
+                    (socket_path, action, worker, start, duration)
+                    for worker in range(clients)
+                ],
+            )
+            result[action.value] = sum(answered) / duration
+    return result
+
+
+def measure_manager(work_dir: str, alarms_count: int, repeat: int) -> Dict[str, Any]:
+    """
+    Latency of listing, dumping and loading alarms in process.
+    """
+    manager = AlarmManager(os.path.join(work_dir, f"alarms-{alarms_count}.bin"))
+    fill_manager(manager, alarms_count)
+
+    def load() -> None:
+        AlarmManager(manager.dump_file).load_alarms()
+
+    cases = {
+        "list_alarms": lambda: manager.list_alarms(),
+        "list_alarms --full": lambda: manager.list_alarms(True),
+        "list_formatted --full": lambda: manager.list_formatted(True),
+        "dump_alarms": manager.dump_alarms,
+        "load_alarms": load,
+    }
+    return {name: measure(func, repeat) for name, func in cases.items()}
+
+
+def next_fire_minute() -> datetime:
+    fire_at = datetime.now().replace(second=0, microsecond=0) + timedelta(minutes=1)
+    if (fire_at - datetime.now()).total_seconds() < FIRE_MARGIN:
+        fire_at += timedelta(minutes=1)
+    return fire_at
+
+
+def measure_fire_lateness(
+    socket_path: str,
+    player_log: str,
+    fires: int,
+) -> List[Optional[float]]:
+    """
+    Seconds between scheduled minute and start of the player.
+    None means that the alarm didn't fire at all.
+    """
+    lateness: List[Optional[float]] = []
+    for _ in range(fires):
+        if os.path.exists(player_log):
+            os.remove(player_log)
+        fire_at = next_fire_minute()
+        time_str = f"{fire_at.hour}:{fire_at.minute}"
+        request(socket_path, make_message(RequestAction.add, When.auto, time_str))
+        time.sleep((fire_at - datetime.now()).total_seconds() + FIRE_WAIT)
+        if os.path.exists(player_log):
+            with open(player_log) as file:
+                started = float(file.readline())
+            lateness.append(started - fire_at.timestamp())
+        else:
+            lateness.append(None)
+        request(socket_path, make_message(RequestAction.stop))
+        print(f"  alarm at {fire_at:%H:%M} fired {lateness[-1]} s late")
+    return lateness
+
+
+def current_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main() -> None:
+    args = parse_args()
+    logger.remove()
+    results: Dict[str, Any] = {
+        "created": datetime.now().isoformat(),
+        "commit": current_commit(),
+        "python": platform.python_version(),
+        "throughput": {},
+        "server_stats": {},
+        "manager": {},
+        "fire_lateness": {},
+    }
+    with tempfile.TemporaryDirectory() as work_dir:
+        prepare_work_dir(work_dir)
+        for engine in args.engines:
+            engine_throughput = results["throughput"][engine] = {}
+            with running_daemon(work_dir, f"throughput-{engine}", engine) as sock:
+                for clients in args.clients:
+                    rates = measure_throughput(sock, clients, args.duration)
+                    engine_throughput[str(clients)] = rates
+                    print(f"{engine} with {clients} clients: {rates}")
+                stats = request(sock, make_message(RequestAction.stats))
+                results["server_stats"][engine] = json.loads(stats)
+            if args.fires:
+                with running_daemon(work_dir, f"fire-{engine}", engine) as sock:
+                    print(f"{engine} waiting for {args.fires} alarms")
+                    results["fire_lateness"][engine] = measure_fire_lateness(
+                        sock, os.path.join(work_dir, "player.log"), args.fires
+                    )
+        for alarms_count in args.alarms:
+            results["manager"][str(alarms_count)] = measure_manager(
+                work_dir, alarms_count, args.repeat
+            )
+            print(f"{alarms_count} alarms: {results['manager'][str(alarms_count)]}")
+    with open(args.output, "w") as file:
+        json.dump(results, file, indent=2)
+    print(f"Results are saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""
+Cold start of alarmd.
+
+Measures how long `alarmix.daemon.main` takes to import
+and how long it takes from spawning alarmd until it answers
+the first request, which is what a socket-activated or
+auto-spawned daemon makes its first client wait for.
+
+Usage:
+    poetry run python benchmarks/bench_daemon_startup.py --alarms 0 1000
+"""
+import os
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser, Namespace
+from typing import List
+
+from bench_daemon import STARTUP_TIMEOUT, prepare_work_dir, request
+from bench_list import fill_manager
+from loguru import logger
+
+from alarmix.client.main import make_message
+from alarmix.constants import RequestAction
+from alarmix.daemon.alarm_manager import AlarmManager
+from alarmix.exceptions import AlarmDaemonIsNotRunning
+
+DAEMON_MODULE = "alarmix.daemon.main"
+
+
+def parse_args() -> Namespace:
+    arg_parse = ArgumentParser(description="Benchmark alarmd cold start")
+    arg_parse.add_argument(
+        "--engines",
+        nargs="+",
+        choices=["threads", "asyncio"],
+        default=["threads", "asyncio"],
+    )
+    arg_parse.add_argument("--alarms", nargs="+", type=int, default=[0, 1000])
+    arg_parse.add_argument("--repeat", type=int, default=10)
+    return arg_parse.parse_args()
+
+
+def import_time() -> float:
+    """
+    Cumulative import time of the daemon module in milliseconds.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {DAEMON_MODULE}"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    for line in result.stderr.splitlines():
+        if line.endswith(f"| {DAEMON_MODULE}"):
+            return int(line.split("|")[1]) / 1000
+    raise RuntimeError(f"{DAEMON_MODULE} wasn't imported")
+
+
+def store_alarms(backup: str, alarms_count: int) -> None:
+    manager = AlarmManager(backup)
+    if alarms_count:
+        fill_manager(manager, alarms_count)
+    manager.dump_alarms()
+
+
+def first_reply(work_dir: str, engine: str) -> float:
+    """
+    Seconds from spawning alarmd until it answers a list request.
+    """
+    socket_path = os.path.join(work_dir, "alarmd.sock")
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            DAEMON_MODULE,
+            "--engine",
+            engine,
+            "--socket",
+            socket_path,
+            "--backup",
+            os.path.join(work_dir, "alarms.bin"),
+            "--log-file",
+            os.path.join(work_dir, "alarmd.log"),
+            "--sound",
+            os.path.join(work_dir, "sound.mp3"),
+            "--player",
+            os.path.join(work_dir, "player"),
+        ],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        while time.perf_counter() - started < STARTUP_TIMEOUT:
+            if process.poll() is not None:
+                raise RuntimeError(f"alarmd exited with code {process.returncode}")
+            try:
+                request(socket_path, make_message(RequestAction.list))
+                return time.perf_counter() - started
+            except (OSError, AlarmDaemonIsNotRunning):
+                time.sleep(0.002)
+        raise RuntimeError("alarmd didn't start in time")
+    finally:
+        process.send_signal(signal.SIGINT)
+        process.wait()
+
+
+def main() -> None:
+    args = parse_args()
+    logger.remove()
+    imports = [import_time() for _ in range(args.repeat)]
+    print(f"{DAEMON_MODULE} imported in {min(imports):.1f} ms")
+    for alarms_count in args.alarms:
+        with tempfile.TemporaryDirectory() as work_dir:
+            prepare_work_dir(work_dir)
+            store_alarms(os.path.join(work_dir, "alarms.bin"), alarms_count)
+            for engine in args.engines:
+                starts: List[float] = [
+                    first_reply(work_dir, engine) for _ in range(args.repeat)
+                ]
+                print(
+                    f"{engine:<8}{alarms_count:>8} alarms"
+                    f"{min(starts) * 1000:>10.1f} ms min"
+                    f"{statistics.median(starts) * 1000:>10.1f} ms median"
+                )
+
+
+if __name__ == "__main__":
+    main()
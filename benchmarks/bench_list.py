@@ -0,0 +1,88 @@
+"""
+Latency and allocations of listing a big schedule.
+
+Usage:
+    poetry run python benchmarks/bench_list.py --alarms 10000
+"""
+import sys
+import tempfile
+import timeit
+import tracemalloc
+from argparse import ArgumentParser, Namespace
+from datetime import time
+from typing import Any, Callable, Dict
+
+from loguru import logger
+
+from alarmix.daemon.alarm_manager import AlarmManager
+from alarmix.schema import When
+
+
+def parse_args() -> Namespace:
+    arg_parse = ArgumentParser(description="Benchmark alarms listing")
+    arg_parse.add_argument("--alarms", type=int, default=10000)
+    arg_parse.add_argument("--repeat", type=int, default=20)
+    return arg_parse.parse_args()
+
+
+def fill_manager(manager: AlarmManager, alarms_count: int) -> None:
+    """
+    Add alarms with distinct times spread over the whole day.
+    """
+    step = max(24 * 60 * 60 // alarms_count, 1)
+    whens = [When.everyday, When.weekdays, When.weekends]
+    for index in range(alarms_count):
+        minutes, seconds = divmod(index * step % (24 * 60 * 60), 60)
+        event_time = time(minutes // 60, minutes % 60, seconds)
+        manager.add_alarm(event_time, whens[index % len(whens)])
+    manager.publish()
+
+
+def uncached_reply(manager: AlarmManager) -> Any:
+    manager.state.replies.clear()
+    return manager.list_reply(True)
+
+
+def measure(func: Callable[[], Any], repeat: int) -> Dict[str, float]:
+    func()
+    latency = min(timeit.repeat(func, number=1, repeat=repeat))
+    blocks_before = sys.getallocatedblocks()
+    result = func()
+    blocks = sys.getallocatedblocks() - blocks_before
+    del result
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "latency_ms": latency * 1000,
+        "allocated_blocks": blocks,
+        "peak_kib": peak / 1024,
+    }
+
+
+def main() -> None:
+    args = parse_args()
+    logger.remove()
+    with tempfile.TemporaryDirectory() as dump_dir:
+        manager = AlarmManager(f"{dump_dir}/alarms.pickle")
+        fill_manager(manager, args.alarms)
+        cases: Dict[str, Callable[[], Any]] = {
+            "list_alarms": lambda: manager.list_alarms(),
+            "list_alarms --full": lambda: manager.list_alarms(True),
+            "list_formatted --full": lambda: manager.list_formatted(True),
+            "list_reply --full": lambda: uncached_reply(manager),
+            "list_reply --full cached": lambda: manager.list_reply(True),
+        }
+        for name, func in cases.items():
+            stats = measure(func, args.repeat)
+            print(
+                f"{name:<24}"
+                f"{stats['latency_ms']:>10.2f} ms"
+                f"{stats['allocated_blocks']:>10} blocks"
+                f"{stats['peak_kib']:>10.0f} KiB peak"
+            )
+
+
+if __name__ == "__main__":
+    main()
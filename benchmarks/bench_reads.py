@@ -0,0 +1,119 @@
+"""
+Latency of reads while alarms are changed.
+
+A writer thread adds and deletes alarms under the daemon lock
+and dumps them to disk, while reader threads list alarms
+either under the same lock, like all requests once did,
+or from the state published by the writer.
+
+Usage:
+    poetry run python benchmarks/bench_reads.py --alarms 1000 --readers 4
+"""
+import statistics
+import tempfile
+import threading
+import time
+from argparse import ArgumentParser, Namespace
+from contextlib import nullcontext
+from datetime import time as alarm_time
+from typing import ContextManager, List, Tuple
+
+from bench_list import fill_manager
+from loguru import logger
+
+from alarmix.daemon import lock
+from alarmix.daemon.alarm_manager import AlarmManager
+from alarmix.schema import RequestAction, TimeMessageSocket, When
+
+
+def parse_args() -> Namespace:
+    arg_parse = ArgumentParser(description="Benchmark reads during changes")
+    arg_parse.add_argument("--alarms", type=int, default=1000)
+    arg_parse.add_argument("--readers", type=int, default=4)
+    arg_parse.add_argument("--duration", type=float, default=3.0)
+    arg_parse.add_argument("--changes-per-second", type=float, default=100)
+    # Changes made between dumps, dumps hold the lock the longest.
+    arg_parse.add_argument("--dump-every", type=int, default=20)
+    return arg_parse.parse_args()
+
+
+def writer(manager: AlarmManager, stop: threading.Event, args: Namespace) -> int:
+    add = TimeMessageSocket(
+        action=RequestAction.add, when=When.everyday, time=alarm_time(3, 33)
+    )
+    delete = TimeMessageSocket(
+        action=RequestAction.delete, when=When.everyday, time=alarm_time(3, 33)
+    )
+    changes = 0
+    while not stop.wait(1 / args.changes_per_second):
+        with lock:
+            manager.process_message(add if changes % 2 == 0 else delete)
+            changes += 1
+            if changes % args.dump_every == 0:
+                manager.dump_alarms()
+    return changes
+
+
+def reader(
+    manager: AlarmManager,
+    guard: ContextManager[object],
+    stop: threading.Event,
+    latencies: List[float],
+) -> None:
+    request = TimeMessageSocket(
+        action=RequestAction.list, when=When.auto, time=None, full_list=True
+    )
+    while not stop.is_set():
+        start = time.perf_counter()
+        with guard:
+            list(manager.stream_message(request))
+        latencies.append(time.perf_counter() - start)
+
+
+def measure(
+    manager: AlarmManager, locked: bool, args: Namespace
+) -> Tuple[List[float], int]:
+    """
+    Latencies of all reads and the number of changes made meanwhile.
+    """
+    stop = threading.Event()
+    latencies: List[float] = []
+    readers = [
+        threading.Thread(
+            target=reader,
+            args=(manager, lock if locked else nullcontext(), stop, latencies),
+        )
+        for _ in range(args.readers)
+    ]
+    for thread in readers:
+        thread.start()
+    timer = threading.Timer(args.duration, stop.set)
+    timer.start()
+    changes = writer(manager, stop, args)
+    for thread in readers:
+        thread.join()
+    return latencies, changes
+
+
+def main() -> None:
+    args = parse_args()
+    logger.remove()
+    with tempfile.TemporaryDirectory() as dump_dir:
+        manager = AlarmManager(f"{dump_dir}/alarms.bin")
+        fill_manager(manager, args.alarms)
+        for name, locked in (("locked", True), ("published", False)):
+            latencies, changes = measure(manager, locked, args)
+            latencies.sort()
+            p99 = latencies[int(len(latencies) * 0.99)]
+            print(
+                f"{name:<10}"
+                f"{changes / args.duration:>8.0f} changes/s"
+                f"{len(latencies) / args.duration:>10.0f} reads/s"
+                f"{statistics.median(latencies) * 1000:>10.3f} ms median"
+                f"{p99 * 1000:>10.3f} ms p99"
+                f"{latencies[-1] * 1000:>10.3f} ms max"
+            )
+
+
+if __name__ == "__main__":
+    main()
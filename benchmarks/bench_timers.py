@@ -0,0 +1,72 @@
+"""
+Cost of snooze timers.
+
+Measures adding and cancelling a timer while many others are pending
+and advancing the wheel through an hour of them.
+
+Usage:
+    poetry run python benchmarks/bench_timers.py --timers 100000
+"""
+import random
+import timeit
+from argparse import ArgumentParser, Namespace
+from datetime import datetime, timedelta
+
+from alarmix.daemon.timer_wheel import TimerWheel
+
+
+def parse_args() -> Namespace:
+    arg_parse = ArgumentParser(description="Benchmark snooze timers")
+    arg_parse.add_argument("--timers", type=int, default=100000)
+    arg_parse.add_argument("--repeat", type=int, default=5)
+    return arg_parse.parse_args()
+
+
+def fill_wheel(wheel: TimerWheel, timers_count: int) -> None:
+    """
+    Add timers spread over the next hour, like snoozes of many profiles.
+    """
+    for index in range(timers_count):
+        delay = timedelta(seconds=random.uniform(1, 60 * 60))
+        wheel.schedule(wheel.origin + delay, index)
+
+
+def add_and_cancel(wheel: TimerWheel) -> None:
+    timer = wheel.schedule(wheel.origin + timedelta(minutes=5), None)
+    wheel.cancel(timer)
+
+
+def advance_hour(start: datetime, timers_count: int) -> int:
+    wheel = TimerWheel(start)
+    fill_wheel(wheel, timers_count)
+    fired = 0
+    now = start
+    while len(wheel):
+        now += timedelta(seconds=1)
+        fired += len(wheel.advance(now))
+    return fired
+
+
+def main() -> None:
+    args = parse_args()
+    start = datetime.now()
+    for timers_count in (10, 1000, args.timers):
+        wheel = TimerWheel(start)
+        fill_wheel(wheel, timers_count)
+        add_cancel = min(
+            timeit.repeat(lambda: add_and_cancel(wheel), number=1000, repeat=5)
+        )
+        advance = min(
+            timeit.repeat(
+                lambda: advance_hour(start, timers_count), number=1, repeat=args.repeat
+            )
+        )
+        print(
+            f"{timers_count:>8} timers"
+            f"{add_cancel * 1000:>10.2f} us add+cancel"
+            f"{advance * 1000:>12.2f} ms hour"
+        )
+
+
+if __name__ == "__main__":
+    main()
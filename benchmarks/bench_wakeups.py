@@ -0,0 +1,143 @@
+"""
+How late alarmd wakes up at deadlines and after wall clock jumps.
+
+Deadlines are armed on the timerfd the engines sleep on,
+it needs Linux and Python 3.13+, elsewhere sleeps are capped
+by MAX_SLEEP and only that is reported.
+
+Suspends are replayed with a clock whose monotonic time stands
+still while the wall clock moves, every jump must be noticed
+and alarms skipped by it must be handled by the catch-up policy.
+
+Usage:
+    poetry run python benchmarks/bench_wakeups.py --repeat 20
+"""
+import select
+import statistics
+import tempfile
+from argparse import ArgumentParser, Namespace
+from datetime import datetime
+from datetime import time as alarm_time
+from datetime import timedelta
+from typing import List, Tuple
+
+from loguru import logger
+
+from alarmix.constants import CatchUp
+from alarmix.daemon.buzzer import BuzzerConfig
+from alarmix.daemon.clock import SimulatedClock
+from alarmix.daemon.profiles import AlarmProfiles
+from alarmix.daemon.simulation import SimulatedBuzzer
+from alarmix.daemon.wall_timer import MAX_SLEEP, WallTimer
+from alarmix.schema import When
+
+START = datetime(2026, 1, 5, 6, 50)
+ALARM = alarm_time(7, 0)
+CATCH_UP_WINDOW = timedelta(minutes=60)
+# Suspends starting at START and whether the alarm must be played after them.
+SUSPENDS = [
+    (timedelta(minutes=5), False),
+    (timedelta(minutes=15), True),
+    (timedelta(minutes=90), False),
+]
+
+
+class SuspendingClock(SimulatedClock):
+    """
+    Simulated clock whose monotonic time stands still during suspend.
+    """
+
+    def __init__(self, start: datetime) -> None:
+        super().__init__(start)
+        self.ticks = 0.0
+
+    def monotonic(self) -> float:
+        return self.ticks
+
+    def advance(self, delta: timedelta) -> None:
+        super().advance(delta)
+        self.ticks += delta.total_seconds()
+
+    def suspend(self, delta: timedelta) -> None:
+        self.current += delta
+
+
+def parse_args() -> Namespace:
+    arg_parse = ArgumentParser(description="Benchmark deadline wake-ups")
+    arg_parse.add_argument("--repeat", type=int, default=20)
+    arg_parse.add_argument("--delay", type=float, default=0.05)
+    return arg_parse.parse_args()
+
+
+def timerfd_lateness(repeat: int, delay: float) -> List[float]:
+    """
+    Seconds between armed deadlines and wake-ups of the timerfd.
+    """
+    timer = WallTimer()
+    fd = timer.fd
+    if fd is None:
+        return []
+    latencies = []
+    try:
+        for _ in range(repeat):
+            deadline = datetime.now() + timedelta(seconds=delay)
+            timer.arm(deadline)
+            readable, _, _ = select.select([fd], [], [], delay + 1)
+            woke_at = datetime.now()
+            if not readable:
+                raise RuntimeError("timerfd didn't wake up at the deadline")
+            if timer.wait():
+                raise RuntimeError("timerfd reported a clock change")
+            latencies.append((woke_at - deadline).total_seconds())
+    finally:
+        timer.close()
+    return latencies
+
+
+def replay_suspend(suspend: timedelta) -> Tuple[timedelta, int]:
+    """
+    Noticed jump and number of played alarms after the suspend.
+    """
+    clock = SuspendingClock(START)
+    config = BuzzerConfig(
+        sounds=[],
+        escalate_after=timedelta(0),
+        catch_up=CatchUp.once,
+        catch_up_window=CATCH_UP_WINDOW,
+    )
+    with tempfile.TemporaryDirectory() as dump_dir:
+        profiles = AlarmProfiles(f"{dump_dir}/alarms.bin", clock)
+        profiles.load_all()
+        profiles.get("default").add_alarm(ALARM, When.everyday)
+        buzzer = SimulatedBuzzer(profiles, config)
+        buzzer.fire_due_alarms()
+        clock.advance(timedelta(seconds=1))
+        clock.suspend(suspend)
+        jump = buzzer.clock_watch.jump()
+        buzzer.fire_due_alarms()
+        buzzer.wall_timer.close()
+    return jump, len(buzzer.fires)
+
+
+def main() -> None:
+    args = parse_args()
+    logger.remove()
+    latencies = timerfd_lateness(args.repeat, args.delay)
+    if latencies:
+        print(
+            f"timerfd deadlines{statistics.median(latencies) * 1000:>10.3f} ms median"
+            f"{max(latencies) * 1000:>10.3f} ms max late"
+        )
+    else:
+        print(f"timerfd isn't available, sleeps are capped at {MAX_SLEEP:g} s")
+    for suspend, played in SUSPENDS:
+        jump, fires = replay_suspend(suspend)
+        if jump != suspend:
+            raise RuntimeError(f"Suspend for {suspend} was noticed as {jump}")
+        if fires != int(played):
+            raise RuntimeError(f"Suspend for {suspend} played {fires} alarms")
+        print(f"suspend {str(suspend):>8} noticed as {str(jump):>8}, {fires} played")
+
+
+if __name__ == "__main__":
+    main()